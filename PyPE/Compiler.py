@@ -0,0 +1,1105 @@
+from __future__ import print_function
+
+if __package__:
+  from .PyPE import Pattern, P, I, S, R, SOL, EOL, C, Cb, Cc, Cg, Cs, Cp, Cl, \
+      Col, Cut, Sc, Sp, Sm, Ssz, V, PatternAnd, PatternOr, PatternNot, \
+      PatternRepeat, PatternUntil, PatternLookAhead, PatternFnWrap, \
+      PatternCaptureN, Match, Span, Context, BackCaptureString, DebugOptions, \
+      CompositePattern, Keywords, escapeStr, _untilSearch
+else:
+  from PyPE import Pattern, P, I, S, R, SOL, EOL, C, Cb, Cc, Cg, Cs, Cp, Cl, \
+      Col, Cut, Sc, Sp, Sm, Ssz, V, PatternAnd, PatternOr, PatternNot, \
+      PatternRepeat, PatternUntil, PatternLookAhead, PatternFnWrap, \
+      PatternCaptureN, Match, Span, Context, BackCaptureString, DebugOptions, \
+      CompositePattern, Keywords, escapeStr, _untilSearch
+
+try:
+  range = xrange
+except NameError:
+  pass
+
+# ==============================================================================
+# Instruction set
+# ==============================================================================
+#
+# Each instruction is a tuple (opcode, a, b). The meaning of 'a' and 'b' depends
+# on the opcode. Labels are indexes into the instruction list.
+#
+#   CHAR s n      Match the literal string s (of length n)
+#   ICHAR s n     Match the lower case literal s (of length n) ignoring case
+#   ANY n         Match n characters
+#   NEG n         Match the rest of the string if less than n characters remain
+#   SET chars     Match a character in chars (a frozenset or a CharClass)
+#   RANGE ranges  Match a character within one of the (low, high) ranges
+#   REGEX rx      Match the compiled regular expression rx
+#   KEYWORDS kw   Match one of the strings of the Keywords pattern kw
+#   SPAN scan n   Match the characters of the (include, exclude) lookup tables
+#                 scan (see PatternRepeat.getScanClass), at least n of them
+#   UNTIL fn ptn  Match the text up to the index fn(string, index) where the
+#                 terminator ptn is found (see PatternUntil.getSearch)
+#   TESTSET L cs  Jump to L if the next character is not in the frozenset cs
+#   SOL / EOL     Check for the start or the end of a line
+#   CUT           Commit to the choices made before the current index (see Cut).
+#                 Their choice points become lists, which are not resumed.
+#   FAIL          Fail (backtrack to the last choice point)
+#   CHOICE L      Push a choice point that resumes at L if the match fails
+#   COMMIT L      Pop the choice point and jump to L
+#   BACKCOMMIT L  Pop the choice point, restore the index and jump to L
+#   FAILTWICE     Pop the choice point and fail
+#   LOOPCOMMIT L  Update the choice point of a loop and jump to L. Exits the
+#                 loop if no input was consumed by the iteration.
+#   MARK          Push the current index
+#   PROGRESS L    Pop the index pushed by MARK and jump to L if no input was
+#                 consumed since then
+#   JMP L         Jump to L
+#   CALL L / RET  Call and return from a subroutine
+#   OPEN kind     Open a capture of the given kind
+#   CLOSE         Close a capture (C and Cg captures)
+#   CLOSEN ptn    Close a PatternCaptureN capture
+#   CLOSEFN ptn   Close a PatternFnWrap capture (calls the function)
+#   CLOSESC ptn   Close an Sc pattern (moves the captures to the stack)
+#   CLOSECB ptn   Close a Cb pattern (stores the back capture)
+#   BCSAVE        Save the number of back captures
+#   BCRESTORE     Remove the back captures added since the matching BCSAVE
+#   PRIM ptn      Match a pattern that has no sub-patterns by calling its
+#                 match function directly (stack patterns, functions, etc.)
+#   VALUE v       Add a constant capture
+#   POSITION      Capture the current index
+#   LINE          Capture the current line number
+#   COLUMN        Capture the current column
+#   ESCAPE ptn    Match the pattern with the tree interpreter (used for
+#                 patterns with debug output and unknown Pattern classes)
+#   END           The match succeeded
+# ==============================================================================
+
+OPCODES = ('CHAR', 'ICHAR', 'ANY', 'NEG', 'SET', 'RANGE', 'REGEX', 'KEYWORDS',
+           'SPAN', 'UNTIL', 'SOL', 'EOL', 'FAIL', 'TESTSET', 'CHOICE', 'COMMIT',
+           'BACKCOMMIT', 'FAILTWICE', 'LOOPCOMMIT', 'MARK', 'PROGRESS', 'JMP',
+           'CALL', 'RET', 'OPEN', 'CLOSE', 'CLOSEN', 'CLOSEFN', 'CLOSESC',
+           'CLOSECB', 'BCSAVE', 'BCRESTORE', 'VALUE', 'POSITION', 'LINE',
+           'COLUMN', 'PRIM', 'ESCAPE', 'CUT', 'END')
+
+CHAR, ICHAR, ANY, NEG, SET, RANGE, REGEX, KEYWORDS, SPAN, UNTIL, SOL_, EOL_, \
+FAIL, TESTSET, CHOICE, COMMIT, BACKCOMMIT, FAILTWICE, LOOPCOMMIT, MARK, PROGRESS, \
+JMP, CALL, RET, OPEN, CLOSE, CLOSEN, CLOSEFN, CLOSESC, CLOSECB, BCSAVE, \
+BCRESTORE, VALUE, POSITION, LINE, COLUMN, PRIM, ESCAPE, CUT, END = \
+  range(len(OPCODES))
+
+# Instructions that take a label
+LABELED = (TESTSET, CHOICE, COMMIT, BACKCOMMIT, LOOPCOMMIT, PROGRESS, JMP, CALL)
+
+# Instructions that require a Context to be tracked while matching
+CONTEXT_OPS = (ESCAPE, PRIM, CLOSEFN, CLOSESC)
+
+# Instructions that store back captures
+BACKCAPTURE_OPS = (ESCAPE, CLOSECB)
+
+# Entries in the capture log
+CAP_VALUE, CAP_LIST, CAP_OPEN, CAP_CLOSE = range(4)
+
+# Kinds of captures that are opened with the OPEN instruction
+K_C, K_CG, K_N, K_FN, K_SC, K_CB = range(6)
+
+# ==============================================================================
+
+def _isHidden(dbg):
+  """
+  Check whether a debug option only hides debug output. Patterns that hide
+  debug output behave the same as patterns with no debug option unless debugging
+  is active, in which case the whole program is run by the tree interpreter.
+  """
+  return isinstance(dbg, DebugOptions) and dbg.isHidden()
+
+# ==============================================================================
+
+def _children(pattern):
+  """
+  Get the patterns contained in a pattern. The pattern referenced by a V object
+  is not included since it is compiled as a separate subroutine.
+  """
+  if isinstance(pattern, V) or not pattern._containsPatterns(): return []
+  return [ptn for ptn in pattern.getPatterns() if ptn is not None]
+
+# ==============================================================================
+
+def _segmentStart(caps):
+  """
+  Find the position in the capture log of the last open capture that has not
+  been closed.
+  """
+  depth = 0
+  for k in range(len(caps)-1, -1, -1):
+    tag = caps[k][0]
+    if tag == CAP_CLOSE:
+      depth += 1
+    elif tag == CAP_OPEN:
+      if depth == 0: return k
+      depth -= 1
+  raise IndexError("No open capture found in the capture log")
+
+# ==============================================================================
+
+def _fold(string, caps, start=0):
+  """
+  Convert the capture log into the list of captures that the tree interpreter
+  produces for the same match.
+
+  :param string: The string that was matched.
+  :param caps: The capture log.
+  :param start: The first entry in the capture log to include.
+  :return: A list of captures.
+  """
+  out = [[]]
+  opens = []
+  for k in range(start, len(caps)):
+    entry = caps[k]
+    tag = entry[0]
+    if tag == CAP_VALUE:
+      out[-1].append(entry[1])
+    elif tag == CAP_LIST:
+      out[-1].extend(entry[1])
+    elif tag == CAP_OPEN:
+      opens.append(entry)
+      out.append([])
+    else:
+      kind, begin = opens.pop()[1:]
+      inner = out.pop()
+      if kind == K_C:
+        out[-1].append(Span(begin, entry[1]))
+        out[-1].extend(inner)
+      elif kind == K_CB:
+        out[-1].extend(inner)
+      else:
+        out[-1].append(inner)
+  return out[0]
+
+# ==============================================================================
+
+def _prune(code, stack, index):
+  """
+  Commit to the choice points on the backtrack stack that resume before the
+  index after a cut, by replacing them with lists. A failure skips lists, while
+  COMMIT and LOOPCOMMIT still find the frame. The choice point of a predicate
+  (resumed after FAILTWICE or BACKCOMMIT) ends the scan, since a predicate
+  always backtracks. The choice points below a committed one were committed
+  before.
+  """
+  for k in range(len(stack) - 1, -1, -1):
+    frame = stack[k]
+    if type(frame) is tuple:
+      if code[frame[0] - 1][0] in (FAILTWICE, BACKCOMMIT): return
+      if frame[1] < index: stack[k] = list(frame)
+    elif type(frame) is list and len(frame) > 1:
+      return
+
+# ==============================================================================
+
+def _lookupStr(lookup):
+  """
+  Format the lookup table of a character class for the program listing.
+  """
+  if isinstance(lookup, frozenset): return "'{0}'".format(escapeStr("".join(sorted(lookup))))
+  return repr(lookup)
+
+# ==============================================================================
+
+class Program(object):
+  """
+  A :class:`Pattern` compiled into a flat list of instructions. The program is
+  run by a loop with an explicit backtrack stack, which avoids the Python level
+  recursion and the per pattern bookkeeping of the tree interpreter. The
+  :class:`Match` results are the same as the results of the pattern that was
+  compiled. Since the program does not recurse, the depth of nesting in the
+  string being matched is not limited by the Python recursion limit.
+
+  Patterns with debug options (other than 'hide') and Pattern classes that are
+  unknown to the compiler are matched with the tree interpreter from within the
+  program. When debugging is active for the whole match, the tree interpreter
+  is used so that debug output is the same, and bytes-like strings are matched
+  with the tree interpreter too. Programs are normally created using
+  :func:`Pattern.compile`.
+
+  >>> from PyPE import V, match
+  >>> nested = V('nested')
+  >>> nested.setPattern('(' * nested**-1 * ')')
+  >>> match(nested, '(' * 5000 + ')' * 5000, engine='vm').end
+  10000
+  """
+
+  # ----------------------------------------------------------------------------
+
+  def __init__(self, pattern):
+    """
+    :param pattern: The pattern to compile.
+    """
+    self.pattern = pattern
+    self.code    = []
+    self._refs   = {}     # Number of references to each pattern
+    self._labels = {}     # Subroutine labels for patterns
+    self._fixups = []     # (instruction index, pattern) for CALL instructions
+    self._todo   = []     # Patterns that need to be compiled as subroutines
+    self._leaks  = {}     # Cache for patterns that leak back captures
+
+    self._countRefs(pattern)
+    self._compile(pattern)
+    self._emit(END)
+
+    while len(self._todo) > 0:
+      ptn = self._todo.pop()
+      self._labels[id(ptn)] = len(self.code)
+      self._inline(ptn)
+      self._emit(RET)
+
+    for idx, ptn in self._fixups:
+      op, dummy, b = self.code[idx]
+      self.code[idx] = (op, self._labels[id(ptn)], b)
+
+    self.usesContext = any(op in CONTEXT_OPS for op, a, b in self.code)
+    self.usesBackCaptures = any(op in BACKCAPTURE_OPS for op, a, b in self.code)
+    del self._refs, self._labels, self._fixups, self._todo, self._leaks
+
+  # ----------------------------------------------------------------------------
+
+  def _emit(self, op, a=None, b=None):
+    self.code.append((op, a, b))
+    return len(self.code) - 1
+
+  # ----------------------------------------------------------------------------
+
+  def _patch(self, idx, label=None):
+    """
+    Set the label for the instruction at the given index. The label defaults to
+    the next instruction.
+    """
+    op, a, b = self.code[idx]
+    self.code[idx] = (op, len(self.code) if label is None else label, b)
+
+  # ----------------------------------------------------------------------------
+
+  def _countRefs(self, pattern):
+    """
+    Count the number of references to each pattern. Patterns that are used more
+    than once are compiled as subroutines so that shared parts of a grammar are
+    only compiled one time.
+    """
+    todo = [pattern]
+    while len(todo) > 0:
+      ptn = todo.pop()
+      if isinstance(ptn, V) and len(ptn.patterns) > 0:
+        todo.append(ptn.patterns[0])
+        continue
+      cnt = self._refs.get(id(ptn), 0) + 1
+      self._refs[id(ptn)] = cnt
+      if cnt == 1: todo.extend(_children(ptn))
+
+  # ----------------------------------------------------------------------------
+
+  def _leaksBackCaptures(self, pattern):
+    """
+    Check whether back captures stored while matching a pattern remain after
+    the pattern returns. The tree interpreter removes the back captures stored
+    by a pattern when it returns, except for :class:`Cb` patterns and patterns
+    in a sequence of :class:`PatternAnd` patterns (which makes the back captures
+    visible to the patterns that follow in the sequence). V objects and
+    P(pattern) objects return the result of the referenced pattern.
+    """
+    key = id(pattern)
+    if key in self._leaks: return self._leaks[key]
+    self._leaks[key] = False   # Guard against recursive grammars
+
+    if isinstance(pattern, Cb):
+      leaks = pattern.pattern is not None
+    elif isinstance(pattern, V):
+      leaks = any(self._leaksBackCaptures(ptn) for ptn in pattern.patterns[:1])
+    elif isinstance(pattern, P):
+      leaks = pattern.matcher == pattern.match_ptn and self._leaksBackCaptures(pattern.ptn)
+    elif isinstance(pattern, PatternAnd) and pattern.is_sub_and:
+      leaks = any(self._leaksBackCaptures(ptn) for ptn in _children(pattern))
+    else:
+      leaks = False
+
+    self._leaks[key] = leaks
+    return leaks
+
+  # ----------------------------------------------------------------------------
+
+  def _scopesBackCaptures(self, pattern):
+    """
+    Check whether back captures must be removed when a pattern returns (i.e.,
+    the pattern is not a back capture or part of a sequence, and one of the
+    contained patterns leaks back captures).
+    """
+    if isinstance(pattern, (Cb, V, P)) or (isinstance(pattern, PatternAnd) and pattern.is_sub_and):
+      return False
+    return any(self._leaksBackCaptures(ptn) for ptn in _children(pattern))
+
+  # ----------------------------------------------------------------------------
+
+  def _mustEscape(self, pattern):
+    """
+    Check whether a pattern is matched using the tree interpreter.
+    """
+    if type(pattern) not in self.compilers: return True
+    # Left recursive V objects grow a seed in the tree interpreter
+    if isinstance(pattern, V) and pattern.isLeftRecursive() and \
+       pattern._leftRecursion == 'head':
+      return True
+    return pattern.dbg is not None and not _isHidden(pattern.dbg)
+
+  # ----------------------------------------------------------------------------
+
+  def _regex(self, pattern):
+    """
+    Get the regular expression used to match a pattern (see
+    :func:`Pattern.getRegex`), or None if the pattern is compiled to
+    instructions. Single character alternatives are compiled to a SET.
+    """
+    if not isinstance(pattern, CompositePattern) or isinstance(pattern, V): return None
+    if isinstance(pattern, PatternOr) and pattern.getCharClass() is not None: return None
+    return pattern.getRegex()
+
+  # ----------------------------------------------------------------------------
+
+  def _call(self, pattern):
+    """
+    Emit a call to the subroutine for the given pattern.
+    """
+    if id(pattern) not in self._labels:
+      self._labels[id(pattern)] = None
+      self._todo.append(pattern)
+    self._fixups.append((self._emit(CALL), pattern))
+
+  # ----------------------------------------------------------------------------
+
+  def _compile(self, pattern):
+    """
+    Compile a pattern inline, as an escape to the tree interpreter, or as a call
+    to a shared subroutine.
+    """
+    if self._mustEscape(pattern):
+      self._emit(ESCAPE, pattern)
+    elif self._regex(pattern) is not None:
+      self._emit(REGEX, self._regex(pattern))
+    elif self._refs.get(id(pattern), 0) > 1 and _children(pattern):
+      self._call(pattern)
+    else:
+      self._inline(pattern)
+
+  # ----------------------------------------------------------------------------
+
+  def _inline(self, pattern):
+    if self._mustEscape(pattern):
+      self._emit(ESCAPE, pattern)
+    elif self._regex(pattern) is not None:
+      self._emit(REGEX, self._regex(pattern))
+    elif self._scopesBackCaptures(pattern):
+      self._emit(BCSAVE)
+      self.compilers[type(pattern)](self, pattern)
+      self._emit(BCRESTORE)
+    else:
+      self.compilers[type(pattern)](self, pattern)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileP(self, ptn):
+    if ptn.matcher == ptn.match_ptn:
+      self._compile(ptn.ptn)
+    elif ptn.matcher == ptn.match_str:
+      self._emit(CHAR, ptn.string, ptn.size)
+    elif ptn.matcher == ptn.match_n:
+      if ptn.n > 0: self._emit(ANY, ptn.n)
+    elif ptn.matcher == ptn.match_neg:
+      self._emit(NEG, ptn.n)
+    elif ptn.matcher == ptn.match_TF:
+      if not ptn.TF: self._emit(FAIL)
+    else:
+      self._emit(PRIM, ptn)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileI(self, ptn):
+    self._emit(ICHAR, ptn.string, ptn.size)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileS(self, ptn):
+    self._emit(SET, ptn.chars)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileR(self, ptn):
+    if ptn.charClass is not None:
+      self._emit(SET, ptn.charClass.lookup)
+    else:
+      self._emit(RANGE, tuple((rng[0], rng[1]) for rng in ptn.ranges))
+
+  # ----------------------------------------------------------------------------
+
+  def _compileKeywords(self, ptn):
+    self._emit(KEYWORDS, ptn)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileSOL(self, ptn):
+    self._emit(SOL_)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileEOL(self, ptn):
+    self._emit(EOL_)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileCut(self, ptn):
+    self._emit(CUT)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileC(self, ptn):
+    self._emit(OPEN, K_C)
+    self._compile(ptn.pattern)
+    self._emit(CLOSE)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileCg(self, ptn):
+    self._emit(OPEN, K_CG)
+    self._compile(ptn.pattern)
+    self._emit(CLOSE)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileCb(self, ptn):
+    if ptn.pattern is None:
+      self._emit(PRIM, ptn)
+      return
+    self._emit(OPEN, K_CB)
+    self._compile(ptn.pattern)
+    self._emit(CLOSECB, ptn)
+
+  # ----------------------------------------------------------------------------
+
+  def _compilePrim(self, ptn):
+    self._emit(PRIM, ptn)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileCc(self, ptn):
+    self._emit(VALUE, ptn.value)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileCp(self, ptn):
+    self._emit(POSITION)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileCl(self, ptn):
+    self._emit(LINE)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileCol(self, ptn):
+    self._emit(COLUMN)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileSc(self, ptn):
+    self._emit(OPEN, K_SC)
+    self._compile(ptn.pattern)
+    self._emit(CLOSESC, ptn)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileV(self, ptn):
+    if len(ptn.patterns) == 0:
+      self._emit(FAIL)
+    elif self._mustEscape(ptn.patterns[0]):
+      self._emit(ESCAPE, ptn.patterns[0])
+    else:
+      self._call(ptn.patterns[0])
+
+  # ----------------------------------------------------------------------------
+
+  def _compileFnWrap(self, ptn):
+    self._emit(OPEN, K_FN)
+    self._compile(ptn.patterns[0])
+    self._emit(CLOSEFN, ptn)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileCaptureN(self, ptn):
+    self._emit(OPEN, K_N)
+    self._compile(ptn.patterns[0])
+    self._emit(CLOSEN, ptn)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileAnd(self, ptn):
+    for pattern in ptn.patterns:
+      self._compile(pattern)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileOr(self, ptn):
+    # Alternatives that match single characters become a single set
+    charClass = ptn.getCharClass()
+    if charClass is not None:
+      self._emit(SET, charClass.lookup)
+      return
+
+    # Alternatives that are literal strings are looked up in a table
+    keywords = ptn.getKeywords()
+    if keywords is not None:
+      self._emit(KEYWORDS, keywords)
+      return
+
+    # An alternative that can't start with the next character is skipped
+    # without pushing a choice point (see Pattern.getFirstSet).
+    commits = []
+    for pattern in ptn.patterns[:-1]:
+      first, nullable = pattern.getFirstSet()
+      test = self._emit(TESTSET, None, first) if first is not None and not nullable else None
+      choice = self._emit(CHOICE)
+      self._compile(pattern)
+      commits.append(self._emit(COMMIT))
+      self._patch(choice)
+      if test is not None: self._patch(test)
+    self._compile(ptn.patterns[-1])
+    for commit in commits: self._patch(commit)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileNot(self, ptn):
+    choice = self._emit(CHOICE)
+    self._compile(ptn.patterns[0])
+    self._emit(FAILTWICE)
+    self._patch(choice)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileLookAhead(self, ptn):
+    choice = self._emit(CHOICE)
+    self._compile(ptn.patterns[0])
+    commit = self._emit(BACKCOMMIT)
+    self._patch(choice)
+    self._emit(FAIL)
+    self._patch(commit)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileRepeat(self, ptn):
+    pattern = ptn.patterns[0]
+
+    # A repeated single character pattern scans the string in one instruction
+    scan = ptn.getScanClass()
+    if scan is not None and ptn.matcher == ptn.match_at_least_n:
+      self._emit(SPAN, scan, ptn.n)
+      return
+
+    body = self._call if ptn.n > 1 and _children(pattern) else self._compile
+
+    if ptn.matcher == ptn.match_n:
+      for i in range(ptn.n): body(pattern)
+
+    elif ptn.matcher == ptn.match_at_most_n:
+      choices = []
+      for i in range(ptn.n):
+        choices.append(self._emit(CHOICE))
+        body(pattern)
+        self._patch(self._emit(COMMIT))
+      for choice in choices: self._patch(choice)
+
+    else:
+      # The required matches. A match that consumes no input ends the loop.
+      progress = []
+      for i in range(ptn.n):
+        self._emit(MARK)
+        body(pattern)
+        progress.append(self._emit(PROGRESS))
+      # Any number of additional matches
+      choice = self._emit(CHOICE)
+      start = len(self.code)
+      self._compile(pattern)
+      self._emit(LOOPCOMMIT, start)
+      self._patch(choice)
+      for idx in progress: self._patch(idx)
+
+  # ----------------------------------------------------------------------------
+
+  def _compileUntil(self, ptn):
+    search = ptn.getSearch()
+    if search is None:
+      self._compileRepeat(ptn)
+    else:
+      self._emit(UNTIL, search, ptn.terminator)
+
+  # ----------------------------------------------------------------------------
+
+  compilers = {
+    P                : _compileP,
+    I                : _compileI,
+    S                : _compileS,
+    R                : _compileR,
+    Keywords         : _compileKeywords,
+    SOL              : _compileSOL,
+    EOL              : _compileEOL,
+    Cut              : _compileCut,
+    C                : _compileC,
+    Cb               : _compileCb,
+    Cg               : _compileCg,
+    Cc               : _compileCc,
+    Cs               : _compilePrim,
+    Sp               : _compilePrim,
+    Sm               : _compilePrim,
+    Ssz              : _compilePrim,
+    Cp               : _compileCp,
+    Cl               : _compileCl,
+    Col              : _compileCol,
+    Sc               : _compileSc,
+    V                : _compileV,
+    PatternFnWrap    : _compileFnWrap,
+    PatternCaptureN  : _compileCaptureN,
+    PatternAnd       : _compileAnd,
+    PatternOr        : _compileOr,
+    PatternNot       : _compileNot,
+    PatternLookAhead : _compileLookAhead,
+    PatternRepeat    : _compileRepeat,
+    PatternUntil     : _compileUntil,
+  }
+
+  # ----------------------------------------------------------------------------
+
+  def __getstate__(self):
+    """
+    The search functions of UNTIL instructions can't be pickled, so they are
+    created again from the terminators when the program is loaded.
+    """
+    state = dict(self.__dict__)
+    state['code'] = [(op, None, b) if op == UNTIL else (op, a, b) for op, a, b in self.code]
+    return state
+
+  # ----------------------------------------------------------------------------
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.code = [(op, _untilSearch(b), b) if op == UNTIL else (op, a, b) for op, a, b in self.code]
+
+  # ----------------------------------------------------------------------------
+
+  def match(self, string, index=0, context=None):
+    """
+    Match the program against the *string* starting at the given *index*.
+
+    :param string: A string to match.
+    :param index:  The location in the string to look for the given pattern.
+    :param context: Store stack information and information that is passed
+           forward during match operations.
+    :return: A :class:`Match` object if the pattern succeeds, or None if the
+             pattern fails.
+
+    >>> from PyPE import C, R
+    >>> number = C(R('09')**1)
+    >>> prog = (number * (',' * number)**0).compile()
+    >>> prog.match('1,22,333').captures
+    ['1', '22', '333']
+    >>> prog('a,b') is None
+    True
+    """
+    if not isinstance(string, BackCaptureString): string = BackCaptureString(string)
+
+    # The tree interpreter handles the debug output, bytes-like strings (the
+    # instructions compare characters of str strings) and the tracking of the
+    # position examined (see BackCaptureString.reach)
+    if context is not None and context.debug is not None or string.binary or \
+       string.reach is not None:
+      return self.pattern.match(string, index, context)
+
+    root = Context(context)
+    index = Pattern._positiveIndex(string, index)
+    sz = string.getStackSize()
+    end, caps = self._run(string, index, root)
+    if end is None:
+      string.setStackSize(sz)
+      return None
+
+    match = Match(string, index, end)
+    match.captures = _fold(string, caps)
+    match.context = root
+    root.commit()
+    return match
+
+  # ----------------------------------------------------------------------------
+
+  def _run(self, string, i, ctx):
+    """
+    Run the instructions.
+
+    :return: The end of the match and the capture log, or (None, None) if the
+             match fails.
+    """
+    code    = self.code
+    s       = string.string
+    size    = len(s)
+    usectx  = self.usesContext
+    usebc   = self.usesBackCaptures
+    buffer  = string.captureBuffer  # Used by the patterns that are called
+    nbc     = 0
+    stack   = []    # Backtrack stack
+    caps    = []    # Capture log
+    pc      = 0
+
+    while True:
+      op, a, b = code[pc]
+
+      if op == CHAR:
+        if s.startswith(a, i):
+          i += b
+          pc += 1
+          continue
+
+      elif op == SET:
+        if i < size and s[i] in a:
+          i += 1
+          pc += 1
+          continue
+
+      elif op == REGEX:
+        match = a.match(s, i)
+        if match is not None:
+          i = match.end()
+          pc += 1
+          continue
+
+      elif op == KEYWORDS:
+        end = a.lookup(s, i)
+        if end is not None:
+          i = end
+          pc += 1
+          continue
+
+      elif op == SPAN:
+        include, exclude = a
+        end = i
+        if include is None and exclude is None:
+          end = size
+        elif exclude is None:
+          while end < size and s[end] in include: end += 1
+        elif include is None:
+          while end < size and s[end] not in exclude: end += 1
+        else:
+          while end < size and s[end] in include and s[end] not in exclude: end += 1
+        if end - i >= b:
+          i = end
+          pc += 1
+          continue
+
+      elif op == UNTIL:
+        i = a(s, i)
+        pc += 1
+        continue
+
+      elif op == TESTSET:
+        pc = pc + 1 if i < size and s[i] in b else a
+        continue
+
+      elif op == CHOICE:
+        if usebc: nbc = string.getStackSize()
+        stack.append((a, i, len(caps), ctx, nbc))
+        if usectx: ctx = Context(ctx)
+        pc += 1
+        continue
+
+      elif op == COMMIT:
+        frame = stack.pop()
+        if usectx:
+          ctx.commit()
+          ctx = frame[3]
+        pc = a
+        continue
+
+      elif op == CALL:
+        stack.append(pc + 1)
+        pc = a
+        continue
+
+      elif op == RET:
+        pc = stack.pop()
+        continue
+
+      elif op == LOOPCOMMIT:
+        frame = stack[-1]
+        if usectx: ctx.commit()
+        if i == frame[1]:
+          # No progress, so the loop matches this position infinitely.
+          stack.pop()
+          if usectx: ctx = frame[3]
+          pc = frame[0]
+        else:
+          if usebc: nbc = string.getStackSize()
+          stack[-1] = (frame[0], i, len(caps), frame[3], nbc)
+          if usectx: ctx = Context(frame[3])
+          pc = a
+        continue
+
+      elif op == RANGE:
+        if i < size:
+          chr = s[i]
+          for low, high in a:
+            if low <= chr and chr <= high:
+              i += 1
+              pc += 1
+              break
+          else:
+            chr = None
+          if chr is not None: continue
+
+      elif op == ANY:
+        if size - i >= a:
+          i += a
+          pc += 1
+          continue
+
+      elif op == OPEN:
+        caps.append((CAP_OPEN, a, i))
+        pc += 1
+        continue
+
+      elif op == CLOSE:
+        caps.append((CAP_CLOSE, i))
+        pc += 1
+        continue
+
+      elif op == VALUE:
+        caps.append((CAP_VALUE, a))
+        pc += 1
+        continue
+
+      elif op == FAILTWICE:
+        stack.pop()
+
+      elif op == BACKCOMMIT:
+        frame = stack.pop()
+        i = frame[1]
+        if usectx:
+          ctx.commit()
+          ctx = frame[3]
+        pc = a
+        continue
+
+      elif op == MARK:
+        stack.append([i])
+        pc += 1
+        continue
+
+      elif op == PROGRESS:
+        pc = a if stack.pop()[0] == i else pc + 1
+        continue
+
+      elif op == JMP:
+        pc = a
+        continue
+
+      elif op == ICHAR:
+        if size - i >= b and s[i:i+b].lower() == a:
+          i += b
+          pc += 1
+          continue
+
+      elif op == NEG:
+        if size - i < a:
+          i = size
+          pc += 1
+          continue
+
+      elif op == SOL_:
+        if i == 0 or s[i-1] == '\n' or \
+           (s[i-1] == '\r' and (i == size or s[i] != '\n')):
+          pc += 1
+          continue
+
+      elif op == EOL_:
+        if i == size or s[i] == '\r' or \
+           (s[i] == '\n' and (i == 0 or s[i-1] != '\r')):
+          pc += 1
+          continue
+
+      elif op == POSITION:
+        caps.append((CAP_VALUE, i + string.offset))
+        pc += 1
+        continue
+
+      elif op == LINE:
+        caps.append((CAP_VALUE, string.getLineNumber(i)))
+        pc += 1
+        continue
+
+      elif op == COLUMN:
+        caps.append((CAP_VALUE, string.getLineOffset(i)))
+        pc += 1
+        continue
+
+      elif op == ESCAPE:
+        mark = len(buffer)
+        cut = string.cutIndex
+        match = a.match(string, i, ctx)
+        if string.cutIndex != cut: _prune(code, stack, string.cutIndex)
+        if isinstance(match, Match):
+          if match._captures: caps.append((CAP_LIST, match._captures))
+          del buffer[mark:]
+          i = match.end
+          pc += 1
+          continue
+        del buffer[mark:]
+
+      elif op == CLOSEN:
+        k = _segmentStart(caps)
+        inner = _fold(string, caps, k+1)
+        del caps[k:]
+        try:
+          caps.append((CAP_LIST, [inner[a.n]]))
+        except IndexError:
+          if a.default is not None: caps.append((CAP_LIST, [a.default]))
+        pc += 1
+        continue
+
+      elif op == CLOSEFN:
+        k = _segmentStart(caps)
+        match = Match(string, caps[k][2], i)
+        match.captures = _fold(string, caps, k+1)
+        match.context = ctx
+        del caps[k:]
+        match = a.fn(match)
+        if isinstance(match, Match):
+          if match._captures: caps.append((CAP_LIST, match._captures))
+          i = match.end
+          pc += 1
+          continue
+
+      elif op == PRIM:
+        mark = len(buffer)
+        match = type(a).match.__wrapped__(a, string, i, ctx) if type(a) is not P \
+                else a.matcher(string, i, ctx)
+        if isinstance(match, Match):
+          if match._captures: caps.append((CAP_LIST, match._captures))
+          del buffer[mark:]
+          i = match.end
+          pc += 1
+          continue
+        del buffer[mark:]
+
+      elif op == BCSAVE:
+        stack.append([string.getStackSize()])
+        pc += 1
+        continue
+
+      elif op == BCRESTORE:
+        string.setStackSize(stack.pop()[0])
+        pc += 1
+        continue
+
+      elif op == CLOSECB:
+        k = _segmentStart(caps)
+        begin = caps[k][2]
+        if a.captureIndex is None:
+          value = s[begin:i]
+        else:
+          match = Match(string, begin, i)
+          match.captures = _fold(string, caps, k+1)
+          value = match.getCapture(a.captureIndex)
+        string.addNamedCapture(a.capname, value)
+        caps.append((CAP_CLOSE, i))
+        pc += 1
+        continue
+
+      elif op == CLOSESC:
+        k = _segmentStart(caps)
+        match = Match(string, caps[k][2], i)
+        match.captures = _fold(string, caps, k+1)
+        del caps[k:]
+        if len(match) > 0: ctx.extend(a.stack, match.captures)
+        pc += 1
+        continue
+
+      elif op == CUT:
+        string.cut(i)
+        _prune(code, stack, i)
+        pc += 1
+        continue
+
+      elif op == END:
+        return i, caps
+
+      # ------------------------------------------------------------------------
+      # The match failed. Backtrack to the last choice point.
+      # ------------------------------------------------------------------------
+      while len(stack) > 0:
+        frame = stack.pop()
+        if type(frame) is tuple:
+          pc, i, ncaps, ctx, nbc = frame
+          del caps[ncaps:]
+          if usebc: string.setStackSize(nbc)
+          break
+      else:
+        return None, None
+
+  # ----------------------------------------------------------------------------
+
+  def __call__(self, string, index=0, context=None):
+    """
+    Shorthand for calling :func:`match(string[, index])`.
+    """
+    return self.match(string, index, context)
+
+  # ----------------------------------------------------------------------------
+
+  def __str__(self):
+    """
+    List the instructions in the program.
+
+    >>> from PyPE import P, S, C
+    >>> print(P('a') + S('bc')**0)
+    P('a') + S('bc')**0
+    >>> print((C('ab') + P('c')).compile())
+    0000: TESTSET 6 'a'
+    0001: CHOICE 6
+    0002: OPEN 0
+    0003: CHAR 'ab'
+    0004: CLOSE
+    0005: COMMIT 7
+    0006: CHAR 'c'
+    0007: END
+    """
+    lines = []
+    for idx, (op, a, b) in enumerate(self.code):
+      if op == TESTSET:
+        arg = " {0} '{1}'".format(a, escapeStr("".join(sorted(b))))
+      elif op in LABELED:
+        arg = " {0}".format(a)
+      elif op in (CHAR, ICHAR):
+        arg = " '{0}'".format(escapeStr(a))
+      elif op == SET:
+        arg = " {0}".format(_lookupStr(a))
+      elif op == UNTIL:
+        arg = " {0}".format(repr(b))
+      elif op == SPAN:
+        arg = " {0} {1} {2}".format(_lookupStr(a[0]), _lookupStr(a[1]), b)
+      elif op == REGEX:
+        arg = " {0}".format(repr(a.pattern))
+      elif a is not None:
+        arg = " {0}".format(repr(a))
+      else:
+        arg = ""
+      lines.append("{0:04d}: {1}{2}".format(idx, OPCODES[op], arg))
+    return "\n".join(lines)
+
+  # ----------------------------------------------------------------------------
+
+  def __repr__(self):
+    return "Program({0})".format(repr(self.pattern))
+
+# ==============================================================================
+
+if __name__ == "__main__":
+  import doctest
+  doctest.testmod()
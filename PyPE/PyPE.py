@@ -7,6 +7,12 @@ except NameError:
 
 # ==============================================================================
 
+# The empty stack. The items of a Stack are stored in a persistent linked list of
+# (size, value, next) nodes that ends with this node.
+_EMPTY_NODE = (0, None, None)
+
+# ==============================================================================
+
 class Stack(object):
   """
   This implements a stack that wraps a parent stack. Changes to the parent
@@ -14,6 +20,19 @@ class Stack(object):
   'commit' is called.
 
   This is used for Stack based captures for grammars that require context.
+
+  The items are stored in a persistent linked list, where each node holds the
+  size of the stack, the top item and the node below it. Nodes are never
+  modified, so a wrapper Stack shares the nodes of its parent: creating a
+  wrapper, dropping it when a match fails, and committing it are O(1), and the
+  size and the top items are available without walking the parent stacks.
+
+  >>> stack = Stack().extend(['a', 'b'])
+  >>> child = Stack(stack).append('c')
+  >>> child.pop(2), len(child), len(stack)
+  (['b', 'c'], 1, 2)
+  >>> child.commit() is stack, stack[0:]
+  (True, ['a'])
   """
 
   # ----------------------------------------------------------------------------
@@ -23,20 +42,8 @@ class Stack(object):
     :param parent: The parent Stack to push changes to when changes are committed.
     """
     self.parent = parent
-    self.parent_pop = 0   # Record how many values have been popped from the parent.
-    self.stack = []
-
-  # ----------------------------------------------------------------------------
-
-  def __parentlen__(self):
-    """
-    Get the virtual length of the parent stack (i.e., the length minus the number
-    of items popped from the parent Stack). Note that items popped from the
-    parent Stack are not actually removed from the Stack until 'commit' is
-    called.
-    """
-    if not self.hasParent(): return 0
-    return len(self.parent) - self.parent_pop
+    self.head = parent.head if parent is not None else _EMPTY_NODE
+    self.base = self.head  # The parent's items when the changes were started
 
   # ----------------------------------------------------------------------------
 
@@ -46,7 +53,11 @@ class Stack(object):
     :param value: The value to look for
     :return: True if the value is in the stack. Otherwise False.
     """
-    return value in self.stack or (self.hasParent() and value in self.parent)
+    node = self.head
+    while node[0] > 0:
+      if node[1] == value: return True
+      node = node[2]
+    return False
 
   # ----------------------------------------------------------------------------
 
@@ -56,7 +67,15 @@ class Stack(object):
     parent stack.
     :return: The length of the stack.
     """
-    return self.__parentlen__() + len(self.stack)
+    return self.head[0]
+
+  # ----------------------------------------------------------------------------
+
+  def __iter__(self):
+    """
+    Iterate over the items from the bottom of the stack to the top.
+    """
+    return iter(self._items())
 
   # ----------------------------------------------------------------------------
 
@@ -69,11 +88,12 @@ class Stack(object):
     :return: The requested item(s).
     """
     if isinstance(idx, slice):
-      index = lambda i, default: default if i is None else len(self)+i if i < 0 else i
+      items = self._items()
+      index = lambda i, default: default if i is None else len(items)+i if i < 0 else i
       start = index(idx.start, 0)
-      stop  = index(idx.stop,  len(self))
+      stop  = index(idx.stop,  len(items))
       step  = index(idx.step,  1)
-      return [self[i] for i in range(start, stop, step)]
+      return [items[i] for i in range(start, stop, step)]
 
     if not isinstance(idx, int): raise IndexError("Invalid stack index type")
 
@@ -81,10 +101,25 @@ class Stack(object):
     idx = self._adjustIndex(idx)
     if not self.isValidIndex(idx): raise IndexError("Invalid stack index {0}".format(idx))
 
-    parentlen = self.__parentlen__()
-    if idx < parentlen: return self.parent[idx]
-    idx = idx - parentlen
-    return self.stack[idx]
+    # Walk down from the top of the stack
+    node = self.head
+    for i in range(node[0] - 1 - idx): node = node[2]
+    return node[1]
+
+  # ----------------------------------------------------------------------------
+
+  def _items(self):
+    """
+    Get the items in the stack as a list, from the bottom of the stack to the
+    top.
+    """
+    items = []
+    node = self.head
+    while node[0] > 0:
+      items.append(node[1])
+      node = node[2]
+    items.reverse()
+    return items
 
   # ----------------------------------------------------------------------------
 
@@ -121,7 +156,7 @@ class Stack(object):
     :param value: The value to add to the Stack
     :return: The Stack object
     """
-    self.stack.append(value)
+    self.head = (self.head[0] + 1, value, self.head)
     return self
 
   # ----------------------------------------------------------------------------
@@ -132,7 +167,9 @@ class Stack(object):
     :param values: The list of values to add to the Stack
     :return: The Stack object
     """
-    self.stack.extend(values)
+    head = self.head
+    for value in values: head = (head[0] + 1, value, head)
+    self.head = head
     return self
 
   # ----------------------------------------------------------------------------
@@ -153,9 +190,8 @@ class Stack(object):
     if n == "all":
       return self.pop(len(self))
 
-    item = self.peek()
-    if len(self.stack) > 0: self.stack.pop()
-    elif self.__parentlen__() > 0: self.parent_pop += 1
+    item = self.head[1]
+    if self.head[0] > 0: self.head = self.head[2]
     return item
 
   # ----------------------------------------------------------------------------
@@ -165,10 +201,7 @@ class Stack(object):
     View the last item added to the stack
     :return: The last item added to the stack
     """
-    if len(self.stack) > 0: return self.stack[-1]
-    parentlen = self.__parentlen__()
-    if parentlen == 0: return None
-    return self.parent[parentlen-1]
+    return self.head[1]
 
   # ----------------------------------------------------------------------------
 
@@ -190,25 +223,43 @@ class Stack(object):
     :return: The parent Stack
     """
     if not self.hasParent(): return
+    parent = self.parent
 
-    for i in range(self.parent_pop): self.parent.pop()
-    self.parent.extend(self.stack)
+    if parent.head is self.base:
+      # The parent did not change, so it takes the items of this Stack
+      parent.head = self.head
+    else:
+      # Find the part of the parent's items that this Stack kept. The items
+      # above it were popped from the parent or pushed on this Stack.
+      head, base = self.head, self.base
+      pushed = []
+      while head[0] > base[0]:
+        pushed.append(head[1])
+        head = head[2]
+      while base[0] > head[0]: base = base[2]
+      while head is not base:
+        pushed.append(head[1])
+        head, base = head[2], base[2]
+      parent.pop(self.base[0] - head[0])
+      parent.extend(reversed(pushed))
 
-    # Reset the stack and
-    self.stack = []
-    self.parent_pop = 0
-    return self.parent
+    self.head = self.base = parent.head
+    return parent
 
   # ----------------------------------------------------------------------------
 
   def __str__(self):
-    return str([item for item in self])
+    return str(self._items())
 
 # ==============================================================================
 
 class Context(object):
   """
   Store context for a match. This includes any Stacks used by the match routine.
+
+  A Context shares the table of the stacks that are visible from it with its
+  parent Context until a stack is added to it, so a Context is created in O(1)
+  and a stack is found without walking the parent contexts.
   """
 
   # ----------------------------------------------------------------------------
@@ -218,17 +269,48 @@ class Context(object):
     self.stacks = {}
     self.debug = parent.debug if parent is not None else None
 
+    # The stacks that are visible from this context, and whether the table is
+    # shared with the parent context
+    self._visible = parent._visible if parent is not None else {}
+    self._shared  = parent is not None
+
   # ----------------------------------------------------------------------------
 
   def __contains__(self, stack):
-    return stack in self.stacks or (self.hasParent() and stack in self.parent)
+    return stack in self._visible
 
   # ----------------------------------------------------------------------------
 
   def __getitem__(self, stack):
-    if stack in self.stacks: return self.stacks[stack]
-    if self.hasParent() and stack in self.parent: return self.parent[stack]
-    raise IndexError("Requested stack not found ({0})".format(stack))
+    thestack = self._find(stack)
+    if thestack is None: raise IndexError("Requested stack not found ({0})".format(stack))
+    return thestack
+
+  # ----------------------------------------------------------------------------
+
+  def _find(self, stack):
+    """
+    Find a stack in this context or the closest parent context that has it.
+
+    :param stack: The name of the stack.
+    :return: The stack object, or None if it is not found.
+    """
+    return self._visible.get(stack)
+
+  # ----------------------------------------------------------------------------
+
+  def _addStack(self, stack, thestack):
+    """
+    Add a stack to this context.
+
+    :param stack: The name of the stack.
+    :param thestack: The stack object.
+    """
+    self.stacks[stack] = thestack
+    if self._shared:
+      self._visible = dict(self._visible)
+      self._shared  = False
+    self._visible[stack] = thestack
 
   # ----------------------------------------------------------------------------
 
@@ -252,12 +334,12 @@ class Context(object):
     :return: The stack object.
     """
     if stack in self.stacks: return self.stacks[stack]
+    parentStack = self._visible.get(stack)
     if wrapStack:
-      thestack = Stack(self.parent[stack]) if self.hasParent() and stack in self.parent else Stack()
-      self.stacks[stack] = thestack
+      thestack = Stack(parentStack) if parentStack is not None else Stack()
+      self._addStack(stack, thestack)
       return thestack
-    if self.hasParent() and stack in self.parent: return self.parent[stack]
-    return None
+    return parentStack
 
   # ----------------------------------------------------------------------------
 
@@ -328,12 +410,14 @@ class Context(object):
       if not thestack.hasParent():
         if stack in self.parent:
           raise IndexError("The current Context is out of sync with its parent Context - unconnected stack {0}".format(stack))
-        self.parent.stacks[stack] = thestack
+        self.parent._addStack(stack, thestack)
         continue
       thestack.commit()
 
     # Clear the stacks since they are committed.
-    self.stacks = {}
+    self.stacks   = {}
+    self._visible = self.parent._visible
+    self._shared  = True
     return self.parent
 
 # ==============================================================================
@@ -350,6 +434,8 @@ def ConfigBackCaptureString4match(fn):
   * The *match* function for the pattern is called.
   * Debug messages are printed if when debugging is active for a pattern.
   * The function cleans up back captures that are out of scope.
+  * The captures of the match are kept at the end of the capture buffer of the
+    :class:`BackCaptureString`, and the captures of a failed match are removed.
   * Results from the *match*
 
   :param fn: A :func:`match` function that takes a string and and optional index
@@ -361,8 +447,52 @@ def ConfigBackCaptureString4match(fn):
   """
 
   def match(pattern, string, index=0, context=None):
+    # Patterns that are regular expressions are matched by the re module. They
+    # have no captures, so only the end of the match is needed.
+    regex = pattern._regex if pattern._regexVersion == Pattern.grammarVersion \
+            else pattern.getRegex()
+    if regex is not None and (context is None or context.debug is None):
+      if not isinstance(string, BackCaptureString): string = BackCaptureString(string)
+      if index < 0 or context is None: index = pattern._positiveIndex(string, index)
+      if not isinstance(string.string, str):
+        regex = pattern.getBytesRegex() if string.binary else None
+      # The text examined by a regular expression is not known (see
+      # BackCaptureString.reach)
+      if string.reach is not None: regex = None
+      if regex is not None:
+        end = regex.match(string.string, index)
+        if end is None: return None
+        matchResult = Match(string, index, end.end())
+        matchResult.context = context if context is not None else Context()
+        return matchResult
+
+    # Lean patterns do not use back captures, stacks, functions or debug
+    # options. When called from another pattern without debugging or
+    # memoization, the result does not depend on the bookkeeping below.
+    if context is not None and context.debug is None and index >= 0 and \
+       isinstance(string, BackCaptureString) and string.memo is None and \
+       (pattern._lean if pattern._leanVersion == Pattern.grammarVersion else pattern.isLean()):
+      buffer = string.captureBuffer
+      mark = len(buffer)
+      matchResult = fn(pattern, string, index, context)
+      if isinstance(matchResult, Match):
+        matchResult.context = context
+        if matchResult._capSource is not string or matchResult._capStart != mark or \
+           matchResult._capEnd != len(buffer):
+          matchResult._moveCaptures(string, mark)
+        if string.reach is not None and matchResult.end > string.reach:
+          string.reach = matchResult.end
+      elif len(buffer) > mark:
+        del buffer[mark:]
+      return matchResult
+
+    # Patterns called without a context are called from outside of a pattern
+    isTopLevel = context is None
+
     if not isinstance(string, BackCaptureString): string = BackCaptureString(string)
     sz = string.getStackSize()
+    buffer = string.captureBuffer
+    mark = len(buffer)
 
     # Get the currently active debug options
     debug = context.debug if context is not None else None
@@ -378,6 +508,27 @@ def ConfigBackCaptureString4match(fn):
     # Convert negative index to positive index
     index = pattern._positiveIndex(string, index)
 
+    # Track the furthest position examined by the match, when the string
+    # tracks it. Memoized results store the position examined by the pattern.
+    memo = string.memo
+    reach = string.reach
+    if reach is not None: string.reach = index
+
+    # Reuse the result of a previous match at this index when memoizing. Results
+    # are not reused while debug output is generated.
+    if memo is not None and (not debug or isinstance(debug, DebugOptions) and debug.isHidden()) \
+       and memo.isMemoized(pattern):
+      matchResult = memo.lookup(pattern, string, index)
+      if matchResult is not MemoTable.MISS:
+        if reach is not None and reach > string.reach: string.reach = reach
+        if matchResult is not None:
+          matchResult.context = context
+          matchResult._moveCaptures(string, mark)
+          if isTopLevel: matchResult._releaseCaptures()
+        return matchResult
+    else:
+      memo = None
+
     if debug: debug.beforeMatch(pattern, string, index, context)
 
     # Get the match result and add the context to it.
@@ -386,6 +537,20 @@ def ConfigBackCaptureString4match(fn):
     if matchSucceeded:
       matchResult.context = context
 
+      # Keep the captures of the match at the end of the capture buffer, where
+      # the containing patterns expect them.
+      if matchResult._capSource is not string or matchResult._capStart != mark or \
+         matchResult._capEnd != len(buffer):
+        matchResult._moveCaptures(string, mark)
+    elif len(buffer) > mark:
+      del buffer[mark:]
+    if reach is not None:
+      end = matchResult.end if matchSucceeded else index
+      if end > string.reach: string.reach = end
+    if memo is not None: memo.store(pattern, index, matchResult,
+                                    None if reach is None else string.reach)
+    if reach is not None and reach > string.reach: string.reach = reach
+
     if debug: debug.afterMatch(pattern, string, index, context, matchResult)
 
     # Clear any nested stored callback items except when:
@@ -404,10 +569,16 @@ def ConfigBackCaptureString4match(fn):
     # Pass context result to the parent context.
     if matchSucceeded: context.commit()
 
+    # The match is returned from the outermost pattern, so the captures no
+    # longer need to be kept in the capture buffer.
+    if matchSucceeded and isTopLevel: matchResult._releaseCaptures()
+
     return matchResult
 
-  # Preserve the doc string for the original match function
+  # Preserve the doc string for the original match function. The original
+  # function is used by the compiler to match patterns without the wrapper.
   match.__doc__ = fn.__doc__
+  match.__wrapped__ = fn
   return match
 
 # ==============================================================================
@@ -427,6 +598,30 @@ def escapeStr(string):
 
 # ==============================================================================
 
+def _textAndBytes(value):
+  """
+  Get the text and the bytes of a literal. Bytes are decoded as latin-1 (one
+  character per byte), so a pattern matches the same text in str subjects and
+  in bytes-like subjects.
+
+  :param value: A string or bytes.
+  :return: A tuple (text, bytes). The bytes are None if the text has characters
+           that are not latin-1.
+
+  >>> _textAndBytes(b'GET') == (u'GET', b'GET')
+  True
+  >>> _textAndBytes(u'\u4e00')[1] is None
+  True
+  """
+  if isinstance(value, bytes) and not isinstance(value, str):
+    return value.decode('latin-1'), value
+  try:
+    return value, value.encode('latin-1')
+  except UnicodeError:
+    return value, None
+
+# ==============================================================================
+
 def ANDfilter(first, second):
   def AND(**args):
     return first(**args) and second(**args)
@@ -603,6 +798,46 @@ class DebugOptions(object):
 
   # ----------------------------------------------------------------------------
 
+  def __getstate__(self):
+    """
+    The registered filters are local functions, so they are pickled by name.
+    The default writers are pickled by name too, since Python 2 can't find
+    static methods by name.
+
+    >>> import pickle
+    >>> pickle.loads(pickle.dumps(DebugOptions('hide'))).isHidden()
+    True
+    """
+    names = dict((id(filter), name) for name, filter in DebugOptions.filters.items())
+    for name in ('printEnter', 'printMatch'): names[id(getattr(DebugOptions, name))] = name
+    return dict((key, names.get(id(value), value)) for key, value in self.__dict__.items())
+
+  # ----------------------------------------------------------------------------
+
+  def __setstate__(self, state):
+    for key, value in state.items():
+      if key.endswith('Filter') and not callable(value): value = DebugOptions.filters[value]
+      if key.endswith('Writer') and not callable(value): value = getattr(DebugOptions, value)
+      setattr(self, key, value)
+
+  # ----------------------------------------------------------------------------
+
+  def isHidden(self):
+    """
+    Indicate whether these debug options only hide the debug output (i.e., the
+    'hide' option). Patterns that hide debug output can be treated as patterns
+    without debug options when no debug output is being generated.
+
+    >>> DebugOptions('hide').isHidden()
+    True
+    >>> DebugOptions('show').isHidden()
+    False
+    """
+    hide = DebugOptions.filters['hide']
+    return self.beforeMatchFilter is hide and self.afterMatchFilter is hide
+
+  # ----------------------------------------------------------------------------
+
   def beforeMatch(self, pattern, string, index, context):
     """
     Called before a match is performed to print debug information
@@ -640,18 +875,118 @@ DebugOptions.baseFilters()
 
 # ==============================================================================
 
+class _MethodName(str):
+  """
+  The name of a method of a pickled pattern (see :func:`Pattern.__getstate__`).
+  """
+
+# ==============================================================================
+
+def _cacheVersion():
+  """
+  Get the grammar version that is stored with an analysis result cached in a
+  pattern, and count the cached result (see :func:`Pattern._changed`).
+  """
+  Pattern.analysisCount += 1
+  return Pattern.grammarVersion
+
+# ==============================================================================
+
 class Pattern(object):
   """
   Abstract base class for all parsing expression patterns.
   """
   precedence = 100
 
+  # Incremented whenever a grammar is changed in a way that affects the
+  # analysis of patterns (debug options and V objects). Analysis results
+  # that are cached in the patterns are recalculated when this changes.
+  grammarVersion = 0
+
+  # The number of analysis results that have been cached, and the number when
+  # the pattern was built (-1 if not known). A pattern built after the last
+  # result was cached is not part of a cached analysis (see _changed()).
+  analysisCount = 0
+  _builtAt      = -1
+
+  # Cached result of isLean() and the grammarVersion when it was calculated.
+  _lean        = False
+  _leanVersion = -1
+
+  # Cached result of compile() and the grammarVersion when it was compiled.
+  _program        = None
+  _programVersion = -1
+
+  # Cached result of getRegex() and the source of the regular expression, with
+  # the grammarVersion when they were calculated.
+  _regex              = None
+  _regexVersion       = -1
+  _regexSource        = None
+  _regexSourceVersion = -1
+  _bytesRegex         = None
+  _bytesRegexVersion  = -1
+
+  # Cached result of getFirstSet() and the grammarVersion when it was calculated.
+  _first        = None
+  _nullable     = True
+  _firstVersion = -1
+
+  # Cached result of getStartSearch() and the grammarVersion when it was created.
+  _startSearch        = None
+  _startSearchVersion = -1
+
+  # Cached result of the left recursion analysis ('head' for V objects that are
+  # matched by growing a seed, 'cycle' for the other patterns in a left
+  # recursive cycle, or None) and the grammarVersion when it was calculated.
+  _leftRecursion        = None
+  _leftRecursionVersion = -1
+
   # ----------------------------------------------------------------------------
 
   def __init__(self):
     self.dbg  = None
     self.name = None
-    pass
+    self._builtAt = Pattern.analysisCount
+
+  # ----------------------------------------------------------------------------
+
+  def __getstate__(self):
+    """
+    Pickle the pattern with the cached analyses that are up to date, so that
+    a loaded grammar does not need to be analyzed and compiled again. Cached
+    search functions can't be pickled, so they are created again when needed.
+    The methods of the pattern (such as the matcher) are stored by name, since
+    Python 2 can't pickle them.
+
+    >>> import pickle
+    >>> expr = V('expr')
+    >>> expr.setPattern('(' * expr**0 * ')')
+    >>> first = expr.getFirstSet()
+    >>> loaded = pickle.loads(pickle.dumps(expr))
+    >>> loaded._firstVersion == Pattern.grammarVersion, loaded.match('(()())').end
+    (True, 6)
+    """
+    state = dict(self.__dict__)
+    for key in ('_startSearch', '_startSearchVersion', '_search', '_searchVersion',
+                '_builtAt'):
+      state.pop(key, None)
+    for key in [key for key in state if key.endswith('Version')]:
+      if state[key] == Pattern.grammarVersion:
+        state[key] = True   # Up to date when the grammar is loaded
+      else:
+        del state[key]
+        state.pop(key[:-len('Version')], None)
+    for key, value in list(state.items()):
+      if getattr(value, '__self__', None) is self: state[key] = _MethodName(value.__name__)
+    return state
+
+  # ----------------------------------------------------------------------------
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    for key, value in state.items():
+      if key.endswith('Version') and value is True: setattr(self, key, Pattern.grammarVersion)
+      elif isinstance(value, _MethodName): setattr(self, key, getattr(self, value))
 
   # ----------------------------------------------------------------------------
 
@@ -712,6 +1047,7 @@ class Pattern(object):
         hasInterfaceFn = lambda fn: hasattr(obj, fn) and callable(getattr(obj, fn))
         return hasInterfaceFn("beforeMatch") and hasInterfaceFn("afterMatch")
 
+      self._changed()
       if isDebugHandlerObject(debugOpt):
         self.dbg = debugOpt
         return self
@@ -725,6 +1061,7 @@ class Pattern(object):
       # Check if the debugOpt matches one of the registered filters
       if debugOpt in DebugOptions.filters.keys(): args['matchFilter'] = debugOpt
 
+    self._changed()
     self.dbg = DebugOptions(**args)
     return self
 
@@ -750,10 +1087,31 @@ class Pattern(object):
     'test 3'
     """
     self.name = name
+    self._changed()
     return self
 
   # ----------------------------------------------------------------------------
 
+  def _changed(self):
+    """
+    Recalculate the cached analyses that can depend on this pattern after the
+    pattern is changed. A pattern that was built after the last analysis result
+    was cached is not part of any cached analysis, so changing it (e.g., setting
+    the debug options of a new pattern) does not change the grammar version.
+
+    >>> version = Pattern.grammarVersion
+    >>> p = (P('a') * 'b').debug('hide')
+    >>> Pattern.grammarVersion == version
+    True
+    >>> first = p.getFirstSet()
+    >>> p = p.debug('show')
+    >>> Pattern.grammarVersion == version
+    False
+    """
+    if self._builtAt != Pattern.analysisCount: Pattern.grammarVersion += 1
+
+  # ----------------------------------------------------------------------------
+
   def _containsPatterns(self):
     """
     Indicate whether this is a container of other patterns.
@@ -771,6 +1129,137 @@ class Pattern(object):
 
   # ----------------------------------------------------------------------------
 
+  def getRegex(self):
+    """
+    Get a compiled regular expression (see the ``re`` module) that matches the
+    same text as this pattern. Composite patterns without captures, functions,
+    stacks, recursion or debug output have a regular expression. Ordered choice
+    becomes an atomic group and repetition becomes a possessive quantifier, so
+    the regular expression follows the PEG rules. Patterns with a regular
+    expression are matched by the ``re`` module. The result is cached until the
+    grammar changes.
+
+    :return: The compiled regular expression, or None if the pattern can't be
+             expressed as a regular expression, or the ``re`` module does not
+             support atomic groups (Python versions before 3.11).
+
+    >>> number = digit**1 * (P('e') * digit**1)**-1
+    >>> print(number.getRegex().pattern)
+    (?:[0-9])++(?:e(?:[0-9])++){0,1}+
+    >>> C(digit**1).getRegex() is None
+    True
+    """
+    if self._regexVersion != Pattern.grammarVersion:
+      self._regex = None
+      if isinstance(self, CompositePattern) and _regexSupported():
+        source = _regexSource(self)
+        if source is not None:
+          import re
+          try:
+            self._regex = re.compile(source, re.DOTALL)
+          except (re.error, RuntimeError, OverflowError):
+            self._regex = None
+      self._regexVersion = _cacheVersion()
+    return self._regex
+
+  # ----------------------------------------------------------------------------
+
+  def getBytesRegex(self):
+    """
+    Get the regular expression of the pattern (see :func:`getRegex`) for
+    bytes-like subjects. The result is cached until the grammar changes.
+
+    :return: The compiled regular expression, or None if the pattern has no
+             regular expression, or the pattern has characters that are not
+             ASCII.
+
+    >>> print((P(b'GET') * ' ' * S('/ab')**1).getBytesRegex().pattern.decode())
+    GET\ (?:[/ab])++
+    """
+    if self._bytesRegexVersion != Pattern.grammarVersion:
+      self._bytesRegex = None
+      regex = self.getRegex()
+      source = None if regex is None else regex.pattern
+      # Case and character classes only agree for ASCII in str and bytes
+      if source is not None and all(ord(chr) < 128 for chr in source):
+        import re
+        self._bytesRegex = re.compile(source.encode('ascii'), re.DOTALL)
+      self._bytesRegexVersion = _cacheVersion()
+    return self._bytesRegex
+
+  # ----------------------------------------------------------------------------
+
+  def getFirstSet(self):
+    """
+    Get the characters that a match of this pattern can start with (the FIRST
+    set), and whether the pattern can match without consuming any characters.
+    A pattern that can't match without consuming characters fails if the next
+    character is not in the FIRST set. V objects are followed to the patterns
+    they are set to. The result is cached until the grammar changes.
+
+    :return: A tuple (first, nullable). The first value is a frozenset of
+             characters, or None if a match can start with any character.
+
+    >>> first, nullable = (P('if') + P('for') + S('0')).getFirstSet()
+    >>> sorted(first), nullable
+    (['0', 'f', 'i'], False)
+    >>> first, nullable = (S(' ')**0 * R('az')).getFirstSet()
+    >>> len(first), nullable
+    (27, False)
+    >>> (P(1) + P(True)).getFirstSet()
+    (None, True)
+    """
+    if self._firstVersion != Pattern.grammarVersion: _analyzeFirst(self)
+    return self._first, self._nullable
+
+  # ----------------------------------------------------------------------------
+
+  def getStartSearch(self):
+    """
+    Get the function that finds the next position where a match of this pattern
+    can start, which is used by :func:`finditer` to skip the positions where the
+    pattern can't match. If every match starts with a literal string (or one of
+    a choice of literal strings), the string is searched for. Otherwise, if the
+    pattern can't match without consuming characters, the next character of
+    the FIRST set (see :func:`getFirstSet`) is searched for. The result is
+    cached until the grammar changes.
+
+    :return: A function ``fn(text, index)`` that returns the next position at
+             or after *index* (or the end of the text), or None if a match can
+             start anywhere.
+
+    >>> search = (C('GET') * ' ' * C(1 - S(' '))**1).getStartSearch()
+    >>> search("PUT /a GET /b", 0)
+    7
+    >>> (S('ab')**0).getStartSearch() is None
+    True
+    """
+    if self._startSearchVersion != Pattern.grammarVersion:
+      self._startSearch = _startSearch(self)
+      self._startSearchVersion = _cacheVersion()
+    return self._startSearch
+
+  # ----------------------------------------------------------------------------
+
+  def isLean(self):
+    """
+    Check whether the pattern is lean. A lean pattern does not contain back
+    captures, stack patterns, functions or patterns with debug output (including
+    patterns referenced by V objects). Lean patterns are matched without the
+    bookkeeping that these features require when called from another pattern.
+
+    :return: True if the pattern is lean.
+
+    >>> (C(alpha**1) * Cp()).isLean()
+    True
+    >>> (C(alpha**1) * Sc('stack', Cp())).isLean()
+    False
+    """
+    if self._leanVersion != Pattern.grammarVersion: _analyzeLean(self)
+    return self._lean
+
+  # ----------------------------------------------------------------------------
+
   def match(self, string, index=0, context=None):
     """
     Match the `Pattern` against the *string* starting at the given *index*. Note
@@ -1084,6 +1573,186 @@ class Pattern(object):
     """
     return self.match(string, index, context)
 
+  # ----------------------------------------------------------------------------
+
+  def find(self, string, index=0, context=None):
+    """
+    Find the first match of the pattern at or after the given *index* (see
+    :func:`finditer`).
+
+    :param string: A string to search.
+    :param index:  The location in the string to start the search.
+    :param context: Information that is forwarded to the matches.
+    :return: A :class:`Match` object, or None if the pattern does not match.
+
+    >>> match = C(digit**1).find("abc 123 45")
+    >>> match.start, match.captures
+    (4, ['123'])
+    >>> P('x').find("abc") is None
+    True
+    """
+    for match in self.finditer(string, index, context): return match
+    return None
+
+  # ----------------------------------------------------------------------------
+
+  def finditer(self, string, index=0, context=None):
+    """
+    Find the matches of the pattern at or after the given *index* that don't
+    overlap, from left to right. After an empty match, the search continues at
+    the next character. This is an iterator function, so the string is searched
+    as the matches are used.
+
+    Patterns that are regular expressions are searched by the ``re`` module.
+    Other patterns are only matched at the positions found by
+    :func:`getStartSearch`. The back captures of a match are not visible to the
+    next matches.
+
+    :param string: A string to search.
+    :param index:  The location in the string to start the search.
+    :param context: Information that is forwarded to the matches.
+
+    >>> [(m.start, str(m)) for m in (alpha**1).finditer("one, two;three")]
+    [(0, 'one'), (5, 'two'), (9, 'three')]
+    >>> [m.captures for m in (C(alpha) * '=' * C(digit)).finditer("a=1 b c=3")]
+    [['a', '1'], ['c', '3']]
+    """
+    if not isinstance(string, BackCaptureString): string = BackCaptureString(string)
+    index = self._positiveIndex(string, index)
+    text  = string.string
+    size  = len(text)
+    sz    = string.getStackSize()
+
+    regex = search = None
+    if context is None or context.debug is None:
+      if isinstance(text, str): regex = self.getRegex()
+      elif string.binary: regex = self.getBytesRegex()
+    if regex is None and (isinstance(text, str) or string.binary):
+      search = self.getStartSearch()
+
+    while index <= size:
+      if regex is not None:
+        found = regex.search(text, index)
+        if found is None: return
+        match = Match(string, found.start(), found.end())
+        match.context = context if context is not None else Context()
+      else:
+        if search is not None: index = search(text, index)
+        match = self.match(string, index, context)
+        if not isinstance(match, Match):
+          index += 1
+          continue
+
+      yield match
+      string.setStackSize(sz)
+      index = match.end if match.end > match.start else match.end + 1
+
+  # ----------------------------------------------------------------------------
+
+  def findall(self, string, index=0, context=None):
+    """
+    Find the matches of the pattern (see :func:`finditer`) and get their
+    values. As with ``re.findall``, the value of a match is the matched text if
+    the match has no captures, the capture if it has one capture, and a tuple
+    of the captures otherwise.
+
+    :param string: A string to search.
+    :param index:  The location in the string to start the search.
+    :param context: Information that is forwarded to the matches.
+    :return: The list of values.
+
+    >>> (digit**1).findall("1 22 333")
+    ['1', '22', '333']
+    >>> (C(alpha) * '=' * C(digit)).findall("a=1 b=2")
+    [('a', '1'), ('b', '2')]
+    """
+    values = []
+    for match in self.finditer(string, index, context):
+      captures = match.captures
+      if len(captures) == 0: values.append(match.getValue())
+      elif len(captures) == 1: values.append(captures[0])
+      else: values.append(tuple(captures))
+    return values
+
+  # ----------------------------------------------------------------------------
+
+  def sub(self, replacement, string, sink=None, context=None):
+    """
+    Replace the matches of the pattern (see :func:`finditer`) in the string.
+    The text between the matches is copied as slices of the string.
+
+    The replacement is one of:
+
+    * *string* - A template, where ``%0`` is the matched text, ``%1`` to ``%9``
+      are the captures of the match and ``%%`` is a percent sign.
+    * *fn* - A function ``fn(match)`` that returns the replacement, or None to
+      keep the matched text.
+
+    The string may be a :class:`StreamString`, which is replaced as it is read.
+    The text is released once it is written, so with a sink neither the input
+    nor the output is held in memory.
+
+    :param replacement: The template or function.
+    :param string: The string to search.
+    :param sink: A list or a file-like object (anything with a ``write``
+           method) that the pieces of the result are written to as they are
+           found, or None (default) to return the result.
+    :param context: Information that is forwarded to the matches.
+    :return: The resulting string if there is no sink, otherwise the number of
+             matches that were replaced.
+
+    >>> (C(alpha**1) * '=' * C(digit**1)).sub('%2=%1', "a=1, bc=23")
+    '1=a, 23=bc'
+    >>> (digit**1).sub(lambda match: str(int(str(match)) * 2), "3 apples, 12 pears")
+    '6 apples, 24 pears'
+    >>> pieces = []
+    >>> P('-').sub('+', "a-b", pieces)
+    1
+    >>> pieces
+    ['a', '+', 'b']
+    """
+    pieces = [] if sink is None else sink
+    write = pieces.append if isinstance(pieces, list) else pieces.write
+
+    if isinstance(string, StreamString):
+      count = string._sub(self, replacement, write, context)
+      empty = string.text[:0]
+    else:
+      if not isinstance(string, BackCaptureString): string = BackCaptureString(string)
+      text    = string.string
+      replace = _replacer(replacement, string.binary)
+      empty   = b"" if string.binary else ""
+      count = start = 0
+      for match in self.finditer(string, 0, context):
+        if match.start > start: write(text[start:match.start])
+        write(replace(match))
+        start = match.end
+        count += 1
+      if start < len(text): write(text[start:])
+
+    if sink is not None: return count
+    return empty.join(pieces)
+
+  # ----------------------------------------------------------------------------
+
+  def compile(self):
+    """
+    Compile the pattern into a :class:`Program`, a flat list of instructions
+    that is run without recursing through the pattern objects. The program
+    returns the same results as the pattern. The program is cached, and is
+    compiled again if V objects or debug options in the grammar change.
+
+    :returns: A Program object that matches the same strings as the pattern.
+    """
+    if self._programVersion != Pattern.grammarVersion:
+      if __package__:
+        from .Compiler import Program
+      else:
+        from Compiler import Program
+      self._program = Program(self)
+      self._programVersion = _cacheVersion()
+    return self._program
+
 # ==============================================================================
 
 class AtomicPattern(Pattern):
@@ -1109,6 +1778,8 @@ class P(AtomicPattern):
     The *P* class accepts he following types:
 
     * *string* - Match against the literal string that is passed in.
+    * *bytes*  - Match against the literal bytes, which are decoded as latin-1
+       to match str subjects.
     * *int*    - Match a given number of characters.
     * *fn*     - Match against a matcher function of form ``fn(string, index, context)``.
        The *fn* may return:
@@ -1132,12 +1803,14 @@ class P(AtomicPattern):
       self.ptn     = value
       self.repr    = _repr_(value)
 
-    elif isinstance(value, six.string_types):
+    elif isinstance(value, (six.string_types, bytes)):
       self.matcher = self.match_str
-      self.string  = value
+      self.string, self.bytes = _textAndBytes(value)
       self.size    = len(value)
       # TODO: Handle single quotes in representation.
-      self.repr    = "P('%s')" % escapeStr(value)
+      self.repr    = "P(%s'%s')" % ("b" if isinstance(value, bytes) and
+                                    not isinstance(value, str) else "",
+                                    escapeStr(self.string))
 
     elif isinstance(value, bool):
       self.matcher = self.match_TF
@@ -1165,7 +1838,7 @@ class P(AtomicPattern):
     """
     Verify that P(arg) is a valid arg. Raise an exception if not.
     """
-    if isinstance(value, (Pattern, str, bool, int)): return True
+    if isinstance(value, (Pattern, str, bytes, bool, int)): return True
     if callable(value): return True
     raise ValueError(msg)
 
@@ -1215,9 +1888,11 @@ class P(AtomicPattern):
     test
     >>> p("Failed") is None
     True
+    >>> p(b"A test", 2).getValue() == b"test"
+    True
     """
     if len(string) - index < self.size: return None
-    if string[index:index+self.size] == self.string:
+    if string[index:index+self.size] == (self.bytes if string.binary else self.string):
         return Match(string, index, index + self.size)
     return None
 
@@ -1324,7 +1999,8 @@ class P(AtomicPattern):
     if match in (False, None):
       return None
     if isinstance(match, Match):
-      return match
+      # The function can keep the match (see PatternFnWrap.match)
+      return match._detach()._copy()
 
     if isinstance(match, int):
         if index <= match and match <= len(string):
@@ -1347,8 +2023,10 @@ class I(AtomicPattern):
 
   def __init__(self, string):
     Pattern.__init__(self)
-    self.orig   = string
-    self.string = string.lower()
+    text, data  = _textAndBytes(string)
+    self.orig   = text
+    self.string = text.lower()
+    self.bytes  = None if data is None else data.lower()
     self.size   = len(string)
 
   # ----------------------------------------------------------------------------
@@ -1365,12 +2043,18 @@ class I(AtomicPattern):
     ACE
     >>> p("ace")
     ace
+    >>> p(b"aCe").getValue() == b"aCe"
+    True
 
     :param string: The string to match
     :param index: The location in string to start match
     :param context: Information that is forwarded between matches.
     """
     if len(string) - index < self.size: return None
+    if string.binary:
+      if self.bytes is None or \
+         string[index:index + self.size].tobytes().lower() != self.bytes: return None
+      return Match(string, index, index + self.size)
     if string[index:index + self.size].lower() == self.string:
       return Match(string, index, index + self.size)
     return None
@@ -1393,9 +2077,11 @@ class S(AtomicPattern):
   def __init__(self, set):
     import six
     Pattern.__init__(self)
-    if not isinstance(set, six.string_types):
+    if not isinstance(set, (six.string_types, bytes)):
       raise ValueError("The arg must be a string in S(arg)")
-    self.set = set
+    self.set    = _textAndBytes(set)[0]
+    self.chars  = frozenset(self.set)
+    self.lookup = CharClass(self.set).lookup  # The characters and their bytes
 
   # ----------------------------------------------------------------------------
 
@@ -1411,13 +2097,15 @@ class S(AtomicPattern):
     True
     >>> p("abc",2)
     c
+    >>> p(b"abc",2).getValue() == b"c"
+    True
 
     :param string: The string to match
     :param index: The location in string to start match
     :param context: Information that is forwarded between matches.
     """
     if len(string) - index < 1: return None
-    if string[index] not in self.set: return None
+    if string[index] not in self.lookup: return None
     return Match(string, index, index + 1)
 
   # ----------------------------------------------------------------------------
@@ -1440,11 +2128,14 @@ class R(AtomicPattern):
 
   def __init__(self, *ranges):
     Pattern.__init__(self)
+    ranges = tuple(_textAndBytes(rng)[0] if isinstance(rng, bytes) else rng
+                   for rng in ranges)
     self.ranges = ranges
     for range in ranges:
       if len(range) != 2: raise ValueError("Ranges must have two values: %s" % range)
       if range[0] > range[1]:
         raise ValueError("Lower range value must be less than upper range value: %s" % range)
+    self.charClass = CharClass(ranges=ranges) if CharClass.isValidRange(*ranges) else None
 
   # ----------------------------------------------------------------------------
 
@@ -1460,6 +2151,8 @@ class R(AtomicPattern):
     Q
     >>> p("1") is None
     True
+    >>> p(b"a").getValue() == b"a"
+    True
 
     :param string: The string to match
     :param index: The location in string to start match
@@ -1468,6 +2161,9 @@ class R(AtomicPattern):
     if len(string) - index < 1: return False
 
     chr = string[index]
+    if self.charClass is not None:
+      return Match(string, index, index+1) if chr in self.charClass.lookup else None
+    if string.binary: chr = _BYTE_CHARS[chr]
     for range in self.ranges:
       if range[0] <= chr and chr <= range[1]:
           return Match(string, index, index+1)
@@ -1481,71 +2177,266 @@ class R(AtomicPattern):
 
 # ===============================================================================
 
-class SOL(AtomicPattern):
+class CharClass(object):
   """
-  Check if his is the Start of Line (SOL).
+  A set of characters that is tested with a single membership test. Characters
+  and small ranges of characters are stored in a frozenset. Large ranges (such
+  as ranges of Unicode characters) are stored in a sorted table of ranges that
+  is searched with a binary search.
+
+  The lookup also holds the byte values of the latin-1 characters, so bytes-like
+  subjects are tested without decoding them.
+
+  >>> digits = CharClass("_", ["09"])
+  >>> '5' in digits, '_' in digits, 'a' in digits
+  (True, True, False)
+  >>> ord('5') in digits.lookup, ord('a') in digits.lookup
+  (True, False)
+  >>> cjk = CharClass(ranges=[u"\u4e00\u9fff"])
+  >>> u"\u6587" in cjk, 'a' in cjk
+  (True, False)
   """
 
-  def __init__(self):
-    Pattern.__init__(self)
+  # Ranges with more characters are stored in the table of ranges
+  maxSetRange = 256
 
   # ----------------------------------------------------------------------------
 
-  @ConfigBackCaptureString4match
-  def match(self, string, index=0, context=None):
+  def __init__(self, chars="", ranges=()):
     """
-    Match the start of a line.
+    :param chars: The characters in the class.
+    :param ranges: Ranges of characters in the class. Each range is a string (or
+           a sequence) with the first and last characters of the range.
+    """
+    import bisect
+    import six
+    members = set(chars)
+    table = []
+    for low, high in sorted((rng[0], rng[1]) for rng in ranges):
+      if ord(high) - ord(low) < CharClass.maxSetRange:
+        char = six.unichr if isinstance(low, six.text_type) else chr
+        members.update(char(c) for c in range(ord(low), ord(high)+1))
+      elif len(table) > 0 and ord(low) <= ord(table[-1][1]) + 1:
+        table[-1] = (table[-1][0], max(table[-1][1], high))
+      else:
+        table.append((low, high))
 
-    :param context:
-    :param string: The string to match
-    :param index: The index to start at
-    :return: A match object. No characters are consumed.
+    self.chars  = frozenset(members)
+    self.lows   = [low for low, high in table]
+    self.highs  = [high for low, high in table]
+    self.bisect = bisect.bisect_right
 
-    >>> p = SOL()
-    >>> p.match("test\\n123\\n") == ""
-    True
-    >>> p.match("test\\n123\\n",1) is None
-    True
-    >>> p.match("test\\n123\\n",5) == ""
-    True
-    >>> p.match("test\\n123\\n",6) is None
-    True
-    >>> p.match("test\\n123\\n",9) == ""
-    True
+    # The characters with the byte values of the latin-1 characters
+    members.update(ord(chr) for chr in self.chars if ord(chr) < 256)
+    for low, high in table:
+      members.update(range(ord(low), min(ord(high), 255) + 1))
+    self.members = frozenset(members)
+
+    # The object used for membership tests. The frozenset is used directly if
+    # there are no large ranges.
+    self.lookup = self if len(table) > 0 else self.members
+
+  # ----------------------------------------------------------------------------
+
+  @staticmethod
+  def isValidRange(*ranges):
     """
-    if index == 0 or string[index-1] == '\n':
-      return Match(string, index, index)
-    if string[index-1] == '\r' and (index == len(string) or string[index] != '\n'):
-      return Match(string, index, index)
-    return None
+    Check whether the ranges are made of single characters, which is required
+    for ranges in a CharClass.
+    """
+    import six
+    for rng in ranges:
+      for chr in (rng[0], rng[1]):
+        if not isinstance(chr, six.string_types) or len(chr) != 1: return False
+    return True
+
+  # ----------------------------------------------------------------------------
+
+  def __contains__(self, chr):
+    if chr in self.members: return True
+    if isinstance(chr, int): return False  # Bytes are in the members
+    k = self.bisect(self.lows, chr) - 1
+    return k >= 0 and chr <= self.highs[k]
 
   # ----------------------------------------------------------------------------
+
   def __repr__(self):
-    return "SOL()"
+    args = ["'{0}'".format(escapeStr("".join(sorted(self.chars))))]
+    if len(self.lows) > 0:
+      args.append(repr([low + high for low, high in zip(self.lows, self.highs)]))
+    return "CharClass({0})".format(", ".join(args))
 
-# ==============================================================================
+# ===============================================================================
 
-class EOL(AtomicPattern):
+class Keywords(AtomicPattern):
   """
-  Detect whether the current position is at the end of a line.
+  Match one of a list of literal strings. The first string in the list that
+  matches wins, as in ``P(words[0]) + P(words[1]) + ...``, but the text is
+  looked up in a table of the strings instead of trying the strings one at a
+  time. A choice of literal patterns (e.g., ``P('if') + P('for') + ...``) is
+  matched with a Keywords table automatically (see
+  :func:`PatternOr.getKeywords`).
   """
 
+  # Longer lists are looked up in the table instead of matching a regular
+  # expression with one alternative per word
+  maxRegexWords = 256
+
   # ----------------------------------------------------------------------------
 
-  def __init__(self):
+  def __init__(self, words):
+    """
+    :param words: The list of strings to match, in order of priority.
+    """
+    import six
     Pattern.__init__(self)
+    for word in words:
+      if not isinstance(word, (six.string_types, bytes)):
+        raise ValueError("The words must be strings in Keywords(words)")
+    forms = [_textAndBytes(word) for word in words]
+    self.words = [text for text, data in forms]
+
+    # The position of each word in the list, and the sizes of the words that
+    # start with each character (longest first). The bytes of the words are
+    # looked up in the same tables for bytes-like subjects.
+    self.table = {}
+    self.sizes = {}
+    for k, form in enumerate(forms):
+      for word in form:
+        if word is None or word in self.table: continue
+        self.table[word] = k
+        if len(word) > 0: self.sizes.setdefault(word[0], set()).add(len(word))
+    for chr, sizes in self.sizes.items():
+      self.sizes[chr] = sorted(sizes, reverse=True)
+    self.empty = self.table.get("")
+
+  # ----------------------------------------------------------------------------
+
+  def lookup(self, text, index):
+    """
+    Find the first word in the list that matches the text at the given index.
+
+    :param text: The string to match.
+    :param index: The location in the text to match the words.
+    :return: The index of the end of the word in the text, or None if no word
+             matches.
+    """
+    best = self.empty
+    end  = index
+    remaining = len(text) - index
+    if remaining > 0:
+      table = self.table
+      # Memoryviews of bytearray and mmap subjects can't be hashed
+      binary = isinstance(text, memoryview)
+      for size in self.sizes.get(text[index], ()):
+        if size > remaining: continue
+        k = table.get(text[index:index+size].tobytes() if binary else text[index:index+size])
+        if k is not None and (best is None or k < best):
+          best = k
+          end = index + size
+    return None if best is None else end
 
   # ----------------------------------------------------------------------------
 
   @ConfigBackCaptureString4match
   def match(self, string, index=0, context=None):
     """
-    Detect whether the current position is at the end of a line.
+    Match the first word that matches the string.
 
-    :param context:
-    :param string: The string to compare against
-    :param index: The location to check.
-    :return: A match object that consumes no input.
+    >>> p = Keywords(['for', 'from', 'f', 'fork'])
+    >>> p("fork")
+    for
+    >>> p("from")
+    from
+    >>> p("fun")
+    f
+    >>> p("if") is None
+    True
+    >>> p(b"from").getValue() == b"from"
+    True
+
+    :param string: The string to match
+    :param index: The location in string to start match
+    :param context: Information that is forwarded between matches.
+    """
+    end = self.lookup(string.string, index)
+    if end is None: return None
+    return Match(string, index, end)
+
+  # ----------------------------------------------------------------------------
+
+  def __repr__(self):
+    return "Keywords([{0}])".format(", ".join("'{0}'".format(escapeStr(word))
+                                              for word in self.words))
+
+# ===============================================================================
+
+class SOL(AtomicPattern):
+  """
+  Check if his is the Start of Line (SOL).
+  """
+
+  def __init__(self):
+    Pattern.__init__(self)
+
+  # ----------------------------------------------------------------------------
+
+  @ConfigBackCaptureString4match
+  def match(self, string, index=0, context=None):
+    """
+    Match the start of a line.
+
+    :param context:
+    :param string: The string to match
+    :param index: The index to start at
+    :return: A match object. No characters are consumed.
+
+    >>> p = SOL()
+    >>> p.match("test\\n123\\n") == ""
+    True
+    >>> p.match("test\\n123\\n",1) is None
+    True
+    >>> p.match("test\\n123\\n",5) == ""
+    True
+    >>> p.match("test\\n123\\n",6) is None
+    True
+    >>> p.match("test\\n123\\n",9) == ""
+    True
+    """
+    if index == 0 or string[index-1] in ('\n', 10):
+      return Match(string, index, index)
+    if string[index-1] in ('\r', 13) and \
+       (index == len(string) or string[index] not in ('\n', 10)):
+      return Match(string, index, index)
+    return None
+
+  # ----------------------------------------------------------------------------
+  def __repr__(self):
+    return "SOL()"
+
+# ==============================================================================
+
+class EOL(AtomicPattern):
+  """
+  Detect whether the current position is at the end of a line.
+  """
+
+  # ----------------------------------------------------------------------------
+
+  def __init__(self):
+    Pattern.__init__(self)
+
+  # ----------------------------------------------------------------------------
+
+  @ConfigBackCaptureString4match
+  def match(self, string, index=0, context=None):
+    """
+    Detect whether the current position is at the end of a line.
+
+    :param context:
+    :param string: The string to compare against
+    :param index: The location to check.
+    :return: A match object that consumes no input.
 
     >>> p = EOL()
     >>> p.match("") == ""
@@ -1560,9 +2451,9 @@ class EOL(AtomicPattern):
     True
     """
 
-    if index == len(string) or string[index] == '\r':
+    if index == len(string) or string[index] in ('\r', 13):
       return Match(string, index, index)
-    if string[index] == '\n' and (index == 0 or string[index-1] != '\r'):
+    if string[index] in ('\n', 10) and (index == 0 or string[index-1] not in ('\r', 13)):
       return Match(string, index, index)
     return None
 
@@ -1571,6 +2462,52 @@ class EOL(AtomicPattern):
   def __repr__(self):
     return "EOL()"
 
+# ==============================================================================
+
+class Cut(AtomicPattern):
+  """
+  Commit to the choices made before the current position. Once the cut matches,
+  the choices and repetitions that started before the position no longer
+  backtrack: if the rest of the match fails, they fail instead of trying the
+  next alternative. The memoized results for the positions before the cut are
+  released, so a loop of statements that ends each statement with a cut does
+  not keep results for the whole input.
+
+  Lookahead patterns (``~ptn`` and ``-ptn``) always backtrack, so a cut only
+  applies to the choices within them.
+
+  >>> ifStmt = P('if') * Cut() * ' ' * C(alpha**1)
+  >>> (ifStmt + C(alpha**1)).match('if x').captures
+  ['x']
+  >>> (ifStmt + C(alpha**1)).match('ifx') is None
+  True
+  >>> (P('if') * ' ' * C(alpha**1) + C(alpha**1)).match('ifx').captures
+  ['ifx']
+  """
+
+  def __init__(self):
+    Pattern.__init__(self)
+
+  # ----------------------------------------------------------------------------
+
+  @ConfigBackCaptureString4match
+  def match(self, string, index=0, context=None):
+    """
+    Commit to the choices made before the position.
+
+    :param context:
+    :param string: The string to match
+    :param index: The position of the cut.
+    :return: A match object that consumes no input.
+    """
+    string.cut(index)
+    return Match(string, index, index)
+
+  # ----------------------------------------------------------------------------
+
+  def __repr__(self):
+    return "Cut()"
+
 # ==============================================================================
 # Captures
 # ==============================================================================
@@ -1631,9 +2568,15 @@ class C(Capture):
     'ab'
     """
 
+    # Reserve a place for the capture before the captures of the pattern
+    buffer = string.captureBuffer
+    start = len(buffer)
+    buffer.append(None)
+
     match = self.pattern.match(string, index, context)
     if isinstance(match, Match):
-      match.captures.insert(0, str(match))
+      buffer[start] = Span(match.start, match.end)
+      match._setCaptureRange(string, start)
     return match
 
   # ----------------------------------------------------------------------------
@@ -1708,6 +2651,12 @@ class Cb(AtomicPattern):
     """
     if self.pattern is None:
       tomatch = string.getNamedCapture(self.capname)
+      # Compare a captured string directly instead of creating a P pattern
+      if isinstance(tomatch, str) and context.debug is None:
+        if not string.string.startswith(tomatch, index): return None
+        return Match(string, index, index + len(tomatch))
+      # Captures of bytes-like subjects are memoryview slices
+      if isinstance(tomatch, memoryview): tomatch = tomatch.tobytes()
       return P(tomatch).match(string, index, context)
     else:
       match = self.pattern.match(string, index, context)
@@ -1814,13 +2763,20 @@ class Cg(Capture):
     ['T', 'e']
     >>> p("b") is None
     True
+    >>> Cg(C(P(1)) * Cg(C(P(1))**0))("abc").getCapture(0)
+    ['a', ['b', 'c']]
     """
 
+    # Reserve a place for the marker of the group
+    buffer = string.captureBuffer
+    start = len(buffer)
+    buffer.append(None)
+
     match = self.pattern.match(string, index, context)
     if not isinstance(match, Match): return match
 
-    match.captures = [match.captures]
-    return match
+    buffer[start] = CaptureGroup(len(buffer))
+    return match._setCaptureRange(string, start)
 
   # ----------------------------------------------------------------------------
 
@@ -1969,7 +2925,7 @@ class Cp(Capture):
     >>> p("test",1).getCapture(0)
     1
     """
-    return Match(string, index, index)._addCapture(index)
+    return Match(string, index, index)._addCapture(index + string.offset)
 
   # ----------------------------------------------------------------------------
 
@@ -2007,14 +2963,7 @@ class Col(Capture):
     >>> p.match("\\n  \\n  Test",9).getCapture(0)
     5
     """
-    match = Match(string, index, index)
-    if index == 0: return match._addCapture(0)
-
-    # Look backwards until the end of a line is found.
-    for i in range(index-1, -1, -1):
-      if string[i] not in ('\r','\n'): continue
-      return match._addCapture(index - 1 - i)
-    return match._addCapture(index)
+    return Match(string, index, index)._addCapture(string.getLineOffset(index))
 
   # ----------------------------------------------------------------------------
 
@@ -2302,17 +3251,39 @@ class CompositePattern(Pattern):
 # ===============================================================================
 
 class V(CompositePattern):
+  """
+  A place holder for a pattern that is set later, which is used to write
+  recursive grammars (see :func:`setVs`). Grammars can be left recursive.
+
+  >>> expr = V('expr')
+  >>> number = C(digit**1)
+  >>> expr.setPattern(Cg(expr * C(S('+-')) * number) + number)
+  >>> expr.match('1-2+3').captures
+  [[['1', '-', '2'], '+', '3']]
+
+  In a cycle of V objects that call each other at the same index, only the
+  head of the cycle grows a seed. The head is the V object through which the
+  cycle is entered from the pattern that is analyzed first (see
+  :func:`isLeftRecursive`), usually the root of the grammar. A match from
+  another V object of the cycle does not grow its own seed, so it can stop at a
+  shorter match.
+  """
   precedence = 1
 
   # ----------------------------------------------------------------------------
 
-  def __init__(self, name):
+  def __init__(self, name, memo=None):
     """
     :param name: The is a pattern place holder. The name is the name of this
                  pattern. The associated Pattern will be set later.
+    :param memo: When matching with a :class:`MemoTable`, True indicates that
+                 the results of the associated pattern are always memoized and
+                 False indicates that they are never memoized. If None
+                 (default), the MemoTable decides.
     """
     CompositePattern.__init__(self)
     self.setName(name)
+    self.memo = memo
 
   # ----------------------------------------------------------------------------
 
@@ -2321,17 +3292,98 @@ class V(CompositePattern):
     Set the pattern for this V object.
     :param pattern: The pattern associated with this V object
     """
+    self._changed()
     self.patterns.insert(0, pattern)
 
   # ----------------------------------------------------------------------------
 
   def match(self, string, index=0, context=None):
     if len(self.patterns) > 0:
+      if self._leftRecursionVersion != Pattern.grammarVersion: _analyzeLeftRecursion(self)
+      if self._leftRecursion == 'head': return self._growSeed(string, index, context)
+      if self.memo is not None and self._leftRecursion is None and \
+         isinstance(string, BackCaptureString) and string.memo is not None:
+        string.memo.setMemoized(self.patterns[0], self.memo)
       return self.patterns[0].match(string, index, context)
     return None
 
   # ----------------------------------------------------------------------------
 
+  def _growSeed(self, string, index, context):
+    """
+    Match a left recursive pattern by growing a seed (Warth et al., "Packrat
+    Parsers Can Support Left Recursion"). The left recursive match at the same
+    index fails at first. The pattern is then matched again, with the left
+    recursive match returning the previous result, until the match stops
+    getting longer. The changes to the stacks of the context are only kept for
+    the longest match.
+    """
+    if not isinstance(string, BackCaptureString): string = BackCaptureString(string)
+    index = self._positiveIndex(string, index)
+    key = (id(self), index)
+    buffer = string.captureBuffer
+    mark = len(buffer)
+
+    # A left recursive match returns the seed. The seed is the end of the match
+    # and a copy of the captures in the capture buffer, with their index. The
+    # copy is spliced into the buffer, so each seed only copies the captures
+    # added to the previous one and growing the seed stays linear.
+    if key in string.seeds:
+      seed = string.seeds[key]
+      if seed is None: return None
+      end, start, captures = seed
+      match = Match(string, index, end)
+      if len(captures) > 0: buffer.append(CaptureSplice(captures, start))
+      match._setCaptureRange(string, mark)
+      match.context = context
+      return match
+
+    sz = string.getStackSize()
+    cut = string.cutIndex
+    best = bestContext = None
+    string.seeds[key] = None
+    try:
+      while True:
+        trial = Context(context)
+        match = self.patterns[0].match(string, index, trial)
+        string.setStackSize(sz)
+        if not isinstance(match, Match) or best is not None and match.end <= best.end: break
+        if match._capSource is not string or match._capStart != mark or \
+           match._capEnd != len(buffer):
+          match._moveCaptures(string, mark)
+        best, bestContext = match, trial
+        string.seeds[key] = (match.end, mark, buffer[mark:])
+        del buffer[mark:]
+    finally:
+      seed = string.seeds.pop(key)
+
+    if len(buffer) > mark: del buffer[mark:]
+    if best is None: return None
+    if string.cutIndex != cut and string.cutIndex > best.end: return None
+    buffer.extend(seed[2])
+    best._setCaptureRange(string, mark)
+    bestContext.commit()
+    if context is None: best._releaseCaptures()
+    return best
+
+  # ----------------------------------------------------------------------------
+
+  def isLeftRecursive(self):
+    """
+    Check whether the pattern can match this V object again at the same index.
+    Left recursive V objects are matched by growing a seed, so the result is the
+    longest match of the pattern. The result is cached until the grammar changes.
+
+    >>> expr = V('expr')
+    >>> expr.setPattern(expr * '+' * digit + digit)
+    >>> expr.isLeftRecursive(), V('x').isLeftRecursive()
+    (True, False)
+    """
+    if self._leftRecursionVersion != Pattern.grammarVersion: _analyzeLeftRecursion(self)
+    return self._leftRecursion is not None
+
+  # ----------------------------------------------------------------------------
+
   def __repr__(self):
     return "V('{0}')".format(self.name)
 
@@ -2386,12 +3438,607 @@ def setVs(pattern, Vs=None, replace=False):
   # Set the Vs for all contained patterns
   for i, ptn in enumerate(patterns):
     ptn = setVs(ptn, Vs, replace)
-    if replace: patterns[i] = ptn
+    if replace and patterns[i] is not ptn:
+      pattern._changed()
+      patterns[i] = ptn
 
   return pattern
 
 # ==============================================================================
 
+def _subPatterns(pattern):
+  """
+  Get the patterns used when matching a pattern. For V objects this is the
+  pattern currently associated with the V object.
+  """
+  if isinstance(pattern, V): return pattern.patterns[:1]
+  if not pattern._containsPatterns(): return []
+  return [ptn for ptn in pattern.getPatterns() if isinstance(ptn, Pattern)]
+
+# ==============================================================================
+
+def _analyzeLean(root):
+  """
+  Determine which patterns reachable from the root pattern are lean (see
+  :func:`Pattern.isLean`) and cache the result in each pattern. A pattern is
+  not lean if a pattern that is not lean can be reached from it.
+  """
+  # Find the reachable patterns and the patterns that use each of them
+  users = {id(root): []}
+  patterns = [root]
+  todo = [root]
+  while len(todo) > 0:
+    ptn = todo.pop()
+    for sub in _subPatterns(ptn):
+      if id(sub) not in users:
+        users[id(sub)] = []
+        patterns.append(sub)
+        todo.append(sub)
+      users[id(sub)].append(ptn)
+
+  def usesFeatures(ptn):
+    if isinstance(ptn, (Cb, Cs, StackPtn, PatternFnWrap)): return True
+    if isinstance(ptn, P) and ptn.matcher == ptn.match_fn: return True
+    return ptn.dbg is not None and not (isinstance(ptn.dbg, DebugOptions) and
+                                        ptn.dbg.isHidden())
+
+  # Patterns that use the features, and any pattern using them, are not lean
+  notLean = set()
+  todo = [ptn for ptn in patterns if usesFeatures(ptn)]
+  while len(todo) > 0:
+    ptn = todo.pop()
+    if id(ptn) in notLean: continue
+    notLean.add(id(ptn))
+    todo.extend(users[id(ptn)])
+
+  version = _cacheVersion()
+  for ptn in patterns:
+    ptn._lean = id(ptn) not in notLean
+    ptn._leanVersion = version
+
+# ==============================================================================
+
+def _charClass(pattern):
+  """
+  Merge the characters matched by a pattern made of S, R and single character P
+  patterns and alternatives of them (see :func:`PatternOr.getCharClass`).
+
+  :return: A :class:`CharClass`, or None if the pattern matches anything other
+           than a single character, or a pattern has debug output.
+  """
+  chars  = []
+  ranges = []
+  todo   = [pattern]
+  while len(todo) > 0:
+    ptn = todo.pop()
+    if ptn.dbg is not None and not (isinstance(ptn.dbg, DebugOptions) and ptn.dbg.isHidden()):
+      return None
+    if type(ptn) is S:
+      chars.append(ptn.set)
+    elif type(ptn) is R and ptn.charClass is not None:
+      ranges.extend(ptn.ranges)
+    elif type(ptn) is P and ptn.matcher == ptn.match_str and ptn.size == 1:
+      chars.append(ptn.string)
+    elif type(ptn) is P and ptn.matcher == ptn.match_ptn:
+      todo.append(ptn.ptn)
+    elif type(ptn) is PatternOr:
+      todo.extend(ptn.patterns)
+    else:
+      return None
+  return CharClass("".join(chars), ranges)
+
+# ==============================================================================
+
+def _scanClass(pattern):
+  """
+  Get the characters matched by a single character pattern: a character class,
+  any character (``P(1)``), or a character class that excludes another one
+  (e.g., ``1 - S(' \\t')``). See :func:`PatternRepeat.getScanClass`.
+
+  :return: A tuple (include, exclude) of the lookup tables of the characters
+           that are matched and the characters that are not matched (None for
+           any character and no character respectively), or None if the
+           pattern is not a single character pattern.
+  """
+  while True:
+    if pattern.dbg is not None and not (isinstance(pattern.dbg, DebugOptions) and
+                                        pattern.dbg.isHidden()):
+      return None
+    if type(pattern) is not P or pattern.matcher != pattern.match_ptn: break
+    pattern = pattern.ptn
+
+  if type(pattern) is P and pattern.matcher == pattern.match_n and pattern.n == 1:
+    return None, None
+
+  if type(pattern) is PatternAnd and len(pattern.patterns) == 2 and \
+     type(pattern.patterns[0]) is PatternNot and pattern.patterns[0].dbg is None:
+    exclude = _charClass(pattern.patterns[0].patterns[0])
+    include = _scanClass(pattern.patterns[1])
+    if exclude is None or include is None or include[1] is not None: return None
+    return include[0], exclude.lookup
+
+  charClass = _charClass(pattern)
+  return None if charClass is None else (charClass.lookup, None)
+
+# ==============================================================================
+
+def _untilSearch(terminator):
+  """
+  Create the function that finds a terminator (see
+  :func:`PatternUntil.getSearch`).
+
+  :return: A function ``fn(text, index)`` that returns the index of the first
+           match of the terminator at or after *index* (or the end of the text),
+           or None if the terminator isn't a literal string, a choice of literal
+           strings or a character class. The text may be a str or a memoryview
+           of bytes.
+  """
+  import re
+  keywords = _keywords(terminator)
+  if keywords is not None:
+    words = keywords.words
+    if "" in words: return lambda text, index: index
+    data = [word for word in (_textAndBytes(word)[1] for word in words) if word is not None]
+    regex = re.compile("|".join(re.escape(word) for word in words))
+    bytesRegex = re.compile(b"|".join(re.escape(word) for word in data) or b"(?!)")
+  else:
+    charClass = _charClass(terminator)
+    if charClass is None: return None
+    chars = "".join(re.escape(chr) for chr in sorted(charClass.chars))
+    ranges = "".join(re.escape(low) + "-" + re.escape(high)
+                     for low, high in zip(charClass.lows, charClass.highs))
+    if len(chars) + len(ranges) == 0: return lambda text, index: max(index, len(text))
+    regex = re.compile("[{0}{1}]".format(chars, ranges))
+    data = bytes(bytearray(sorted(byte for byte in charClass.members if isinstance(byte, int))))
+    bytesRegex = re.compile(b"[" + re.escape(data) + b"]" if len(data) > 0 else b"(?!)")
+
+  def search(text, index):
+    match = (regex if isinstance(text, str) else bytesRegex).search(text, index)
+    return max(index, len(text)) if match is None else match.start()
+  if keywords is None or len(words) > 1: return search
+
+  word = words[0]
+  def find(text, index):
+    if not isinstance(text, str): return search(text, index)
+    end = text.find(word, index)
+    return max(index, len(text)) if end < 0 else end
+  return find
+
+# ==============================================================================
+
+def _startSearch(pattern):
+  """
+  Create the function that finds the next position where a match of a pattern
+  can start (see :func:`Pattern.getStartSearch`).
+
+  :return: A function ``fn(text, index)`` (see :func:`_untilSearch`), or None
+           if a match can start anywhere.
+  """
+  # Follow the first pattern of sequences to a literal string that starts
+  # every match
+  ptn  = pattern
+  seen = set()
+  while id(ptn) not in seen:
+    seen.add(id(ptn))
+    if ptn.dbg is not None and not (isinstance(ptn.dbg, DebugOptions) and ptn.dbg.isHidden()):
+      break
+    kind = type(ptn)
+    if kind is P and ptn.matcher == ptn.match_ptn:
+      ptn = ptn.ptn
+    elif kind in (C, Cg, PatternCaptureN, V) and len(_subPatterns(ptn)) == 1:
+      ptn = _subPatterns(ptn)[0]
+    elif kind is PatternAnd and len(ptn.patterns) > 0:
+      ptn = ptn.patterns[0]
+    elif kind is PatternRepeat and ptn.n > 0 and ptn.matcher != ptn.match_at_most_n:
+      ptn = ptn.patterns[0]
+    else:
+      break
+  keywords = _keywords(ptn)
+  if keywords is not None and "" not in keywords.words: return _untilSearch(ptn)
+
+  first, nullable = pattern.getFirstSet()
+  if nullable or first is None: return None
+  return _untilSearch(S("".join(sorted(first))))
+
+# ==============================================================================
+
+def _replacer(replacement, binary):
+  """
+  Create the function that gets the replacement of a match (see
+  :func:`Pattern.sub`).
+
+  :param replacement: A template string or a function of the match.
+  :param binary: Whether the replacement is bytes (for bytes-like strings).
+  :return: A function ``fn(match)`` that returns the replacement text.
+  """
+  import re
+  import six
+  empty = b"" if binary else ""
+
+  def text(value):
+    if binary:
+      if isinstance(value, (bytes, bytearray, memoryview)): return value
+      data = _textAndBytes(value if isinstance(value, six.string_types) else str(value))[1]
+      if data is None: raise ValueError("The replacement is not latin-1: {0!r}".format(value))
+      return data
+    return value if isinstance(value, six.string_types) else str(value)
+
+  if callable(replacement):
+    def call(match):
+      value = replacement(match)
+      return text(match.getValue() if value is None else value)
+    return call
+
+  if not isinstance(replacement, (six.string_types, bytes)):
+    raise ValueError("The replacement must be a string or a function")
+
+  # The template is split into text and capture numbers
+  parts = []
+  for k, part in enumerate(re.split("%([0-9%])", _textAndBytes(replacement)[0])):
+    if k % 2 == 0: parts.append(text(part))
+    elif part == "%": parts.append(text("%"))
+    else: parts.append(int(part))
+  if not any(isinstance(part, int) for part in parts):
+    constant = empty.join(parts)
+    return lambda match: constant
+
+  def replace(match):
+    pieces = []
+    for part in parts:
+      if not isinstance(part, int): pieces.append(part)
+      elif part == 0: pieces.append(text(match.getValue()))
+      else: pieces.append(text(match.getCapture(part - 1)))
+    return empty.join(pieces)
+  return replace
+
+# ==============================================================================
+
+def _keywords(pattern):
+  """
+  Merge the strings of a choice of literal patterns into a :class:`Keywords`
+  pattern (see :func:`PatternOr.getKeywords`).
+
+  :return: A :class:`Keywords` pattern, or None if the pattern matches anything
+           other than literal strings, or a pattern has debug output.
+  """
+  words = []
+  todo  = [pattern]
+  while len(todo) > 0:
+    ptn = todo.pop()
+    if ptn.dbg is not None and not (isinstance(ptn.dbg, DebugOptions) and ptn.dbg.isHidden()):
+      return None
+    if type(ptn) is P and ptn.matcher == ptn.match_str:
+      words.append(ptn.string)
+    elif type(ptn) is Keywords:
+      words.extend(ptn.words)
+    elif type(ptn) is P and ptn.matcher == ptn.match_ptn:
+      todo.append(ptn.ptn)
+    elif type(ptn) is PatternOr:
+      todo.extend(reversed(ptn.patterns))
+    else:
+      return None
+  return Keywords(words)
+
+# ==============================================================================
+
+def _analyzeFirst(root):
+  """
+  Calculate the FIRST set and nullability (see :func:`Pattern.getFirstSet`) of
+  the patterns reachable from the root pattern and cache them in each pattern.
+  The values are calculated by iterating until they no longer change, so
+  recursive V references are handled. Patterns with debug output can match
+  anything, so they are never skipped.
+  """
+  patterns = [root]
+  seen = set([id(root)])
+  todo = [root]
+  while len(todo) > 0:
+    ptn = todo.pop()
+    subs = [ptn.ptn] if type(ptn) is P and ptn.matcher == ptn.match_ptn else _subPatterns(ptn)
+    for sub in subs:
+      if id(sub) not in seen:
+        seen.add(id(sub))
+        patterns.append(sub)
+        todo.append(sub)
+  patterns.reverse() # Contained patterns first, so fewer iterations are needed
+
+  EMPTY = frozenset()
+  first = dict((id(ptn), EMPTY) for ptn in patterns)
+  nullable = dict((id(ptn), False) for ptn in patterns)
+
+  def union(first1, first2):
+    return None if first1 is None or first2 is None else first1 | first2
+
+  def calculate(ptn):
+    kind = type(ptn)
+    if ptn.dbg is not None and not (isinstance(ptn.dbg, DebugOptions) and ptn.dbg.isHidden()):
+      return None, True
+
+    if kind is P:
+      if ptn.matcher == ptn.match_str:
+        return (frozenset(ptn.string[0]), False) if ptn.size > 0 else (EMPTY, True)
+      if ptn.matcher == ptn.match_n: return (None, False) if ptn.n > 0 else (EMPTY, True)
+      if ptn.matcher == ptn.match_TF: return EMPTY, ptn.TF
+      if ptn.matcher == ptn.match_ptn: return first[id(ptn.ptn)], nullable[id(ptn.ptn)]
+      return None, True
+    if kind is S: return ptn.chars, False
+    if kind is Keywords:
+      if "" in ptn.table: return EMPTY, True
+      return frozenset(word[0] for word in ptn.words), False
+    if kind is R:
+      charClass = ptn.charClass
+      if charClass is None or len(charClass.lows) > 0: return None, False
+      return charClass.chars, False
+    if kind is I: return None, ptn.size == 0
+    if kind in (SOL, EOL, Cc, Cp, Cl, Col, Cs, PatternNot, PatternLookAhead):
+      return EMPTY, True
+    if kind in (C, Cg, Cb, Sc, V, PatternCaptureN, PatternFnWrap):
+      subs = _subPatterns(ptn)
+      if len(subs) != 1: return None, True
+      return first[id(subs[0])], nullable[id(subs[0])]
+
+    if kind is PatternAnd:
+      result, isNullable = EMPTY, True
+      for sub in ptn.patterns:
+        if not isNullable: break
+        result = union(result, first[id(sub)])
+        isNullable = nullable[id(sub)]
+      return result, isNullable
+    if kind is PatternOr:
+      result, isNullable = EMPTY, False
+      for sub in ptn.patterns:
+        result = union(result, first[id(sub)])
+        isNullable = isNullable or nullable[id(sub)]
+      return result, isNullable
+    if kind in (PatternRepeat, PatternUntil):
+      sub = ptn.patterns[0]
+      isNullable = nullable[id(sub)] or ptn.n == 0 or ptn.matcher == ptn.match_at_most_n
+      return first[id(sub)], isNullable
+
+    # Stack patterns and unknown patterns can match anything. The alternatives
+    # that start with a Cut are never skipped, so the cut is always made.
+    return None, True
+
+  changed = True
+  while changed:
+    changed = False
+    for ptn in patterns:
+      result, isNullable = calculate(ptn)
+      if result != first[id(ptn)] or isNullable != nullable[id(ptn)]:
+        first[id(ptn)] = result
+        nullable[id(ptn)] = isNullable
+        changed = True
+
+  version = _cacheVersion()
+  for ptn in patterns:
+    ptn._first = first[id(ptn)]
+    ptn._nullable = nullable[id(ptn)]
+    ptn._firstVersion = version
+
+# ==============================================================================
+
+def _analyzeLeftRecursion(root):
+  """
+  Find the left recursive cycles of V objects reachable from the root pattern
+  (V objects that can be matched again at the same index) and cache the result
+  in each pattern (see :func:`V.isLeftRecursive`). At least one V object in each
+  cycle is marked 'head' and is matched by growing a seed. The other V objects
+  in the cycles, and the patterns they match at the start of their pattern, are
+  marked 'cycle'. Their results change while a seed is grown, so they are not
+  memoized.
+  """
+  root.getFirstSet()   # Whether the patterns are nullable
+
+  def leftPatterns(ptn):
+    if type(ptn) is not PatternAnd: return _subPatterns(ptn)
+    subs = []
+    for sub in ptn.patterns:
+      subs.append(sub)
+      if not sub._nullable: break
+    return subs
+
+  # Find the reachable patterns
+  patterns = {id(root): root}
+  todo = [root]
+  while len(todo) > 0:
+    for sub in _subPatterns(todo.pop()):
+      if id(sub) not in patterns:
+        patterns[id(sub)] = sub
+        todo.append(sub)
+
+  # Find the V objects that can be matched at the start of the pattern of each
+  # V object, and the patterns that are matched before them
+  calls, starts = {}, {}
+  Vs = [ptn for ptn in patterns.values() if isinstance(ptn, V)]
+  for v in Vs:
+    seen = set()
+    calls[id(v)], starts[id(v)] = [], []
+    todo = list(v.patterns[:1])
+    while len(todo) > 0:
+      ptn = todo.pop()
+      if id(ptn) in seen: continue
+      seen.add(id(ptn))
+      if isinstance(ptn, V):
+        calls[id(v)].append(ptn)
+      else:
+        starts[id(v)].append(ptn)
+        todo.extend(leftPatterns(ptn))
+
+  # Every cycle has a back edge in a depth first search, and the V objects that
+  # the back edges lead to are the heads.
+  heads = set()
+  state = {}   # 1 while a V object is being searched, 2 when it is done
+  for v in Vs:
+    if id(v) in state: continue
+    state[id(v)] = 1
+    stack = [(v, iter(calls[id(v)]))]
+    while len(stack) > 0:
+      for call in stack[-1][1]:
+        if id(call) not in state:
+          state[id(call)] = 1
+          stack.append((call, iter(calls[id(call)])))
+          break
+        if state[id(call)] == 1: heads.add(id(call))
+      else:
+        state[id(stack.pop()[0])] = 2
+
+  # The V objects in a cycle can reach a head and can be reached from it
+  callers = dict((id(v), []) for v in Vs)
+  for v in Vs:
+    for call in calls[id(v)]: callers[id(call)].append(v)
+  def reachable(head, edges):
+    found = {id(head): head}
+    todo = [head]
+    while len(todo) > 0:
+      for ptn in edges[id(todo.pop())]:
+        if id(ptn) not in found:
+          found[id(ptn)] = ptn
+          todo.append(ptn)
+    return found
+  cycle = {}
+  for head in [v for v in Vs if id(v) in heads]:
+    before = reachable(head, callers)
+    cycle.update((key, v) for key, v in reachable(head, calls).items() if key in before)
+
+  version = _cacheVersion()
+  for ptn in patterns.values():
+    ptn._leftRecursion = None
+    ptn._leftRecursionVersion = version
+  for key, v in cycle.items():
+    for ptn in starts[key]: ptn._leftRecursion = 'cycle'
+  for key, v in cycle.items():
+    v._leftRecursion = 'head' if key in heads else 'cycle'
+
+# ==============================================================================
+
+_regexFeatures = []
+
+def _regexSupported():
+  """
+  Check whether the ``re`` module supports atomic groups and possessive
+  quantifiers, which are needed to keep the PEG rules in regular expressions.
+  """
+  if len(_regexFeatures) == 0:
+    import re
+    try:
+      re.compile("(?>a|b)c*+")
+      _regexFeatures.append(True)
+    except re.error:
+      _regexFeatures.append(False)
+  return _regexFeatures[0]
+
+# ==============================================================================
+
+def _regexSource(pattern, active=()):
+  """
+  Get the source of a regular expression for a pattern (see
+  :func:`Pattern.getRegex`). The source is cached until the grammar changes.
+
+  :param pattern: The pattern to translate.
+  :param active: The V objects that are being translated, to detect recursion.
+  :return: The source of the regular expression, or None if the pattern can't
+           be expressed as a regular expression.
+  """
+  if pattern._regexSourceVersion != Pattern.grammarVersion:
+    try:
+      source = _translateRegex(pattern, active)
+    except RuntimeError:  # Too deeply nested
+      source = None
+    pattern._regexSource = source
+    pattern._regexSourceVersion = _cacheVersion()
+  return pattern._regexSource
+
+# ------------------------------------------------------------------------------
+
+def _translateRegex(pattern, active):
+  import re
+  if pattern.dbg is not None and not (isinstance(pattern.dbg, DebugOptions) and
+                                      pattern.dbg.isHidden()):
+    return None
+
+  kind = type(pattern)
+  if kind is P:
+    if pattern.matcher == pattern.match_str: return re.escape(pattern.string)
+    if pattern.matcher == pattern.match_n: return ".{%d}" % pattern.n
+    if pattern.matcher == pattern.match_neg: return "(?!.{%d}).*+" % pattern.n
+    if pattern.matcher == pattern.match_TF: return "" if pattern.TF else "(?!)"
+    if pattern.matcher == pattern.match_ptn: return _regexSource(pattern.ptn, active)
+    return None
+
+  if kind is S:
+    if len(pattern.set) == 0: return "(?!)"
+    return "[{0}]".format("".join(re.escape(chr) for chr in pattern.set))
+
+  if kind is R:
+    if pattern.charClass is None: return None
+    if len(pattern.ranges) == 0: return "(?!)"
+    return "[{0}]".format("".join(re.escape(rng[0]) + "-" + re.escape(rng[1])
+                                  for rng in pattern.ranges))
+
+  if kind is Keywords:
+    if len(pattern.words) == 0: return "(?!)"
+    if len(pattern.words) > Keywords.maxRegexWords: return None
+    return "(?>{0})".format("|".join(re.escape(word) for word in pattern.words))
+
+  if kind is SOL: return r"(?:\A|(?<=\n)|(?<=\r)(?!\n))"
+  if kind is EOL: return r"(?:\Z|(?=\r)|(?<!\r)(?=\n))"
+
+  if kind is V:
+    if len(pattern.patterns) == 0 or id(pattern) in active: return None
+    return _regexSource(pattern.patterns[0], active + (id(pattern),))
+
+  if kind is PatternOr and pattern.getKeywords() is not None and \
+     len(pattern.getKeywords().words) > Keywords.maxRegexWords:
+    return None
+
+  if kind in (PatternAnd, PatternOr):
+    # Sequences and choices are flattened, so long chains don't nest
+    parts = []
+    todo = list(reversed(pattern.patterns))
+    while len(todo) > 0:
+      ptn = todo.pop()
+      if type(ptn) is kind and ptn.dbg is None:
+        todo.extend(reversed(ptn.patterns))
+        continue
+      source = _regexSource(ptn, active)
+      if source is None: return None
+      parts.append(source)
+    if kind is PatternAnd: return "".join(parts)
+    return "(?>{0})".format("|".join(parts))
+
+  if kind is PatternNot:
+    source = _regexSource(pattern.patterns[0], active)
+    return None if source is None else "(?!{0})".format(source)
+
+  if kind is PatternLookAhead:
+    source = _regexSource(pattern.patterns[0], active)
+    return None if source is None else "(?={0})".format(source)
+
+  if kind is PatternUntil:
+    # The characters that can't start the terminator are skipped at once
+    first, nullable = pattern.terminator.getFirstSet()
+    source = _regexSource(pattern.terminator, active)
+    if isinstance(first, frozenset) and len(first) > 0 and not nullable and \
+       source is not None:
+      chars = "".join(re.escape(chr) for chr in sorted(first))
+      return "(?:[^{0}]++|(?!{1}).)*+".format(chars, source)
+
+  if kind in (PatternRepeat, PatternUntil):
+    source = _regexSource(pattern.patterns[0], active)
+    if source is None: return None
+    n = pattern.n
+    if pattern.matcher == pattern.match_n:
+      repeat = "{%d}" % n
+    elif pattern.matcher == pattern.match_at_most_n:
+      repeat = "{0,%d}+" % n
+    else:
+      repeat = {0: "*+", 1: "++"}.get(n, "{%d,}+" % n)
+    return "(?:{0}){1}".format(source, repeat)
+
+  return None
+
+# ==============================================================================
+
 class PatternFnWrap(CompositePattern):
   """
   Pass the match to the given function and return the match returned by the
@@ -2428,7 +4075,10 @@ class PatternFnWrap(CompositePattern):
     match = self.patterns[0].match(string, index, context)
     if match is None: return None
 
-    return self.fn(match)
+    # The function can keep the match, so it is given a match with its own
+    # captures, and the containing patterns change a copy of the result.
+    match = self.fn(match._detach())
+    return match._copy() if isinstance(match, Match) else match
 
   # ----------------------------------------------------------------------------
 
@@ -2492,7 +4142,8 @@ class PatternCaptureN(CompositePattern):
 
     newmatch = Match(string, index, match.end)
     try:
-      newmatch._addCapture(match.captures[self.n])
+      newmatch._addCapture(match._captures[self.n])
+      newmatch._lazy = match._lazy
     except IndexError:
       if self.default is not None:
         newmatch._addCapture(self.default)
@@ -2505,13 +4156,39 @@ class PatternCaptureN(CompositePattern):
     n = self.n if self.default is None else "({0},{1})".format(self.n, self.default)
     return "({0})/{1}".format(repr(self.patterns[0]),n)
 
+# ==============================================================================
+
+def _operands(pattern):
+  """
+  Get the patterns of the chain of sequences or choices that a PatternAnd or
+  PatternOr starts (see :func:`PatternAnd.getOperands`). The patterns of an
+  operand of the same kind are added in its place, unless it is named or has
+  debug options (so that it is still shown in debug output), or it is a
+  ptn1 - ptn2 sequence.
+  """
+  kind = type(pattern)
+  operands = []
+  todo = list(reversed(pattern.patterns))
+  while len(todo) > 0:
+    ptn = todo.pop()
+    if type(ptn) is kind and ptn.name is None and ptn.dbg is None and \
+       not getattr(ptn, 'is_not_ptn', False):
+      todo.extend(reversed(ptn.patterns))
+    else:
+      operands.append(ptn)
+  return operands
+
 # ===============================================================================
 
 class PatternAnd(CompositePattern):
   """
-  Match pattern1 followed by pattern2.
+  Match pattern1 followed by pattern2. A chain of sequences (e.g.,
+  ``a * b * c``) is matched as a single sequence of the patterns (see
+  :func:`getOperands`).
   """
   precedence = 6
+  _operands        = None  # The cached result of getOperands()
+  _operandsVersion = -1    # The grammar version of the cached result
 
   # ----------------------------------------------------------------------------
 
@@ -2537,8 +4214,12 @@ class PatternAnd(CompositePattern):
     if self.is_not_ptn:
       self.precedence = 7
 
-    if isinstance(pattern1, PatternAnd): pattern1.is_sub_and = True
-    if isinstance(pattern2, PatternAnd): pattern2.is_sub_and = True
+    # Back captures in a sub-sequence are visible in the containing sequence.
+    # This changes how the sub-sequence is matched, so the grammar changes.
+    for ptn in (pattern1, pattern2):
+      if isinstance(ptn, PatternAnd) and not ptn.is_sub_and:
+        ptn.is_sub_and = True
+        ptn._changed()
 
   # ----------------------------------------------------------------------------
 
@@ -2563,15 +4244,48 @@ class PatternAnd(CompositePattern):
     :param context: Information that is forwarded between matches.
     """
 
+    # The sequences in a chain are matched as one sequence, unless they are
+    # shown in debug output or their results may be memoized.
+    patterns = self.patterns
+    debug = context.debug if context is not None else None
+    if string.memo is None and \
+       (debug is None or isinstance(debug, DebugOptions) and debug.isHidden()):
+      patterns = self._operands if self._operandsVersion == Pattern.grammarVersion \
+                 else self.getOperands()
+
     MATCH = Match(string, index)
-    # Make sure all the patterns match
-    for pattern in self.patterns:
+    start = len(string.captureBuffer)
+    # Make sure all the patterns match. The captures of the patterns are added
+    # to the capture buffer in order.
+    for pattern in patterns:
       match = pattern.match(string, index, context)
       if not isinstance(match, Match): return None
-      MATCH._addSubmatch(match)
       index = match.end
     MATCH.end = index
-    return MATCH
+    return MATCH._setCaptureRange(string, start)
+
+  # ----------------------------------------------------------------------------
+
+  def getOperands(self):
+    """
+    Get the patterns of the chain of sequences that this sequence starts. The
+    chain ``a * b * c`` is built as ``(a * b) * c``, and is matched as the
+    sequence of ``a``, ``b`` and ``c``. A sequence in the chain that is named or
+    has debug options is kept as one pattern, so that it is still shown in
+    debug output. The result is cached until the grammar changes.
+
+    >>> inner = P('a') * 'b'
+    >>> outer = inner * (P('c') * 'd')
+    >>> outer.getOperands()
+    [P('a'), P('b'), P('c'), P('d')]
+    >>> inner = inner.setName('AB')
+    >>> outer, outer.getOperands()[0] is inner
+    (<AB>*P('c')*P('d'), True)
+    """
+    if self._operandsVersion != Pattern.grammarVersion:
+      self._operands = _operands(self)
+      self._operandsVersion = _cacheVersion()
+    return self._operands
 
   # ----------------------------------------------------------------------------
 
@@ -2582,15 +4296,23 @@ class PatternAnd(CompositePattern):
       notPtn = self.patterns[0].getPatterns()[0]
       return "%s - %s" % (self._addPrn(self.patterns[1]), self._addPrn(notPtn))
     else:
-      return "{0}*{1}".format(self._addPrn(self.patterns[0]), self._addPrn(self.patterns[1]))
+      return "*".join(self._addPrn(ptn) for ptn in self.patterns)
 
 # ==============================================================================
 
 class PatternOr(CompositePattern):
   """
-  Look for the first pattern in the list that matches the string.
+  Look for the first pattern in the list that matches the string. A chain of
+  choices (e.g., ``a + b + c``) is matched as a single list of alternatives
+  (see :func:`getOperands`).
   """
   precedence = 7
+  _operands         = None  # The cached result of getOperands()
+  _operandsVersion  = -1    # The grammar version of the cached result
+  _charClass        = None  # The cached result of getCharClass()
+  _charClassVersion = -1    # The grammar version of the cached result
+  _keywords         = None  # The cached result of getKeywords()
+  _keywordsVersion  = -1    # The grammar version of the cached result
 
   # ----------------------------------------------------------------------------
 
@@ -2627,36 +4349,134 @@ class PatternOr(CompositePattern):
     :param context: Information that is forwarded between matches.
     """
 
-    for pattern in self.patterns:
+    # Alternatives are not tried after a Cut past the index
+    cut = string.cutIndex
+
+    # Alternatives are matched one at a time for debug output
+    if context is not None and context.debug is not None:
+      for pattern in self.patterns:
+        match = pattern.match(string, index, context)
+        if isinstance(match, Match): return match
+        if string.cutIndex != cut and string.cutIndex > index: return None
+      return None
+
+    # Alternatives that match single characters are tested at once
+    charClass = self._charClass if self._charClassVersion == Pattern.grammarVersion \
+                else self.getCharClass()
+    if charClass is not None:
+      if len(string) - index < 1 or string[index] not in charClass.lookup: return None
+      return Match(string, index, index + 1)
+
+    # Alternatives that are literal strings are looked up at once
+    keywords = self._keywords if self._keywordsVersion == Pattern.grammarVersion \
+               else self.getKeywords()
+    if keywords is not None:
+      end = keywords.lookup(string.string, index)
+      return None if end is None else Match(string, index, end)
+
+    # Skip the alternatives that can't start with the next character
+    if self._firstVersion != Pattern.grammarVersion: _analyzeFirst(self)
+    chr = string[index] if index < len(string) else None
+    if string.binary and chr is not None: chr = _BYTE_CHARS[chr]
+    # The choices in a chain are tried as one list of alternatives, unless their
+    # results may be memoized.
+    patterns = self.patterns
+    if string.memo is None:
+      patterns = self._operands if self._operandsVersion == Pattern.grammarVersion \
+                 else self.getOperands()
+    for pattern in patterns:
+      if not pattern._nullable and pattern._first is not None and \
+         (chr is None or chr not in pattern._first):
+        continue
       match = pattern.match(string, index, context)
       if isinstance(match, Match): return match
+      if string.cutIndex != cut and string.cutIndex > index: return None
     return None
 
   # ----------------------------------------------------------------------------
 
-  def __repr__(self):
-    return "{0} + {1}".format(self._addPrn(self.patterns[0]), self._addPrn(self.patterns[1]))
+  def getCharClass(self):
+    """
+    Get the characters matched by this pattern if every alternative matches a
+    single character (i.e., the alternatives are S, R or single character P
+    patterns). The result is cached until the grammar changes.
 
-# ==============================================================================
+    :return: A :class:`CharClass`, or None if an alternative matches anything
+             other than a single character.
 
-class PatternNot(CompositePattern):
-  """
-  Verify that the text ahead does not match the pattern. The string index does
-  not advance.
-  """
-  precedence = 5
+    >>> (alpha + digit + '_').getCharClass()
+    CharClass('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz')
+    >>> (alpha + P('--')).getCharClass() is None
+    True
+    """
+    if self._charClassVersion != Pattern.grammarVersion:
+      self._charClass = _charClass(self)
+      self._charClassVersion = _cacheVersion()
+    return self._charClass
 
   # ----------------------------------------------------------------------------
 
-  def __init__(self, pattern):
-    CompositePattern.__init__(self)
-    P.isValidValue(pattern, msg ="Invalid '-ptn' expression")
-    self.patterns.append(P.asPattern(pattern))
+  def getKeywords(self):
+    """
+    Get a :class:`Keywords` pattern that matches the same strings as this
+    pattern if every alternative is a literal string (a P pattern of a string
+    or a Keywords pattern). The result is cached until the grammar changes.
 
-  # ----------------------------------------------------------------------------
+    :return: A :class:`Keywords` pattern, or None if an alternative is not a
+             literal string.
 
-  @ConfigBackCaptureString4match
-  def match(self, string, index=0, context=None):
+    >>> (P('if') + P('in') + P('is') + 'import').getKeywords()
+    Keywords(['if', 'in', 'is', 'import'])
+    >>> (P('if') + S('ab')).getKeywords() is None
+    True
+    """
+    if self._keywordsVersion != Pattern.grammarVersion:
+      self._keywords = _keywords(self)
+      self._keywordsVersion = _cacheVersion()
+    return self._keywords
+
+  # ----------------------------------------------------------------------------
+
+  def getOperands(self):
+    """
+    Get the alternatives of the chain of choices that this choice starts (see
+    :func:`PatternAnd.getOperands`). A choice in the chain that is named or has
+    debug options is kept as one alternative. The result is cached until the
+    grammar changes.
+
+    >>> (P('a') + 'b' + (P('c') + 'd').setName('CD')).getOperands()
+    [P('a'), P('b'), P('c') + P('d')]
+    """
+    if self._operandsVersion != Pattern.grammarVersion:
+      self._operands = _operands(self)
+      self._operandsVersion = _cacheVersion()
+    return self._operands
+
+  # ----------------------------------------------------------------------------
+
+  def __repr__(self):
+    return " + ".join(self._addPrn(ptn) for ptn in self.patterns)
+
+# ==============================================================================
+
+class PatternNot(CompositePattern):
+  """
+  Verify that the text ahead does not match the pattern. The string index does
+  not advance.
+  """
+  precedence = 5
+
+  # ----------------------------------------------------------------------------
+
+  def __init__(self, pattern):
+    CompositePattern.__init__(self)
+    P.isValidValue(pattern, msg ="Invalid '-ptn' expression")
+    self.patterns.append(P.asPattern(pattern))
+
+  # ----------------------------------------------------------------------------
+
+  @ConfigBackCaptureString4match
+  def match(self, string, index=0, context=None):
     """
 
     >>> p = -P("bob")
@@ -2670,7 +4490,9 @@ class PatternNot(CompositePattern):
     :param context: Information that is forwarded between matches.
     """
 
+    cut = string.cutIndex
     match = self.patterns[0](string, index, context)
+    string.cutIndex = cut
     if not isinstance(match, Match): return Match(string, index, index)
     return None
 
@@ -2686,6 +4508,8 @@ class PatternRepeat(CompositePattern):
   Repeat a pattern n or more times, n or less times, or exactly n times.
   """
   precedence = 4
+  _scan        = None  # The cached result of getScanClass()
+  _scanVersion = -1    # The grammar version of the cached result
 
   # ----------------------------------------------------------------------------
 
@@ -2722,10 +4546,94 @@ class PatternRepeat(CompositePattern):
 
   @ConfigBackCaptureString4match
   def match(self, string, index=0, context=None):
+    # A repeated single character pattern is matched by scanning the string,
+    # unless the characters are matched one at a time for debug output
+    if context is None or context.debug is None:
+      scan = self._scan if self._scanVersion == Pattern.grammarVersion \
+             else self.getScanClass()
+      if scan is not None: return self.match_scan(string, index, scan)
     return self.matcher(string, index, context)
 
   # ----------------------------------------------------------------------------
 
+  def match_scan(self, string, index, scan):
+    """
+    Match the characters of a repeated single character pattern in one loop,
+    without matching the pattern for each character.
+
+    >>> p = (1 - S(" \\t"))**1
+    >>> p("abc def")
+    abc
+    >>> p(" abc") is None
+    True
+    >>> p = (R("az") - S("aeiou"))**-3
+    >>> p("bcdfg")
+    bcd
+    >>> p("bad")
+    b
+
+    The characters are matched one at a time when debug output is shown:
+
+    >>> (S('ab')**-1).debug(True).match('b')
+    Pattern: (1.1) S('ab')
+      Result: 'b'
+    Pattern: (1.1) S('ab')**-1
+      Result: 'b'
+    b
+
+    :param string: The string to match
+    :param index: The location in string to start match
+    :param scan: The (include, exclude) tuple of :func:`getScanClass`.
+    """
+    include, exclude = scan
+    text  = string.string
+    limit = len(text)
+    if self.matcher != self.match_at_least_n: limit = min(limit, index + self.n)
+
+    end = index
+    if include is None and exclude is None:
+      end = max(end, limit)
+    elif exclude is None:
+      while end < limit and text[end] in include: end += 1
+    elif include is None:
+      while end < limit and text[end] not in exclude: end += 1
+    else:
+      while end < limit and text[end] in include and text[end] not in exclude: end += 1
+
+    if self.matcher != self.match_at_most_n and end - index < self.n:
+      # The characters up to the end were examined (see MemoTable.edit)
+      if string.reach is not None and end > string.reach: string.reach = end
+      return None
+    return Match(string, index, end)
+
+  # ----------------------------------------------------------------------------
+
+  def getScanClass(self):
+    """
+    Get the characters matched by the repeated pattern if it matches a single
+    character: a character class (S, R and single character P patterns and
+    alternatives of them), any character (``P(1)``), or a character class that
+    excludes another one (e.g., ``1 - S(' \\t')``). The result is cached until
+    the grammar changes.
+
+    :return: A tuple (include, exclude) of the lookup tables of the characters
+             that are matched and the characters that are not matched (None for
+             any character and no character respectively), or None if the
+             repeated pattern is not a single character pattern.
+
+    >>> include, exclude = ((P(1) - S(" "))**0).getScanClass()
+    >>> include is None, ' ' in exclude, 'a' in exclude
+    (True, True, False)
+    >>> (P("ab")**0).getScanClass() is None
+    True
+    """
+    if self._scanVersion != Pattern.grammarVersion:
+      self._scan = _scanClass(self.patterns[0])
+      self._scanVersion = _cacheVersion()
+    return self._scan
+
+  # ----------------------------------------------------------------------------
+
   def match_n(self, string, index=0, context=None):
     """
 
@@ -2736,14 +4644,13 @@ class PatternRepeat(CompositePattern):
     abc
     """
     MATCH = Match(string, index)
-    cnt = 0
+    start = len(string.captureBuffer)
     for i in range(self.n):
       match = self.patterns[0].match(string, index, context)
       if not isinstance(match, Match): return None
       index = match.end
-      MATCH._addSubmatch(match)
       MATCH._setEnd(index)
-    return MATCH
+    return MATCH._setCaptureRange(string, start)
 
   # ----------------------------------------------------------------------------
 
@@ -2759,17 +4666,20 @@ class PatternRepeat(CompositePattern):
     abcabc
     """
     MATCH = Match(string, index)
+    start = len(string.captureBuffer)
+    cut = string.cutIndex
     cnt = 0
     while True:
       match = self.patterns[0].match(string, index, context)
 
       if not isinstance(match, Match):
-        return MATCH._setEnd(index) if cnt >= self.n else None
-
-      MATCH._addSubmatch(match)
+        if cnt < self.n: return None
+        if string.cutIndex != cut and string.cutIndex > index: return None
+        return MATCH._setEnd(index)._setCaptureRange(string, start)
 
       # No progress, so it matches infinite times
-      if match.end == index: return MATCH._setEnd(index)
+      if match.end == index:
+        return MATCH._setEnd(index)._setCaptureRange(string, start)
 
       cnt += 1
       index = match.end
@@ -2786,12 +4696,15 @@ class PatternRepeat(CompositePattern):
     abc
     """
     MATCH = Match(string, index)
+    start = len(string.captureBuffer)
+    cut = string.cutIndex
     for i in range(self.n):
       match = self.patterns[0].match(string, index, context)
-      if not isinstance(match, Match): return MATCH._setEnd(index)
-      MATCH._addSubmatch(match)
+      if not isinstance(match, Match):
+        if string.cutIndex != cut and string.cutIndex > index: return None
+        break
       index = match.end
-    return MATCH._setEnd(index)
+    return MATCH._setEnd(index)._setCaptureRange(string, start)
 
   # ----------------------------------------------------------------------------
 
@@ -2803,6 +4716,89 @@ class PatternRepeat(CompositePattern):
 
 # ==============================================================================
 
+class PatternUntil(PatternRepeat):
+  """
+  Match any text until a terminator pattern matches (see :func:`matchUntil`).
+  This is the pattern ``(1 - terminator)**0``, but when the terminator is a
+  literal string, a choice of literal strings or a character class, the end of
+  the text is found with a single search of the string (``str.find`` or the
+  ``re`` module) instead of trying the terminator at every character.
+  """
+  _search        = None  # The cached result of getSearch()
+  _searchVersion = -1    # The grammar version of the cached result
+
+  # ----------------------------------------------------------------------------
+
+  def __init__(self, terminator):
+    """
+    :param terminator: The pattern that ends the text.
+    """
+    PatternRepeat.__init__(self, (1 - terminator) & 'hide', 0)
+    self.terminator = terminator
+
+  # ----------------------------------------------------------------------------
+
+  @ConfigBackCaptureString4match
+  def match(self, string, index=0, context=None):
+    """
+
+    >>> p = PatternUntil(P("*/"))
+    >>> p("comment*/ code")
+    comment
+    >>> p("no end")
+    no end
+    >>> PatternUntil(newline)("first\\r\\nsecond")
+    first
+
+    :param string: The string to match
+    :param index: The location in string to start match
+    :param context: Information that is forwarded between matches.
+    """
+    search = self._search if self._searchVersion == Pattern.grammarVersion \
+             else self.getSearch()
+    if search is not None: return Match(string, index, search(string.string, index))
+
+    # Terminators that need the generic loop
+    scan = self._scan if self._scanVersion == Pattern.grammarVersion \
+           else self.getScanClass()
+    if scan is not None: return self.match_scan(string, index, scan)
+    return self.matcher(string, index, context)
+
+  # ----------------------------------------------------------------------------
+
+  def getSearch(self):
+    """
+    Get a function that finds the terminator if the terminator is a literal
+    string, a choice of literal strings or a character class. The result is
+    cached until the grammar changes.
+
+    :return: A function ``fn(text, index)`` that returns the index of the first
+             location at or after *index* where the terminator matches (or the
+             end of the text), or None if the terminator needs the generic loop.
+
+    >>> matchUntil(newline).getSearch()("ab\\ncd", 0)
+    2
+    >>> matchUntil(P("a")**1).getSearch() is None
+    True
+    """
+    if self._searchVersion != Pattern.grammarVersion:
+      self._search = _untilSearch(self.terminator)
+      self._searchVersion = _cacheVersion()
+    return self._search
+
+  # ----------------------------------------------------------------------------
+
+  def getRegex(self):
+    """
+    Get the regular expression of the pattern (see :func:`Pattern.getRegex`).
+    The pattern has no regular expression if the terminator is found with a
+    search (see :func:`getSearch`).
+    """
+    if self.getSearch() is not None: return None
+    return PatternRepeat.getRegex(self)
+
+# ==============================================================================
+
 class PatternLookAhead(CompositePattern):
   """
   Check whether the pattern matches the string that follows without consuming the
@@ -2835,7 +4831,9 @@ class PatternLookAhead(CompositePattern):
     :param index: The location in string to start match
     :param context: Information that is forwarded between matches.
     """
+    cut = string.cutIndex
     match = self.patterns[0].match(string, index, context)
+    string.cutIndex = cut
     if isinstance(match, Match): return match._setEnd(index)
     return None
 
@@ -2860,30 +4858,152 @@ newline     = P("\r\n") + P("\r") + P("\n")
 # BackCaptureString
 # ==============================================================================
 
+# The latin-1 character of each byte value
+_BYTE_CHARS = tuple(chr(byte) for byte in range(256))
+
+def _binaryView(string):
+  """
+  Get a read-only memoryview of the bytes of a bytes-like subject (bytes,
+  bytearray, memoryview or mmap), or None if the string is not bytes-like. The
+  bytes are not copied, and slices of the view are memoryviews. Before Python
+  3.8, the bytes of a writable subject are copied to get a read-only view.
+
+  Python 2 memoryviews are indexed with strings, so the bytes are copied to a
+  str (the bytes type of Python 2), which is returned to be matched as text.
+  """
+  import mmap
+  if isinstance(string, str) or \
+     not isinstance(string, (bytes, bytearray, memoryview, mmap.mmap)):
+    return None
+  if not hasattr(memoryview, 'cast'):   # Python 2
+    return string[:] if isinstance(string, mmap.mmap) else memoryview(string).tobytes()
+  view = memoryview(string)
+  if view.format != 'B' or view.ndim != 1: view = view.cast('B')
+  if view.readonly: return view
+  return view.toreadonly() if hasattr(view, 'toreadonly') else memoryview(view.tobytes())
+
+# ------------------------------------------------------------------------------
+
+def _lineBreaks(text):
+  """
+  Find the line breaks (\\r\\n, \\r or \\n) in a str or bytes-like text.
+  """
+  import re
+  return re.finditer(r"\r\n|\r|\n" if isinstance(text, str) else br"\r\n|\r|\n", text)
+
+# ------------------------------------------------------------------------------
+
+def _picklable(value):
+  """
+  Copy the memoryview captures of a binary subject, which can't be pickled, as
+  bytes. Capture groups are copied recursively.
+  """
+  if isinstance(value, memoryview): return value.tobytes()
+  if isinstance(value, (list, tuple)): return type(value)(_picklable(item) for item in value)
+  return value
+
+# ==============================================================================
+
 class BackCaptureString(object):
   """
   This class is used to track the string that is being matched against and any
   back captures that are generated. Back captures are stored in a stack. Back
   captures that are added as part of a pattern that fails are removed from the
   stack.
+
+  The captures of the patterns that are being matched are stored in a single
+  capture buffer. The captures of a :class:`Match` are a range of the buffer, so
+  the captures do not need to be copied as the match is returned to the
+  containing patterns. Captures of patterns that fail are removed from the end
+  of the buffer.
+
+  Bytes-like strings (bytes, bytearray, memoryview and mmap) are matched through
+  a read-only memoryview, without decoding or copying them. The characters of
+  str and bytes patterns are matched as latin-1 bytes, and the matched text and
+  the captures are memoryview slices.
+
+  >>> match = (C(alpha**1) * '=' * C(digit**1)).match(bytearray(b"key=42"))
+  >>> [bytes(capture) for capture in match.captures] == [b'key', b'42']
+  True
+  >>> str(match)
+  'key=42'
   """
 
   # ----------------------------------------------------------------------------
 
-  def __init__(self, string):
-    self.string           = string
-    self.backcaptures     = []
-    self.startOfLineIndex = [0]
+  def __init__(self, string, memo=None):
+    """
+    :param string: The string to match against.
+    :param memo: A :class:`MemoTable` used to memoize match results, True to
+           create a MemoTable with the default settings, or None (default) to
+           disable memoization.
+    """
+    view = _binaryView(string)
+    if isinstance(view, str): string, view = view, None   # Python 2 text
+    self.binary           = view is not None  # Whether the string is bytes-like
+    self.string           = string if view is None else view
+    self.backcaptures     = []  # (name, capture) pairs in the order they were added
+    self.backcaptureIndex = {}  # The index of the latest back capture of each name
+    self.previousCapture  = []  # The index of the previous capture of the same name
+    self.captureBuffer    = []  # Captures, Spans and CaptureGroup markers
+    self.startOfLineIndex = [0]    # The index of the start of each line
+    self.linesIndexed     = False  # Whether startOfLineIndex is complete
     self.stringSz         = len(string)
+    self.offset           = 0  # The position of the string in a StreamString
+    self.startLine        = 1  # The line, column and line offset at index 0
+    self.startColumn      = 1
+    self.startLineOffset  = 0
+    self.memo             = None
+    self.seeds            = {}  # The seeds of left recursive V objects that are grown
+    self.cutIndex         = 0   # The position of the latest Cut
+    # The furthest position examined by the patterns, or None if it is not
+    # tracked (see StreamString.match and MemoTable.edit)
+    self.reach            = None
+    if memo is not None: self.setMemo(memo)
     # Pattern to find start of lines
     #self.line = (1 - newline) ** 0 * (newline) ** -1 * Cp()
 
   # ----------------------------------------------------------------------------
 
+  def setMemo(self, memo, clear=True):
+    """
+    Set the table used to memoize match results for this string.
+
+    :param memo: A :class:`MemoTable`, True to create a new MemoTable, or
+           None or False to disable memoization.
+    :param clear: False to keep the results in the table, which must be
+           results for this string (see :func:`StreamString._getString`).
+    :return: The MemoTable or None.
+    """
+    if memo is True: memo = MemoTable()
+    if memo is False: memo = None
+    if memo is not None and clear: memo.clear()
+    self.memo = memo
+    # The results that are kept for edits store the position examined
+    if memo is not None and memo.lookahead is not None and self.reach is None:
+      self.reach = 0
+    return memo
+
+  # ----------------------------------------------------------------------------
+
+  def cut(self, index):
+    """
+    Commit to the choices made before the given position (see :class:`Cut`).
+    The memoized results for the positions before it are released.
+
+    :param index: The position of the cut.
+    """
+    self.cutIndex = index
+    if self.memo is not None: self.memo.release(index)
+
+  # ----------------------------------------------------------------------------
+
   def addNamedCapture(self, name, capture):
     """
     Add a named capture to the list of back captures.
     """
+    self.previousCapture.append(self.backcaptureIndex.get(name, -1))
+    self.backcaptureIndex[name] = len(self.backcaptures)
     self.backcaptures.append((name, capture))
 
   # ----------------------------------------------------------------------------
@@ -2893,12 +5013,9 @@ class BackCaptureString(object):
     Get a named capture from the list. The most recent capture of the given
     name is returned.
     """
-
-    for i in range(self.getStackSize()-1,-1,-1):
-      bcname, capture = self.backcaptures[i]
-      if bcname == name: return capture
-
-    raise IndexError("No backcapture was found for '{0}'".format(name))
+    idx = self.backcaptureIndex.get(name)
+    if idx is None: raise IndexError("No backcapture was found for '{0}'".format(name))
+    return self.backcaptures[idx][1]
 
   # ----------------------------------------------------------------------------
 
@@ -2914,39 +5031,87 @@ class BackCaptureString(object):
     """
     Set the stack back to the given size. If the stack is too large raise an
     Exception.
+
+    >>> string = BackCaptureString("")
+    >>> string.addNamedCapture("q", "'")
+    >>> string.addNamedCapture("q", '"')
+    >>> string.setStackSize(1)
+    >>> string.getNamedCapture("q")
+    "'"
     """
     sz = len(self.backcaptures)
     if size == sz: return
     if sz < size: raise ValueError("The backcaptures stack is shorter than "
                                    "expected.")
 
-    self.backcaptures = self.backcaptures[0:size]
+    # Restore the latest capture of the names of the removed captures
+    index = self.backcaptureIndex
+    for i in range(sz - 1, size - 1, -1):
+      previous = self.previousCapture[i]
+      if previous < 0: del index[self.backcaptures[i][0]]
+      else: index[self.backcaptures[i][0]] = previous
+    del self.backcaptures[size:]
+    del self.previousCapture[size:]
 
   # ----------------------------------------------------------------------------
 
   def getColumnNumber(self, index):
     """
-    Get the index of the start of the line in the `startOfLineIndex` array.
+    Get the column number at the given position in the string. The column
+    numbers start with 1.
 
-    :param index: The index in the string.
-    :return: The index for the `startOfLineIndex` array that marks the start
-             of the line containing the given index.
+    :param index: The position in the string.
+    :return: The column number associated with the position.
     """
 
-    line = self.getLineNumber(index)
+    line = self.getLineNumber(index) - self.startLine + 1
     col = index - self.startOfLineIndex[line-1]+1
+    if line == 1: col += self.startColumn - 1
     return col
 
   # ----------------------------------------------------------------------------
 
+  def getLineOffset(self, index):
+    """
+    Get the distance from the last end of line character (\\r or \\n) before
+    the given position in the string (see :class:`Col`).
+
+    :param index: The position in the string.
+    :return: The number of characters between the end of line character and
+             the position, or the position if there is no end of line before
+             it.
+
+    >>> string = BackCaptureString("ab\\r\\ncd")
+    >>> string.getLineOffset(1), string.getLineOffset(3), string.getLineOffset(6)
+    (1, 0, 2)
+    """
+    if index <= 0: return self.startLineOffset
+    if self.string[index-1] in ('\r', '\n', 13, 10): return 0
+
+    # The characters between the start of the line and the position are not end
+    # of line characters (a \\r\\n pair ends at the start of the line).
+    line = self.getLineNumber(index) - self.startLine + 1
+    if line == 1: return index + self.startLineOffset
+    return index - self.startOfLineIndex[line-1]
+
+  # ----------------------------------------------------------------------------
+
   def getLineNumber(self, index):
     """
     Get the line number at the given position in the string. The line numbers
     start with 1.
 
+    The start of each line is found in one pass over the string the first time a
+    line number is requested, and the line is found with a binary search.
+
     :param index: The position in the string.
     :return: The line number associated with the position.
+
+    >>> string = BackCaptureString("one\\r\\ntwo\\rthree\\nfour")
+    >>> [string.getLineNumber(i) for i in (0, 4, 5, 9, 15)]
+    [1, 1, 2, 3, 4]
     """
+    import bisect
 
     if index < 0 or self.stringSz < index:
       if index < 0:
@@ -2956,43 +5121,19 @@ class BackCaptureString(object):
         raise IndexError("Error getting line number for position. Index is "
                          "past the end of the string")
 
-    # If the line number is already calculated. Find the line number.
-    if index <= self.startOfLineIndex[-1]:
-      if index == self.startOfLineIndex[-1]: return len(self.startOfLineIndex)
-
-      # TODO: Make a more efficient lookup for line number.
-      for i, startOfLine in enumerate(self.startOfLineIndex):
-        if index < startOfLine: return i
-
-    def nextnewline(idx):
-      NOTFOUND = -2
-      dat = {'idx':idx,'\r':idx-1,'\n':idx-1}
-      def getnext(string):
-        r, n, idx = (dat[i] for i in ('\r','\n','idx'))
-        if r != NOTFOUND and r <= idx: r = string.find('\r', r+1); dat['\r'] = r == -1 and NOTFOUND or r
-        if n != NOTFOUND and n <= idx: n = string.find('\n', n+1); dat['\n'] = n == -1 and NOTFOUND or n
-        if n == NOTFOUND and r == NOTFOUND: return len(string)
-        dat['idx'] = n+1 if n != NOTFOUND and (n < r or n == r+1 or r == NOTFOUND) else r+1
-        return dat['idx']
-
-      return getnext
-
-    # Find start of lines till we get to index
-    startOfLine = self.startOfLineIndex[-1]
-    nextnl = nextnewline(startOfLine)
-    while True:
-      startOfLine = nextnl(self.string)
+    if not self.linesIndexed: self._indexLines()
+    return bisect.bisect_right(self.startOfLineIndex, index) + self.startLine - 1
 
-      # This if is just a precaution to make sure that we don't append indexes
-      # less than the ones on the list.
-      if startOfLine > self.startOfLineIndex[-1]:
-        self.startOfLineIndex.append(startOfLine)
-      if index < startOfLine:
-        return len(self.startOfLineIndex) - 1
-      if index == startOfLine:
-        return len(self.startOfLineIndex)
-    raise IndexError(
-      "Unexpected error calculating line number for string position")
+  # ----------------------------------------------------------------------------
+
+  def _indexLines(self):
+    """
+    Find the start of each line in the string. A line ends with \\r\\n, \\r or
+    \\n.
+    """
+    self.startOfLineIndex = [0]
+    self.startOfLineIndex.extend(match.end() for match in _lineBreaks(self.string))
+    self.linesIndexed = True
 
   # ----------------------------------------------------------------------------
 
@@ -3005,22 +5146,842 @@ class BackCaptureString(object):
   # ----------------------------------------------------------------------------
 
   def __getattr__(self, attr):
+    if attr.startswith('__'): raise AttributeError(attr)
     return getattr(self.string, attr)
 
   # ----------------------------------------------------------------------------
 
+  def __getstate__(self):
+    """
+    Pickle the string and the back captures. The capture buffer and the memo
+    table are only used while matching, so they are not pickled.
+
+    >>> import pickle
+    >>> string = pickle.loads(pickle.dumps(Cb('key', alpha**1).match(b'ab').string))
+    >>> string.binary, bytes(string.string), string.backcaptures
+    (True, b'ab', [('key', b'ab')])
+    """
+    state = dict(self.__dict__)
+    if self.binary: state['string'] = self.string.tobytes()
+    state['backcaptures']  = _picklable(self.backcaptures)
+    state['captureBuffer'] = []
+    state['memo']          = None
+    return state
+
+  # ----------------------------------------------------------------------------
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    if self.binary: self.string = _binaryView(self.string)
+
+  # ----------------------------------------------------------------------------
+
   def __len__(self):
     return len(self.string)
 
   # ----------------------------------------------------------------------------
 
   def __repr__(self):
+    if self.binary: return self.string.tobytes().decode('latin-1')
     return self.string
 
+# ==============================================================================
+# StreamString
+# ==============================================================================
+
+class StreamString(object):
+  """
+  A string that is read in chunks from a file-like object (anything with a
+  ``read(size)`` method) or an iterator of strings, so that large inputs can be
+  matched without reading them into memory.
+
+  Only a window of the text is kept in memory. The text before a position is
+  released with :func:`release` once no match needs to go back to it, e.g. after
+  each match of :func:`matches` or each token of :func:`Tokenizer.getTokens`.
+  Positions, :class:`Cp`, :class:`Cl` and :class:`Col` captures are the same as
+  if the whole text was matched, and the back captures are kept from one match
+  to the next.
+
+  A match is only accepted when at least `lookahead` characters follow the
+  furthest position examined by the match, or at the end of the text, so the
+  result of a pattern must not depend on the text more than `lookahead`
+  characters past the furthest position where one of its patterns succeeded or
+  was tried. Records that are longer than the window are read until they end.
+  The text of a match is a copy of the matched text, so a match does not keep
+  the window in memory.
+
+  >>> import io
+  >>> stream = StreamString(io.StringIO(u"a=1\\nb=22\\nc=333\\n"),
+  ...                       chunkSize=4, lookahead=8)
+  >>> line = C(alpha) * '=' * C(digit**1) * Cl() * newline
+  >>> [(match.start, match.captures) for match in stream.matches(line)]
+  [(0, ['a', '1', 1]), (4, ['b', '22', 2]), (9, ['c', '333', 3])]
+  >>> stream = StreamString(iter(["ab", "", "cd"]), lookahead=1)
+  >>> [str(match) for match in stream.matches(C(alpha) * Cp())]
+  ['a', 'b', 'c', 'd']
+
+  The results memoized in a :class:`MemoTable` are kept when the window moves,
+  so the matches that are tried again after more text is read reuse them.
+
+  >>> num = 'num' | C(digit**1)
+  >>> item = 'item' | num * ',' + num
+  >>> memo = MemoTable()
+  >>> stream = StreamString(iter([u"1,22", u",333", u",4"]), lookahead=1, memo=memo)
+  >>> memo.setMemoized(item, False)
+  >>> [match.captures for match in stream.matches(item)], memo.hits > 0
+  ([['1'], ['22'], ['333'], ['4']], True)
+  >>> memo.isMemoized(item)
+  False
+  """
+
+  # ----------------------------------------------------------------------------
+
+  def __init__(self, source, chunkSize=65536, lookahead=None, memo=None):
+    """
+    :param source: A file-like object or an iterable of strings.
+    :param chunkSize: The number of characters read from a file-like object at
+           a time.
+    :param lookahead: The number of characters that a pattern may look past the
+           text it matches (default `chunkSize`).
+    :param memo: A :class:`MemoTable` used to memoize match results (see
+           :class:`BackCaptureString`).
+    """
+    self.read      = getattr(source, 'read', None)
+    self.source    = source if self.read is not None else iter(source)
+    self.chunkSize = chunkSize
+    self.lookahead = chunkSize if lookahead is None else lookahead
+    self.memo      = memo
+    self.text      = ""     # The text that was read and not released
+    self.offset    = 0      # The position of text[0] in the stream
+    self.position  = 0      # The position that the stream was released to
+    self.eof       = False  # Whether the whole stream was read
+    self.string    = BackCaptureString(self.text, memo)
+    self.current   = True   # Whether self.string holds the text
+    self.released  = 0      # The text released since self.string was created
+
+  # ----------------------------------------------------------------------------
+
+  def _read(self):
+    """
+    Read the next chunk of the stream.
+    """
+    if self.read is not None:
+      chunk = self.read(self.chunkSize)
+    else:
+      chunk = next(self.source, None)
+      while chunk is not None and len(chunk) == 0: chunk = next(self.source, None)
+    if not chunk:
+      self.eof = True
+      return
+    self.text = chunk if len(self.text) == 0 else self.text + chunk
+    self.current = False
+
+  # ----------------------------------------------------------------------------
+
+  def _getString(self):
+    """
+    Get the :class:`BackCaptureString` of the text. The back captures and the
+    position of the text in the stream are copied from the previous string.
+    The memoized results are moved with the window (see
+    :func:`MemoTable.moveWindow`).
+    """
+    if not self.current:
+      previous = self.string
+      string = BackCaptureString(self.text)
+      for attr in ('backcaptures', 'backcaptureIndex', 'previousCapture',
+                   'offset', 'startLine', 'startColumn', 'startLineOffset'):
+        setattr(string, attr, getattr(previous, attr))
+      if self.memo is not None:
+        end = len(previous.string)
+        if len(self.text) + self.released == end: end = None  # Nothing was read
+        self.memo.moveWindow(previous, self.released, end, self.lookahead)
+        string.setMemo(self.memo, clear=False)
+      self.string = string
+      self.current = True
+      self.released = 0
+    return self.string
+
+  # ----------------------------------------------------------------------------
+
+  def match(self, pattern, index, context=None):
+    """
+    Match the pattern at the given position in the stream. The stream is read
+    until the result of the match does not depend on the text that follows.
+
+    :param pattern: The pattern to match.
+    :param index: The position in the stream, which must not be released.
+    :param context: Information that is forwarded between matches.
+    :return: A :class:`Match` with positions in the stream, or None.
+    """
+    if index < self.offset:
+      raise IndexError("The stream before position {0} was released".format(index))
+    start = index - self.offset
+    while True:
+      string = self._getString()
+      string.reach = start
+      match = pattern.match(string, start, context)
+      # The text after the furthest position examined by the match must be read
+      # up to the lookahead, e.g. a repetition that stopped at the end of the
+      # window may continue.
+      if self.eof or string.reach + self.lookahead <= len(self.text): break
+      self._read()
+
+    if not isinstance(match, Match): return match
+    # Detach the match from the window
+    match.captures
+    match.string = _StreamText(self.text[match.start:match.end], index)
+    match.start, match.end = (index, match.end + self.offset)
+    return match
+
+  # ----------------------------------------------------------------------------
+
+  def release(self, index):
+    """
+    Release the text before the given position in the stream. The character
+    before the position is kept for patterns such as :class:`SOL`. The text is
+    only removed from the window once it is at least half of the window, so the
+    window is not copied for each small match.
+
+    :param index: The position in the stream.
+    """
+    self.position = max(self.position, index)
+    keep = index - 1 - self.offset
+    if keep <= 0 or 2 * keep < len(self.text): return
+    string = self._getString()
+    text = self.text
+    lines = [match.end() for match in _lineBreaks(text[:keep+1]) if match.end() <= keep]
+    if lines:
+      string.startColumn = keep - lines[-1] + 1
+      string.startLineOffset = keep - lines[-1]
+    else:
+      string.startColumn += keep
+      string.startLineOffset += keep
+    if text[keep-1] in ('\r', '\n', 13, 10): string.startLineOffset = 0
+    string.startLine += len(lines)
+    string.offset += keep
+    self.offset += keep
+    self.released += keep
+    self.text = text[keep:]
+    self.current = False
+
+  # ----------------------------------------------------------------------------
+
+  def matches(self, pattern, index=0, context=None):
+    """
+    Match the pattern repeatedly, each match starting where the previous match
+    ended. The text before each match is released. This is an iterator
+    function, which stops when the pattern fails or does not consume text.
+
+    :param pattern: The pattern to match.
+    :param index: The position in the stream of the first match.
+    :param context: Information that is forwarded between matches.
+    """
+    while True:
+      self.release(index)
+      match = self.match(pattern, index, context)
+      if not isinstance(match, Match): return
+      yield match
+      if match.end == index: return
+      index = match.end
+
+  # ----------------------------------------------------------------------------
+
+  def _sub(self, pattern, replacement, write, context=None):
+    """
+    Replace the matches of the pattern from the released position to the end
+    of the stream (see :func:`Pattern.sub`). The text is released as it is
+    written.
+
+    :param pattern: The pattern to replace.
+    :param replacement: The template or function.
+    :param write: The function that the pieces of the result are written to.
+    :param context: Information that is forwarded to the matches.
+    :return: The number of matches that were replaced.
+    """
+    if len(self.text) == 0 and not self.eof: self._read()
+    replace = _replacer(replacement, not isinstance(self.text, str))
+    search  = pattern.getStartSearch()
+    index   = self.position
+    count   = 0
+    while True:
+      self.release(index)
+      match = self.match(pattern, index, context)
+      if isinstance(match, Match):
+        write(replace(match))
+        count += 1
+        if match.end > index:
+          index = match.end
+          continue
+
+      # Copy the text up to the next position where a match can start. After
+      # a failed or an empty match, that is after the current position.
+      start = index - self.offset
+      if start >= len(self.text): return count
+      first = start + 1
+      while True:
+        end = first if search is None else search(self.text, first)
+        if end < len(self.text) or self.eof: break
+        # A match may start in the last lookahead characters
+        safe = len(self.text) - self.lookahead
+        if safe > start:
+          write(self.text[start:safe])
+          index += safe - start
+          self.release(index)
+          start = first = index - self.offset
+        self._read()
+      if end > start: write(self.text[start:end])
+      index += end - start
+
+# ==============================================================================
+
+class _StreamText(object):
+  """
+  The text of a match in a :class:`StreamString`, which is indexed with the
+  positions in the stream.
+  """
+
+  # ----------------------------------------------------------------------------
+
+  def __init__(self, string, offset):
+    self.string = string
+    self.offset = offset
+
+  # ----------------------------------------------------------------------------
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return self.string[index.start - self.offset:index.stop - self.offset]
+    return self.string[index - self.offset]
+
+  # ----------------------------------------------------------------------------
+
+  def __len__(self):
+    return self.offset + len(self.string)
+
+  # ----------------------------------------------------------------------------
+
+  def __repr__(self):
+    return self.string
+
+# ==============================================================================
+# MemoTable
+# ==============================================================================
+
+class MemoTable(object):
+  """
+  Memoize the results of matching patterns at a given index (packrat parsing).
+  When a pattern is matched again at the same index, the stored result is
+  returned instead of matching the pattern again. The table holds a limited
+  number of results. When the table is full, the least recently used result is
+  removed.
+
+  Only named patterns (and the patterns referenced by V objects) are memoized,
+  and only if their result depends on nothing but the string and the index.
+  Patterns that use back captures, stacks, functions, cuts or debug output are
+  not memoized. The `memo` argument of a :class:`V` object overrides this for
+  the referenced pattern.
+
+  A table created with a `lookahead` keeps its results when the string is
+  edited (see :func:`edit` and :class:`IncrementalParser`).
+
+  :ivar hits: The number of matches that were found in the table.
+  :ivar misses: The number of matches that were not found in the table.
+  :ivar evictions: The number of results removed to make room for new results.
+
+  >>> digits = 'digits' | C(digit**1)
+  >>> number = 'number' | digits * '.' * digits + digits
+  >>> memo = MemoTable()
+  >>> match(number, '42', memo=memo).captures
+  ['42']
+  >>> memo.hits, memo.misses
+  (1, 2)
+  """
+
+  # Returned by lookup when a result is not in the table
+  MISS = object()
+
+  # ----------------------------------------------------------------------------
+
+  def __init__(self, maxEntries=100000, lookahead=None):
+    """
+    :param maxEntries: The maximum number of results held by the table.
+    :param lookahead: The number of characters a pattern can examine after the
+           end of its match (or after the index of a failed match). The results
+           are only kept when the string is edited if this is given.
+    """
+    import collections
+    if maxEntries < 1: raise ValueError("MemoTable requires maxEntries to be 1 or more")
+    if lookahead is not None and lookahead < 1:
+      raise ValueError("MemoTable requires lookahead to be 1 or more")
+    self.maxEntries = maxEntries
+    self.lookahead  = lookahead
+    self.entries    = collections.OrderedDict()
+    self.memoized   = {}   # id(pattern) -> (pattern, True if memoized)
+    self.positional = {}   # id(pattern) -> True if the captures hold positions
+    self.hits       = 0
+    self.misses     = 0
+    self.evictions  = 0
+
+  # ----------------------------------------------------------------------------
+
+  def clear(self):
+    """
+    Remove all results and reset the counters.
+    """
+    self.entries.clear()
+    self.memoized.clear()
+    self.positional.clear()
+    self.hits = self.misses = self.evictions = 0
+
+  # ----------------------------------------------------------------------------
+
+  def setMemoized(self, pattern, memoize):
+    """
+    Indicate whether the results of a pattern are memoized.
+
+    :param pattern: The pattern.
+    :param memoize: True to memoize the pattern results, False to never
+           memoize the results.
+    """
+    self.memoized[id(pattern)] = (pattern, memoize)
+
+  # ----------------------------------------------------------------------------
+
+  def isMemoized(self, pattern):
+    """
+    Check whether the results of a pattern are memoized.
+    """
+    entry = self.memoized.get(id(pattern))
+    if entry is not None: return entry[1]
+    # The results of left recursive patterns change while a seed is grown
+    if pattern._leftRecursionVersion != Pattern.grammarVersion: _analyzeLeftRecursion(pattern)
+    memoize = pattern.name is not None and pattern._leftRecursion is None and \
+              self._isPure(pattern, set())
+    self.memoized[id(pattern)] = (pattern, memoize)
+    return memoize
+
+  # ----------------------------------------------------------------------------
+
+  @staticmethod
+  def _isPure(pattern, visited):
+    """
+    Check whether the result of a pattern depends only on the string and index.
+    """
+    if id(pattern) in visited: return True
+    visited.add(id(pattern))
+
+    if isinstance(pattern, (Cb, Cs, Cut, StackPtn, PatternFnWrap)): return False
+    if isinstance(pattern, P) and pattern.matcher == pattern.match_fn: return False
+    if pattern.dbg is not None and not (isinstance(pattern.dbg, DebugOptions) and
+                                        pattern.dbg.isHidden()):
+      return False
+    if not pattern._containsPatterns(): return True
+    return all(MemoTable._isPure(ptn, visited) for ptn in pattern.getPatterns()
+               if ptn is not None)
+
+  # ----------------------------------------------------------------------------
+
+  @staticmethod
+  def _usesPositions(pattern, visited):
+    """
+    Check whether the captures of a pattern depend on its position in the
+    string, which changes when text is inserted or removed before it.
+    """
+    if id(pattern) in visited: return False
+    visited.add(id(pattern))
+
+    if isinstance(pattern, (Cl, Cp, Col)): return True
+    return any(MemoTable._usesPositions(ptn, visited) for ptn in _subPatterns(pattern))
+
+  # ----------------------------------------------------------------------------
+
+  def lookup(self, pattern, string, index):
+    """
+    Get the stored result for a pattern at the given index.
+
+    :return: A new Match object, None if the pattern failed, or MemoTable.MISS
+             if there is no stored result.
+    """
+    key = (id(pattern), index)
+    entry = self.entries.pop(key, self)
+    if entry is self:
+      self.misses += 1
+      return MemoTable.MISS
+
+    # Move the result to the end of the table (most recently used)
+    self.hits += 1
+    self.entries[key] = entry
+    end, captures, reach = entry
+    if reach is not None and string.reach is not None and reach > string.reach:
+      string.reach = reach
+    if end is None: return None
+    match = Match(string, index, end)
+    match.captures = list(captures)
+    return match
+
+  # ----------------------------------------------------------------------------
+
+  def store(self, pattern, index, match, reach=None):
+    """
+    Store the result of matching a pattern at the given index.
+
+    :param reach: The furthest position examined by the match. It is required
+           to keep the result when the string is edited.
+    """
+    if not isinstance(match, Match):
+      entry = (None, None, reach)
+    elif self.lookahead is None:
+      entry = (match.end, list(match._captures), reach)
+    else:
+      # The captures must not refer to positions in the string, which move
+      # when the string is edited
+      entry = (match.end, match._materialize(list(match._captures)), reach)
+    self.entries[(id(pattern), index)] = entry
+    if len(self.entries) > self.maxEntries:
+      self.entries.popitem(last=False)
+      self.evictions += 1
+
+  # ----------------------------------------------------------------------------
+
+  def release(self, index):
+    """
+    Remove the results for the positions before the given index, which are not
+    matched again after a :class:`Cut`.
+
+    >>> digits = 'digits' | C(digit**1)
+    >>> memo = MemoTable()
+    >>> match('pair' | digits * ',' * digits, '1,23', memo=memo).end, len(memo)
+    (4, 3)
+    >>> memo.release(2)
+    >>> len(memo)
+    1
+
+    The results are kept in a table with a `lookahead`, since they can be
+    reused after the string is edited.
+    """
+    if self.lookahead is not None: return
+    entries = self.entries
+    for key in [key for key in entries if key[1] < index]: del entries[key]
+
+  # ----------------------------------------------------------------------------
+
+  def moveWindow(self, string, start, end, lookahead):
+    """
+    Update the results after a :class:`StreamString` moves its window of the
+    stream. The text before `start` was released, so the results before it are
+    removed and the other results move back by `start`. Text was read after
+    `end`, so the results of the matches that examined the text within
+    `lookahead` characters of it are removed, since they may change. The
+    counters and the patterns that are memoized are kept.
+
+    >>> digits = 'digits' | C(digit**1)
+    >>> memo = MemoTable()
+    >>> string = BackCaptureString('12,34,5', memo)
+    >>> string.reach = 0
+    >>> match('pair' | digits * ',' * digits, string).end
+    5
+    >>> sorted((key[1], entry[0]) for key, entry in memo.entries.items())
+    [(0, 2), (0, 5), (3, 5)]
+    >>> memo.moveWindow(string, 3, 7, 1)
+    >>> sorted((key[1], entry[0]) for key, entry in memo.entries.items())
+    [(0, 2)]
+
+    :param string: The :class:`BackCaptureString` of the previous window.
+    :param start: The length of the text that was released.
+    :param end: The length of the previous window, or None if no text was read.
+    :param lookahead: The number of characters that a pattern may examine after
+           its reach (see :class:`StreamString`).
+    """
+    import collections
+    materialize = Match(string, 0)._materialize
+    entries = collections.OrderedDict()
+    for key, entry in self.entries.items():
+      ptnId, index = key
+      matchEnd, captures, reach = entry
+      if index < start or reach is None: continue
+      if end is not None and reach + lookahead > end: continue
+      if start > 0:
+        # The captures must not refer to positions in the released text
+        if matchEnd is not None:
+          matchEnd -= start
+          captures = materialize(list(captures))
+        entry = (matchEnd, captures, reach - start)
+      entries[(ptnId, index - start)] = entry
+    self.entries = entries
+
+  # ----------------------------------------------------------------------------
+
+  def edit(self, start, end, size):
+    """
+    Update the results after the text from `start` to `end` is replaced with
+    `size` characters. The results of the matches that did not examine the
+    replaced text are kept. The results of the matches after it are moved by
+    the change in length, unless their captures depend on their position.
+
+    >>> digits = 'digits' | C(digit**1)
+    >>> memo = MemoTable(lookahead=1)
+    >>> match('pair' | digits * ',' * digits, '12,34 5', memo=memo).end
+    5
+    >>> sorted(key[1] for key in memo.entries)
+    [0, 0, 3]
+    >>> memo.edit(1, 2, 0)
+    >>> sorted(key[1] for key in memo.entries)
+    [2]
+
+    :param start: The start of the replaced text.
+    :param end: The end of the replaced text.
+    :param size: The length of the new text.
+    """
+    import collections
+    if self.lookahead is None:
+      raise ValueError("MemoTable.edit requires a table with a lookahead")
+    delta = size - (end - start)
+    lookahead = self.lookahead
+    entries = collections.OrderedDict()
+    for key, entry in self.entries.items():
+      ptnId, index = key
+      reach = entry[2]
+      if reach is None: continue   # Stored by a string that did not track it
+      if reach + lookahead <= start:
+        entries[key] = entry
+      elif index > end:
+        positional = self.positional.get(ptnId)
+        if positional is None:
+          positional = self._usesPositions(self.memoized[ptnId][0], set())
+          self.positional[ptnId] = positional
+        if positional: continue
+        matchEnd = None if entry[0] is None else entry[0] + delta
+        entries[(ptnId, index + delta)] = (matchEnd, entry[1], reach + delta)
+    self.entries = entries
+
+  # ----------------------------------------------------------------------------
+
+  def __len__(self):
+    return len(self.entries)
+
+  # ----------------------------------------------------------------------------
+
+  def __repr__(self):
+    return "MemoTable(entries={0}, hits={1}, misses={2}, evictions={3})".format(
+      len(self.entries), self.hits, self.misses, self.evictions)
+
+# ==============================================================================
+# IncrementalParser
+# ==============================================================================
+
+def _lookahead(root):
+  """
+  Get the number of characters that the patterns reachable from the root pattern
+  can examine after the end of a match (or after the index of a failed match):
+  the length of the longest literal string or keyword, or of the longest ``P(n)``
+  pattern.
+
+  >>> _lookahead(P('while') + Keywords(['if', 'else']) * P(3))
+  5
+  """
+  size = 1
+  visited = {id(root)}
+  todo = [root]
+  while len(todo) > 0:
+    ptn = todo.pop()
+    if isinstance(ptn, (P, I)) and hasattr(ptn, 'size'): size = max(size, ptn.size)
+    elif isinstance(ptn, P) and hasattr(ptn, 'n'): size = max(size, ptn.n)
+    elif isinstance(ptn, Keywords):
+      size = max([size] + [len(word) for word in ptn.words])
+    for sub in _subPatterns(ptn):
+      if id(sub) not in visited:
+        visited.add(id(sub))
+        todo.append(sub)
+  return size
+
+# ==============================================================================
+
+class IncrementalParser(object):
+  """
+  Match a pattern against a text that is edited, e.g. in an editor. The memoized
+  results of the previous match are kept, so after an edit only the patterns
+  that examined the edited text are matched again, and the results after the
+  edit are moved by the change in length.
+
+  Only the results of named patterns that are memoized are reused (see
+  :class:`MemoTable`). The patterns must not examine the text more than
+  `lookahead` characters past the end of a match (or the position where the
+  pattern fails).
+
+  >>> number = 'number' | C(digit**1)
+  >>> numbers = number * (',' * number)**0
+  >>> parser = IncrementalParser(numbers, '1,22,333')
+  >>> parser.match.captures
+  ['1', '22', '333']
+  >>> parser.edit([(2, 4, '4')]).captures
+  ['1', '4', '333']
+  >>> parser.text
+  '1,4,333'
+  >>> parser.memo.hits
+  2
+
+  :ivar pattern: The pattern.
+  :ivar text: The current text.
+  :ivar memo: The :class:`MemoTable` that holds the results.
+  :ivar match: The result of the latest match.
+  """
+
+  # ----------------------------------------------------------------------------
+
+  def __init__(self, pattern, text, lookahead=None, maxEntries=1000000):
+    """
+    :param pattern: The pattern to match.
+    :param text: The initial text.
+    :param lookahead: The number of characters that a pattern may look past the
+           text it matches (by default, the length of the longest literal
+           string in the pattern).
+    :param maxEntries: The maximum number of results held by the table.
+    """
+    self.pattern = P.asPattern(pattern)
+    self.text    = text
+    if lookahead is None: lookahead = _lookahead(self.pattern)
+    self.memo    = MemoTable(maxEntries, lookahead)
+    self.match   = self._match()
+
+  # ----------------------------------------------------------------------------
+
+  def _match(self):
+    """
+    Match the pattern against the current text, reusing the results in the
+    memo table.
+    """
+    string = BackCaptureString(self.text)
+    # The table is not cleared, unlike with setMemo
+    string.memo = self.memo
+    string.reach = 0
+    return self.pattern.match(string)
+
+  # ----------------------------------------------------------------------------
+
+  def edit(self, edits):
+    """
+    Apply a list of edits to the text and match the pattern again.
+
+    :param edits: A list of ``(start, end, replacement)`` tuples that replace
+           the text from `start` to `end` with the replacement text. Each edit
+           applies to the text that results from the previous edits.
+    :return: The new match result (None if the pattern fails).
+    """
+    for start, end, replacement in edits:
+      if not 0 <= start <= end <= len(self.text):
+        raise IndexError("Edit range {0}:{1} is outside of the text".format(start, end))
+      self.text = self.text[:start] + replacement + self.text[end:]
+      self.memo.edit(start, end, len(replacement))
+    self.match = self._match()
+    return self.match
+
 # ==============================================================================
 # Match object
 # ==============================================================================
 
+class Span(object):
+  """
+  A string capture that has not been created yet. The capture is the part of
+  the matched string from `start` to `end`. Spans are used in place of the
+  captured string until the capture is accessed through a :class:`Match`
+  object, so that captures that are never used (such as captures in patterns
+  that fail) do not copy the text.
+  """
+  __slots__ = ('start', 'end')
+
+  # ----------------------------------------------------------------------------
+
+  def __init__(self, start, end):
+    self.start = start
+    self.end   = end
+
+  # ----------------------------------------------------------------------------
+
+  def __repr__(self):
+    return "Span({0}, {1})".format(self.start, self.end)
+
+# ==============================================================================
+
+class CaptureGroup(object):
+  """
+  Mark the start of a group of captures in the capture buffer of a
+  :class:`BackCaptureString`. The captures that follow the marker, up to the
+  `end` index of the buffer, form a single capture that is a list.
+  """
+  __slots__ = ('end',)
+
+  # ----------------------------------------------------------------------------
+
+  def __init__(self, end):
+    self.end = end
+
+  # ----------------------------------------------------------------------------
+
+  def __repr__(self):
+    return "CaptureGroup({0})".format(self.end)
+
+# ==============================================================================
+
+class CaptureSplice(object):
+  """
+  Splice a copy of a range of the capture buffer into the capture buffer of a
+  :class:`BackCaptureString`. The `captures` were at the `start` index of the
+  buffer, so their :class:`CaptureGroup` markers remain valid. Used to return
+  the seed of a left recursive :class:`V` object without copying it.
+  """
+  __slots__ = ('captures', 'start')
+
+  # ----------------------------------------------------------------------------
+
+  def __init__(self, captures, start):
+    self.captures = captures
+    self.start    = start
+
+  # ----------------------------------------------------------------------------
+
+  def __repr__(self):
+    return "CaptureSplice({0!r}, {1})".format(self.captures, self.start)
+
+# ==============================================================================
+
+def _captureList(buffer, start, end, offset=0):
+  """
+  Create the list of captures stored in a range of a capture buffer. Groups of
+  captures become nested lists and spliced captures are inserted in place. The
+  `offset` is the index in the capture buffer of the first item of `buffer`,
+  when it is a copy of part of the buffer.
+
+  >>> _captureList(['a', CaptureGroup(4), 'b', 'c', 'd'], 0, 5)
+  ['a', ['b', 'c'], 'd']
+  >>> _captureList([CaptureGroup(13), 'b', 'c'], 10, 13, 10)
+  [['b', 'c']]
+  >>> _captureList([CaptureSplice(['a', CaptureGroup(4), 'b'], 1), 'c'], 0, 2)
+  ['a', ['b'], 'c']
+  """
+  captures = []
+  frames   = []   # Enclosing groups and splices
+  i = start
+  while True:
+    while i < end:
+      capture = buffer[i - offset]
+      i += 1
+      if isinstance(capture, CaptureGroup):
+        frames.append((captures, end))
+        captures.append([])
+        captures, end = captures[-1], capture.end
+      elif isinstance(capture, CaptureSplice):
+        frames.append((buffer, i, end, offset))
+        buffer, offset = capture.captures, capture.start
+        i, end = offset, offset + len(buffer)
+      else:
+        captures.append(capture)
+    if len(frames) == 0: return captures
+    frame = frames.pop()
+    if len(frame) == 2: captures, end = frame
+    else: buffer, i, end, offset = frame
+
+# ==============================================================================
+
 class Match(object):
   """
   The ``Match`` object tracks the text that was matched by a PEG pattern, and
@@ -3037,11 +5998,159 @@ class Match(object):
   # ----------------------------------------------------------------------------
 
   def __init__(self, string, start, end=None):
-    self.string   = string
-    self.start    = start
-    self.end      = end
-    self.captures = []
-    self.context  = None
+    self.string    = string
+    self.start     = start
+    self.end       = end
+    self._capList   = []     # The captures, which may contain Span objects
+    self._lazy      = False  # Indicate that the captures may contain Spans
+    self._capSource = None   # The BackCaptureString that stores the captures
+    self._capStart  = 0      # The range of the captures in the capture buffer
+    self._capEnd    = 0
+    self.context    = None
+
+  # ----------------------------------------------------------------------------
+
+  @property
+  def captures(self):
+    """
+    The list of captures. String captures are created from the matched string
+    when the captures are first accessed.
+
+    >>> match = (C(alpha**1) * ' ' * C(alpha**1)).match('lazy captures')
+    >>> match._captures
+    [Span(0, 4), Span(5, 13)]
+    >>> match.captures
+    ['lazy', 'captures']
+    """
+    captures = self._captures
+    # The list can be changed by the caller, so it is no longer in sync with the
+    # capture buffer.
+    self._capSource = None
+    if self._lazy:
+      self._materialize(captures)
+      self._lazy = False
+    return captures
+
+  # ----------------------------------------------------------------------------
+
+  @captures.setter
+  def captures(self, captures):
+    self._captures = captures
+    self._lazy = True
+
+  # ----------------------------------------------------------------------------
+
+  @property
+  def _captures(self):
+    """
+    The list of captures, which may contain Span objects. The list is created
+    from the capture buffer when the captures are stored in the buffer.
+    """
+    if self._capList is None:
+      self._capList = _captureList(self._capSource.captureBuffer,
+                                   self._capStart, self._capEnd)
+      self._lazy = True
+    return self._capList
+
+  # ----------------------------------------------------------------------------
+
+  @_captures.setter
+  def _captures(self, captures):
+    self._capList = captures
+    self._capSource = None
+
+  # ----------------------------------------------------------------------------
+
+  def _setCaptureRange(self, string, start):
+    """
+    Use the captures stored in the capture buffer of the string, from the
+    `start` index to the end of the buffer, as the captures of the match.
+
+    :param string: The :class:`BackCaptureString` that stores the captures.
+    :param start: The index of the first capture in the capture buffer.
+    :return: The match object
+    """
+    self._capList   = None
+    self._capSource = string
+    self._capStart  = start
+    self._capEnd    = len(string.captureBuffer)
+    return self
+
+  # ----------------------------------------------------------------------------
+
+  def _moveCaptures(self, string, start):
+    """
+    Store the captures of the match in the capture buffer of the string,
+    replacing anything after the `start` index.
+
+    :param string: The :class:`BackCaptureString` that stores the captures.
+    :param start: The index of the first capture in the capture buffer.
+    """
+    buffer = string.captureBuffer
+    captures = self._captures
+    if len(buffer) > start: del buffer[start:]
+    buffer.extend(captures)
+    self._capSource = string
+    self._capStart  = start
+    self._capEnd    = len(buffer)
+
+  # ----------------------------------------------------------------------------
+
+  def _detach(self):
+    """
+    Copy the captures of the match out of the capture buffer, so the match is
+    not changed when later matches reuse the buffer. Matches are detached before
+    they are given to user functions, which can keep them.
+
+    :return: The match object
+    """
+    if self._capList is None: self._captures = self._captures
+    self._capSource = None
+    return self
+
+  # ----------------------------------------------------------------------------
+
+  def _copy(self):
+    """
+    Create a match for the same text with a copy of the list of captures. The
+    patterns containing a user function change the copy instead of the match
+    returned by the function.
+
+    :return: The new match object
+    """
+    match = Match(self.string, self.start, self.end)
+    match._capList = list(self._captures)
+    match._lazy    = self._lazy
+    match.context  = self.context
+    return match
+
+  # ----------------------------------------------------------------------------
+
+  def _releaseCaptures(self):
+    """
+    Create the list of captures for the match and remove the captures from the
+    capture buffer.
+    """
+    string = self._capSource
+    if string is None: return
+    self._captures = self._captures
+    del string.captureBuffer[self._capStart:]
+
+  # ----------------------------------------------------------------------------
+
+  def _materialize(self, capture):
+    """
+    Convert the Span objects in a capture to strings. Lists of captures are
+    updated in place.
+
+    :param capture: A capture or a list of captures.
+    :return: The capture with Spans converted to strings.
+    """
+    if isinstance(capture, Span): return self.string[capture.start:capture.end]
+    if isinstance(capture, list):
+      for i, item in enumerate(capture):
+        if isinstance(item, (Span, list)): capture[i] = self._materialize(item)
+    return capture
 
   # ----------------------------------------------------------------------------
 
@@ -3067,7 +6176,9 @@ class Match(object):
     """
     Add a capture or a submatch.
     """
-    self.captures.append( capture )
+    self._captures.append( capture )
+    self._capSource = None
+    if isinstance(capture, (Span, list)): self._lazy = True
     return self
 
   # ----------------------------------------------------------------------------
@@ -3093,7 +6204,9 @@ class Match(object):
     Extend the captures in the current match object with captures from a
     contained PEG pattern.
     """
-    self.captures.extend(match.captures)
+    self._captures.extend(match._captures)
+    self._capSource = None
+    if match._lazy: self._lazy = True
     return self
 
   # ----------------------------------------------------------------------------
@@ -3102,7 +6215,8 @@ class Match(object):
     """
     :return: Return true if this Match object contains any captures.
     """
-    return len(self.captures) > 0
+    if self._capList is None: return self._capEnd > self._capStart
+    return len(self._capList) > 0
 
   # ----------------------------------------------------------------------------
 
@@ -3120,17 +6234,38 @@ class Match(object):
     :return: The requested capture value.
     """
     # TODO: Handles slices?
-    if not self.hasCaptures() or -index < -len(self.captures) or len(self.captures) <= index:
+    captures = self._captures
+    if not self.hasCaptures() or -index < -len(captures) or len(captures) <= index:
       raise IndexError("Invalid capture index for Match")
-    return self.captures[index]
+    if self._lazy: captures[index] = self._materialize(captures[index])
+    return captures[index]
 
   # ----------------------------------------------------------------------------
 
   def __getattr__(self, attr):
+    if attr.startswith('__'): raise AttributeError(attr)
     return getattr(str(self), attr)
 
   # ----------------------------------------------------------------------------
 
+  def __getstate__(self):
+    """
+    Pickle the match with its captures, which are copied out of the capture
+    buffer of the string.
+
+    >>> import pickle
+    >>> match = pickle.loads(pickle.dumps((C(alpha**1) * '=' * C(digit**1)).match('ab=12')))
+    >>> match, match.captures, match.start, match.end
+    (ab=12, ['ab', '12'], 0, 5)
+    """
+    state = dict(self.__dict__)
+    state['_capList']   = _picklable(self.captures)
+    state['_lazy']      = False
+    state['_capSource'] = None
+    return state
+
+  # ----------------------------------------------------------------------------
+
   def __getitem__(self, key):
     """
     Get a capture from the Match object
@@ -3150,13 +6285,16 @@ class Match(object):
     if isinstance(other, six.string_types):
       return str(self) == other
 
+    if isinstance(other, (bytes, bytearray, memoryview)):
+      return self.getValue() == other
+
     if isinstance(other, Match):
       return str(self) == str(other)
 
   # ----------------------------------------------------------------------------
 
   def __len__(self):
-    return len(self.captures)
+    return len(self._captures)
 
   # ----------------------------------------------------------------------------
 
@@ -3166,7 +6304,12 @@ class Match(object):
   # ----------------------------------------------------------------------------
 
   def __str__(self):
-    return self.getValue()
+    value = self.getValue()
+    # The text of bytes-like subjects is shown as latin-1
+    if isinstance(value, memoryview): return value.tobytes().decode('latin-1')
+    if isinstance(value, bytes) and not isinstance(value, str):
+      return value.decode('latin-1')
+    return value
 
 # ==============================================================================
 
@@ -3181,7 +6324,7 @@ def matchUntil(pattern, matchAfter=False):
   :return: A Pattern that matches all text up to the given pattern, and matches
          the pattern as well if `matchAfter` is True.
   """
-  beforePattern = (1-pattern & 'hide')**0
+  beforePattern = PatternUntil(pattern)
   if not matchAfter: return beforePattern
   return beforePattern * pattern
 
@@ -3202,12 +6345,23 @@ def join(separator=""):
   >>> p.match("123").captures
   ['1,2,3']
 
+  The captures of bytes-like subjects are joined as bytes, with the separator
+  encoded as latin-1:
+
+  >>> p.match(b"123").captures == [b'1,2,3']
+  True
+
   :param separator: The string to use to join the capture values (Empty sting by default)
   :return: The match object with the joined string as the only capture.
   """
   def joinfn(match):
-
-    joined = separator.join(match.captures)
+    captures = [capture.tobytes() if isinstance(capture, memoryview) else capture
+                for capture in match.captures]
+    sep = separator
+    if not isinstance(sep, bytes) and any(isinstance(capture, bytes) for capture in captures):
+      sep = _textAndBytes(separator)[1]
+      if sep is None: raise ValueError("The separator can't be joined with bytes captures")
+    joined = sep.join(captures)
     match.captures = [joined]
     return match
 
@@ -3216,13 +6370,287 @@ def join(separator=""):
 # ==============================================================================
 # ==============================================================================
 
-def match(pattern, subject, index=0, context=None):
+def match(pattern, subject, index=0, context=None, memo=None, engine='tree'):
   """
+  Match the pattern against the subject.
+
+  :param pattern: The pattern to match.
+  :param subject: The string to match against.
+  :param index: The location in the string to start the match.
+  :param context: Information that is forwarded between matches.
+  :param memo: A :class:`MemoTable` to memoize match results, True to memoize
+         results using a new MemoTable, or None (default) to not memoize.
+         Results are memoized for patterns matched by the tree interpreter.
+  :param engine: 'tree' (default) to match by calling the match method of
+         each pattern, or 'vm' to match using the compiled pattern (see
+         :func:`Pattern.compile`). The 'vm' engine does not recurse, so deeply
+         nested text does not run into the Python recursion limit.
+  :return: A :class:`Match` object if the pattern succeeds, or None.
   """
+  if engine not in ('tree', 'vm'): raise ValueError("Unknown engine '{0}'".format(engine))
+  if memo is not None:
+    if not isinstance(subject, BackCaptureString):
+      subject = BackCaptureString(subject)
+    subject.setMemo(memo)
+  if engine == 'vm': return pattern.compile().match(subject, index, context)
   return pattern.match(subject, index, context)
 
 # ==============================================================================
 
+def matchMany(pattern, subjects, workers=None, chunksize=1, ordered=True,
+              index=0, encoding=None):
+  """
+  Match the pattern against many subjects in a pool of worker processes.
+
+  The pattern is pickled once and loaded once by each worker. Patterns that
+  can't be pickled (for example, patterns that use lambda functions) can be
+  passed as a function defined at module level that builds the pattern, which
+  is then called once by each worker. The match results are pickled back, so
+  the captures and the stack items must be picklable. Memoryview captures of
+  binary subjects are returned as bytes.
+
+  >>> list(matchMany(C(alpha**1), ['ab1', '1', 'c'], workers=0))
+  [ab, None, c]
+  >>> sorted(str(match) for subject, match in
+  ...        matchMany(C(alpha**1), ['ab', 'cd'], workers=2, ordered=False))
+  ['ab', 'cd']
+
+  :param pattern: The pattern to match, or a function that returns it.
+  :param subjects: An iterable of subjects. A path (an `os.PathLike` object,
+         such as `pathlib.Path`) is read by the worker.
+  :param workers: The number of worker processes (default: the number of CPUs).
+         If 0, the subjects are matched in this process.
+  :param chunksize: The number of subjects sent to a worker at a time.
+  :param ordered: If True (default), the results are returned in the order of
+         the subjects. Otherwise, (subject, result) pairs are returned as they
+         are completed.
+  :param index: The location in each subject to start the match.
+  :param encoding: The encoding used to read paths (default: the encoding
+         used by `open`).
+  :return: An iterator over the match results (a :class:`Match` object or None).
+  """
+  import functools
+  isFactory = not isinstance(pattern, Pattern)
+  task = functools.partial(_matchSubject, index=index)
+  return _mapMany(task, pattern, isFactory, subjects, workers, chunksize, ordered, encoding)
+
+# ------------------------------------------------------------------------------
+
+def _matchSubject(pattern, subject, index=0):
+  return pattern.match(subject, index)
+
+# ------------------------------------------------------------------------------
+
+# The pattern or tokenizer used by the tasks of a worker process
+_workerTarget = None
+
+def _initWorker(data, isFactory):
+  """
+  Load the pattern or tokenizer of a worker process.
+  """
+  import pickle
+  global _workerTarget
+  _workerTarget = pickle.loads(data)
+  if isFactory: _workerTarget = _workerTarget()
+
+# ------------------------------------------------------------------------------
+
+def _runTasks(task, subjects, encoding, target=None):
+  """
+  Apply a task to a chunk of subjects, reading the subjects that are paths. The
+  target is the pattern or tokenizer of the worker process by default.
+  """
+  import io
+  if target is None: target = _workerTarget
+  results = []
+  for subject in subjects:
+    if hasattr(subject, '__fspath__'):
+      path = subject.__fspath__()   # Python 2 io.open takes no path objects
+      with io.open(path, encoding=encoding) as stream: subject = stream.read()
+    results.append(task(target, subject))
+  return results
+
+# ------------------------------------------------------------------------------
+
+def _mapMany(task, target, isFactory, subjects, workers, chunksize, ordered, encoding):
+  """
+  Apply `task(target, subject)` to each subject in a pool of worker processes.
+  At most two chunks per worker are in flight, so the subjects are read and the
+  results are returned as they are needed.
+  """
+  import collections, itertools, os, pickle
+
+  if chunksize < 1: raise ValueError("The chunksize must be at least 1")
+  subjects = iter(subjects)
+  if workers == 0:
+    if isFactory: target = target()
+    for subject in subjects:
+      result = _runTasks(task, [subject], encoding, target)[0]
+      yield result if ordered else (subject, result)
+    return
+
+  from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+  workers = workers or os.cpu_count() or 1
+  executor = ProcessPoolExecutor(workers, initializer=_initWorker,
+                                 initargs=(pickle.dumps(target), isFactory))
+  pending = collections.deque()  # (future, chunk) pairs in the order of the subjects
+  try:
+    while True:
+      while len(pending) < 2 * workers:
+        chunk = list(itertools.islice(subjects, chunksize))
+        if len(chunk) == 0: break
+        pending.append((executor.submit(_runTasks, task, chunk, encoding), chunk))
+      if len(pending) == 0: break
+      if ordered:
+        future, chunk = pending.popleft()
+        for result in future.result(): yield result
+      else:
+        done = wait([future for future, chunk in pending], return_when=FIRST_COMPLETED)[0]
+        for item in [item for item in pending if item[0] in done]:
+          pending.remove(item)
+          for result in zip(item[1], item[0].result()): yield result
+  finally:
+    for future, chunk in pending: future.cancel()
+    executor.shutdown()
+
+# ==============================================================================
+
+def dumpGrammar(pattern, file, compile=True):
+  """
+  Write a grammar to a binary file. V cycles and named patterns are stored with
+  the grammar, and the functions used by the grammar are stored by their import
+  path, so they need to be defined at the module level. The analyses of the
+  patterns that are up to date are stored too, so a loaded grammar is matched
+  without analyzing it again.
+
+  >>> import io
+  >>> expr = V('expr')
+  >>> expr.setPattern(C(digit**1) + '(' * expr * ')')
+  >>> file = io.BytesIO()
+  >>> dumpGrammar(expr, file, compile=False)
+  >>> loaded = loadGrammar(io.BytesIO(file.getvalue()))
+  >>> loaded, loaded.match('((12))').captures
+  (V('expr'), ['12'])
+
+  :param pattern: The root pattern of the grammar.
+  :param file: A file opened for writing in binary mode.
+  :param compile: If True (default), the grammar is compiled (see
+         :func:`Pattern.compile`) before it is written.
+  """
+  import pickle
+  if compile: pattern.compile()
+  pickle.dump(pattern, file, pickle.HIGHEST_PROTOCOL)
+
+# ------------------------------------------------------------------------------
+
+def loadGrammar(file):
+  """
+  Read a grammar written by :func:`dumpGrammar`.
+
+  :param file: A file opened for reading in binary mode.
+  :return: The root pattern of the grammar.
+  """
+  import pickle
+  pattern = pickle.load(file)
+  if not isinstance(pattern, Pattern): raise ValueError("The file does not contain a grammar")
+  return pattern
+
+# ------------------------------------------------------------------------------
+
+def grammarFingerprint(build, key=None):
+  """
+  Get the fingerprint of the grammar returned by a function. It changes when
+  the source of the module that defines the function, the PyPE version that
+  builds the grammar or the `key` changes.
+
+  :param build: A function defined at the module level that returns a grammar.
+  :param key: An optional string that is added to the fingerprint, for
+         grammars that depend on more than the module source.
+  :return: A hex string.
+  """
+  import hashlib, sys
+  if __package__:
+    from . import Compiler
+  else:
+    import Compiler
+  module = sys.modules.get(build.__module__)
+  path = getattr(module, '__file__', None)
+  if path is None and key is None:
+    raise ValueError("A key is required for a grammar that is not built in a module file")
+
+  digest = hashlib.sha1()
+  name = getattr(build, '__qualname__', build.__name__)   # Not in Python 2
+  for text in (sys.version, build.__module__, name, key or ""):
+    digest.update(text.encode('utf-8') + b'\0')
+  for path in (path, __file__, Compiler.__file__):
+    if path is None: continue
+    with open(path, 'rb') as source: digest.update(source.read())
+  return digest.hexdigest()
+
+# ------------------------------------------------------------------------------
+
+# The grammars loaded by cachedGrammar, by fingerprint
+_loadedGrammars = {}
+
+def cachedGrammar(build, cacheDir=None, key=None, compile=True):
+  """
+  Get the grammar returned by a function from a cache directory. The grammar is
+  built and written to the cache the first time, and it is loaded from the cache
+  afterward until its fingerprint (see :func:`grammarFingerprint`) changes. The
+  grammar is loaded once per process.
+
+  The cached grammars are pickles, and loading a pickle can run any code that
+  it names. The cache directory must only be writable by trusted users: the
+  default directory is created so that only its owner can access it, and a
+  shared `cacheDir` should not be used.
+
+  :param build: A function defined at the module level that returns a grammar.
+  :param cacheDir: The cache directory (default: ~/.cache/PyPE). If the cache
+         can't be written, the grammar is built each time it is loaded.
+  :param key: An optional string that is added to the fingerprint.
+  :param compile: If True (default), the grammar is compiled before it is
+         written to the cache.
+  :return: The root pattern of the grammar.
+  :raises: The errors of :func:`loadGrammar` if the cached file is not a valid
+           grammar. The file must then be removed from the cache.
+  """
+  import os, tempfile
+  fingerprint = grammarFingerprint(build, key)
+  if fingerprint in _loadedGrammars: return _loadedGrammars[fingerprint]
+
+  cacheDir = cacheDir or os.path.join(os.path.expanduser('~'), '.cache', 'PyPE')
+  path = os.path.join(cacheDir, fingerprint + '.grammar')
+  try:
+    file = open(path, 'rb')
+  except (IOError, OSError):   # The grammar is not cached, or can't be read
+    file = None
+
+  if file is not None:
+    with file: pattern = loadGrammar(file)
+  else:
+    pattern = build()
+    if compile: pattern.compile()
+    try:
+      if not os.path.isdir(cacheDir): os.makedirs(cacheDir, 0o700)
+      # Write to a temporary file first, so processes that start at the same
+      # time never read a partial grammar.
+      fd, tmpPath = tempfile.mkstemp(dir=cacheDir, suffix='.tmp')
+      try:
+        with os.fdopen(fd, 'wb') as file: dumpGrammar(pattern, file, compile=False)
+        # os.replace is not available in Python 2, where os.rename replaces the
+        # file except on Windows (the grammar is then cached by another process)
+        getattr(os, 'replace', os.rename)(tmpPath, path)
+      except BaseException:
+        os.remove(tmpPath)
+        raise
+    except OSError:
+      pass
+
+  _loadedGrammars[fingerprint] = pattern
+  return pattern
+
+# ==============================================================================
+
 def _repr_(ptn, prnsCls=None):
   if ptn.name is not None:
     return "<{0}>".format(ptn.name)
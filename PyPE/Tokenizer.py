@@ -1,8 +1,8 @@
 from __future__ import print_function
 if __package__:
-  from .PyPE import Pattern, BackCaptureString
+  from .PyPE import Pattern, BackCaptureString, StreamString, _mapMany
 else:
-  from PyPE import Pattern, BackCaptureString
+  from PyPE import Pattern, BackCaptureString, StreamString, _mapMany
 # ==============================================================================
 
 class Grammar(object):
@@ -203,16 +203,28 @@ class Tokenizer(object):
     token name is the name associated with the token Pattern in the grammar
     rules list. This is an iterator function.
 
-    :param string: The string to tokenize.
+    A :class:`StreamString` is tokenized as it is read, and the text before each
+    token is released.
+
+    :param string: The string or :class:`StreamString` to tokenize.
     :param index: The location in the string to start (default 0)
     """
     if __package__:
       from .PyPE import Match
     else:
       from PyPE import Match
-    if not isinstance(string, BackCaptureString): string = BackCaptureString(string)
+    if isinstance(string, StreamString):
+      stream = string
+      string = None
+    elif not isinstance(string, BackCaptureString):
+      string = BackCaptureString(string)
+
+    def matchAt(pattern, index):
+      if string is None: return stream.match(pattern, index)
+      return pattern.match(string, index)
 
     while True:
+      if string is None: stream.release(index)
       grammar, end_grammar = [self.stack[-1][item] for item in ('grammar','end grammar')]
 
       # ------------------------------------------------------------------------
@@ -220,7 +232,7 @@ class Tokenizer(object):
       # and continue.
       # ------------------------------------------------------------------------
       if end_grammar is not None:
-        match = end_grammar.match(string, index)
+        match = matchAt(end_grammar, index)
         if isinstance(match, Match):
           if end_grammar.name is not None: yield (end_grammar.name, match)
           index = match.end
@@ -235,7 +247,7 @@ class Tokenizer(object):
       # ------------------------------------------------------------------------
       for pattern, new_grammar, end_new_grammar in grammar:
         name = pattern.name
-        match = pattern.match(string, index)
+        match = matchAt(pattern, index)
         if isinstance(match, Match):
           if name is not None:
             yield (name, match)
@@ -254,3 +266,35 @@ class Tokenizer(object):
       else:
         return
         #raise StopIteration()
+
+# ==============================================================================
+
+def tokenizeMany(tokenizer, subjects, workers=None, chunksize=1, ordered=True,
+                 index=0, encoding=None):
+  """
+  Tokenize many subjects in a pool of worker processes. Each subject is
+  tokenized from the initial grammar of the tokenizer, and the result for a
+  subject is the list of its (token name, match object) pairs. See
+  :func:`PyPE.matchMany` for the parameters.
+
+  >>> from PyPE import C, alpha, digit
+  >>> T = Tokenizer(root=['word' | C(alpha**1), 'number' | C(digit**1)])
+  >>> [[name for name, match in tokens] for tokens in tokenizeMany(T, ['ab12', '3'], workers=0)]
+  [['word', 'number'], ['number']]
+
+  :param tokenizer: The :class:`Tokenizer`, or a function that returns it.
+  :return: An iterator over the lists of tokens.
+  """
+  import functools
+  isFactory = not isinstance(tokenizer, Tokenizer)
+  task = functools.partial(_tokenizeSubject, index=index)
+  return _mapMany(task, tokenizer, isFactory, subjects, workers, chunksize, ordered, encoding)
+
+# ------------------------------------------------------------------------------
+
+def _tokenizeSubject(tokenizer, subject, index=0):
+  stack = list(tokenizer.stack)
+  try:
+    return list(tokenizer.getTokens(subject, index))
+  finally:
+    tokenizer.stack[:] = stack
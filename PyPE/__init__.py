@@ -1,5 +1,7 @@
-from .PyPE import P, I, R, S, V, C, Cb, Cc, Cg, Cs, Cl, Cp, Col, SOL, EOL, Sc, Sp, \
-                  Sm, Ssz
+from .PyPE import P, I, R, S, V, C, Cb, Cc, Cg, Cs, Cl, Cp, Col, SOL, EOL, \
+                  Sc, Sp, Sm, Ssz, Keywords, Cut
 from .PyPE import match, matchUntil, escapeStr, join, whitespace, whitespace0, \
-                  whitespace1, alpha, digit, newline, quote, setVs
-from .Tokenizer import Tokenizer
+                  whitespace1, alpha, digit, newline, quote, setVs, MemoTable, \
+                  StreamString, IncrementalParser, matchMany, dumpGrammar, \
+                  loadGrammar, grammarFingerprint, cachedGrammar
+from .Tokenizer import Tokenizer, tokenizeMany
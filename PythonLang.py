@@ -1,7 +1,14 @@
-from PyPE import P, S, R, C, Cc, Cb, Cg, Cs, SOL, EOL, alpha, digit, newline, \
-                 quote, V, setVs, Sc, Sp, Sm, Ssz, matchUntil, whitespace
+from PyPE import P, S, R, C, Cc, Cb, Cg, Cs, SOL, EOL, Cut, alpha, digit, \
+                 newline, quote, V, setVs, Sc, Sp, Sm, Ssz, matchUntil, \
+                 whitespace, match, cachedGrammar
 
 import sys
+
+# The grammar is matched with the 'vm' engine, which does not recurse for
+# nested statements and expressions. It is built once per process, or loaded
+# from the grammar cache when a cache directory is given (see getPythonGrammar).
+# The tree engine recurses for each nested pattern, so the recursion limit is
+# raised for the callers of pythonGrammar that use it.
 sys.setrecursionlimit(10000)
 
 # ==============================================================================
@@ -61,6 +68,53 @@ def STRING_():
 
   return "string" | longstring + shortstring + stringliteral
 
+# ==============================================================================
+# The indentation of the statements is checked by these functions. They are
+# defined at module level so that a pickled grammar refers to them by name.
+
+def checkIndent(match):
+  """
+  Verify that the indent is greater than the previous indent
+  """
+  if match.context == None: return match
+  indents = match.context.getStack("indent")
+  if indents is None: return
+
+  string = match.string
+  if len(indents) < 2: return match
+
+  # Check that the indentation is larger than previous indentation
+  if len(indents[-1]) > len(indents[-2]):
+    #TODO: Report an error
+    pass
+
+  # Check that the new contains the previous indentation characters
+  if not indents[-1].startswith(indents[-2]):
+    # TODO: report an error
+    pass
+
+  return match
+
+# ==============================================================================
+
+def dedent(match):
+  """
+  Check for a valid dedent and remove indents from the indent stack
+  """
+  if match.context == None: return match
+  indents = match.context.getStack("indent")
+
+  # TODO: Report an invalid deindent
+  if indents is None or len(indents) == 0: return
+
+  indent = match.getValue()
+  indentSz = len(indent)
+  # TODO: report that the dedented line is actually indented
+  if indentSz > len(indents.peek()): pass
+  indents.pop() # Pop at least one indent from the stack
+
+  return match
+
 # ==============================================================================
 
 def pythonGrammar():
@@ -137,51 +191,6 @@ def pythonGrammar():
 
   # ----------------------------------------------------------------------------
 
-  def checkIndent(match):
-    """
-    Verify that the indent is greater than the previous indent
-    """
-    if match.context == None: return match
-    indents = match.context.getStack("indent")
-    if indents is None: return
-
-    string = match.string
-    if len(indents) < 2: return match
-
-    # Check that the indentation is larger than previous indentation
-    if len(indents[-1]) > len(indents[-2]):
-      #TODO: Report an error
-      pass
-
-    # Check that the new contains the previous indentation characters
-    if not indents[-1].startswith(indents[-2]):
-      # TODO: report an error
-      pass
-
-    return match
-
-  # ----------------------------------------------------------------------------
-
-  def dedent(match):
-    """
-    Check for a valid dedent and remove indents from the indent stack
-    """
-    if match.context == None: return match
-    indents = match.context.getStack("indent")
-
-    # TODO: Report an invalid deindent
-    if indents is None or len(indents) == 0: return
-
-    indent = match.getValue()
-    indentSz = len(indent)
-    # TODO: report that the dedented line is actually indented
-    if indentSz > len(indents.peek()): pass
-    indents.pop() # Pop at least one indent from the stack
-
-    return match
-
-  # ----------------------------------------------------------------------------
-
   # TODO: Track the indentation and unindent
   INDENT = 'INDENT' | Sc('indent',C(ws)) / checkIndent
   DEDENT = 'DEDENT' | P(0) / dedent
@@ -544,8 +553,10 @@ def pythonGrammar():
   # in the indents stack.
 
   # file_input: (NEWLINE | stmt)* ENDMARKER
+  # The input before each statement is never matched again (see Cut).
   file_input = 'file_input' | init_var_state * next_stmt_line**-1 * \
-                              (INDENT * stmt)**-1 * (match_indent*stmt)**0
+                              (INDENT * stmt * Cut())**-1 * \
+                              (match_indent * stmt * Cut())**0
 
   # ----------------------------------------------------------------------------
   # Close grammar
@@ -586,12 +597,34 @@ def pythonGrammar():
 
 # ==============================================================================
 
-def getUndefinedVarsFromSrc(src):
+_pythonGrammar = None   # The grammar built by getPythonGrammar
+
+def getPythonGrammar(cacheDir=None):
+  """
+  Get the python grammar, which is built the first time it is needed. When a
+  cache directory is given, the grammar is loaded from the grammar cache in the
+  directory instead, and is built and written to it the first time (see
+  cachedGrammar). Only a directory that is writable by trusted users should be
+  used, since the cached grammars are pickles.
+
+  :param cacheDir: An optional directory of cached grammars.
+  :return: The root pattern of the python grammar.
+  """
+  global _pythonGrammar
+  if cacheDir is not None: return cachedGrammar(pythonGrammar, cacheDir)
+  if _pythonGrammar is None: _pythonGrammar = pythonGrammar()
+  return _pythonGrammar
+
+# ==============================================================================
+
+def getUndefinedVarsFromSrc(src, cacheDir=None):
   """
   Parse the source code and get a list of the variables that are undefined in
   the source code.
 
   :param src: A string with the source code to parse.
+  :param cacheDir: An optional directory of cached grammars (see
+         getPythonGrammar).
   :return: An array of undefined variables.
   """
   defined, scope, undefined = ([], [], [])
@@ -600,12 +633,12 @@ def getUndefinedVarsFromSrc(src):
   defined.extend(dir(__builtins__))
   scope.append(len(defined)) # Mark the end of this scope
 
-  pygrammar = pythonGrammar()
-  match = pygrammar.match(src)
+  pygrammar = getPythonGrammar(cacheDir)
+  result = match(pygrammar, src, engine='vm')
 
   # This needs to be more sophisticated to handle class variables where
   # self.<classvar> is used, and things like static methods are possible.
-  for cmd, val in match.captures:
+  for cmd, val in result.captures:
     val = val.strip()
 
     if cmd == 'end':
@@ -635,17 +668,17 @@ def getUndefinedVarsFromSrc(src):
 
 # ==============================================================================
 
-def printValuesUsedInSrc(src):
-  pygrammar = pythonGrammar()
+def printValuesUsedInSrc(src, cacheDir=None):
+  pygrammar = getPythonGrammar(cacheDir)
   #pygrammar.debug(True)
 
-  match = pygrammar.match(src)
+  result = match(pygrammar, src, engine='vm')
 
   def show(string):
     print "  " * indent + string.strip()
 
   indent = 0
-  for cmd, val in match.captures:
+  for cmd, val in result.captures:
     if cmd == 'end':
       indent -= 1
       continue
@@ -662,6 +695,6 @@ if __name__ == "__main__":
 
   #print getUndefinedVarsFromSrc(code)
 
-  pyg = pythonGrammar()
+  pyg = getPythonGrammar()
 
-  print pyg.match(code)
\ No newline at end of file
+  print match(pyg, code, engine='vm')
\ No newline at end of file
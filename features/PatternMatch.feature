@@ -206,4 +206,120 @@ Scenario Outline: Captures are applied.
     | Cc('Test')         | Constant Capture 'Test' | any       | 0     | ['Test']                  |
     | 3*C(3)*C(2)        | Basic Captures          | 123456789 | 0     | ['456','78']              |
     | 3*Cp()*3*Cp()      | Position Captures       | 123456789 | 0     | [3,6]                     |
-    | (Cg(C(2)*C(2)))**1 | Capture Group           | 12ab34cd5 | 0     | [['12','ab'],['34','cd']] |
\ No newline at end of file
+    | (Cg(C(2)*C(2)))**1 | Capture Group           | 12ab34cd5 | 0     | [['12','ab'],['34','cd']] |
+#-------------------------------------------------------------------------------
+Scenario Outline: Matches kept by a function are not changed by the rest of the
+  match.
+  Given p = <pattern> [<desc>]
+  And   the function keep saves the matches it is given
+  When  p.match('<string>',<index>) is called
+  Then  the kept matches should have captures <kept>
+  And   captures should be <captures>
+
+  Examples:
+    | pattern                                                        | desc               | string         | index | kept                                  | captures                            |
+    | ((C(alpha**1)*C(digit**1))/keep * P(' ')**-1)**1               | across a repeat    | ab12 cd34 ef56 | 0     | [['ab','12'],['cd','34'],['ef','56']] | ['ab','12','cd','34','ef','56']     |
+    | ((C(alpha**1)*C(digit**1))/keep*'x' + Cc('Q')*C(3)) * C(1)     | failed alternative | ab1yz          | 0     | [['ab','1']]                          | ['Q','ab1','y']                     |
+    | C((C(alpha**1)*C(digit**1))/keep)**1                           | captured again     | ab12cd34       | 0     | [['ab','12'],['cd','34']]             | ['ab12','ab','12','cd34','cd','34'] |
+    | (C(alpha)*P(lambda s, i, c: keep(C(digit).match(s, i, c))))**1 | returned by P(fn)  | a1b2           | 0     | [['1'],['2']]                         | ['a','1','b','2']                   |
+
+#-------------------------------------------------------------------------------
+Scenario Outline: Compiled patterns give the same results as the pattern.
+  Given p = <pattern> [<desc>]
+  When  p.compile().match('<string>',<index>) is called
+  Then  the result should be the same as p.match('<string>',<index>)
+
+  Examples:
+    | pattern                                           | desc                    | string    | index |
+    | P('ab') + P('a')                                  | ordered choice          | abc       | 0     |
+    | P('ab') + P('a')                                  | ordered choice fails    | bc        | 0     |
+    | C(R('az')**1) * (' ' * C(R('az')**1))**0          | captured words          | one two 3 | 0     |
+    | (P('a')**0)**0                                    | no progress loop        | aab       | 0     |
+    | P('a')**-2 * C(P(1))                              | at most 2               | aaab      | 0     |
+    | P('a')**[2] * Cp()                                | exactly 2               | aaab      | 0     |
+    | -P('a') * C(1)                                    | not pattern             | bab       | 0     |
+    | ~C(P('b')) * P(1)                                 | look ahead captures     | bab       | 0     |
+    | Cg(C(1)*Cc('x'))**1 / 1                           | nth capture             | abc       | 0     |
+    | C(1)**1 / join('-')                               | function capture        | abc       | 0     |
+    | Cl()*(P(1)-SOL())**0*P(1)*Col()                   | line and column         | ab\ncd    | 2     |
+    | Cb('q', S('ab')) * P('-') * Cb('q')               | back capture            | a-a       | 0     |
+    | Cb('q', S('ab')) * P('-') * Cb('q')               | back capture fails      | a-b       | 0     |
+    | Sc('s', C(1)) * Sm('s') * Ssz('s')                | stack patterns          | aab       | 0     |
+    | (R('az') + S('_$') + P('0'))**1                   | character class         | ab_$0-1   | 0     |
+    | (R('09') + P('ab'))**1                            | not a class             | 1ab2      | 0     |
+    | (P('ab') + P('a'))**0 * P(-2)                     | regular expression      | ababa     | 0     |
+    | ((SOL() * S('ab')) + '\n')**1 * EOL()             | regular anchors         | a\nb      | 0     |
+    | (P('if')*Cc('kw') + C(R('az')**1) + C(P(1)))**0   | FIRST set prediction    | if x1     | 0     |
+    | C(Keywords(['for', 'fork', 'f']))**0              | keyword table           | forkfo    | 0     |
+    | C(P('in') + P('import') + P('i'))**0              | keyword choice          | importin  | 0     |
+    | C((1 - S(' '))**1) * ' ' * C((R('az') - 'x')**-2) | character scan          | ab cd     | 0     |
+    | C(matchUntil(P('*/') + '--', True)) * C(1)        | text until a terminator | ab--c     | 0     |
+    | P('if')*Cut()*' '*C(R('az')**1) + C(R('az')**1)   | cut commits to choice   | ifx       | 0     |
+    | (C(R('az'))*Cut()*P(';'))**0 * C(P(1))            | cut in a loop           | a;b;1     | 0     |
+    | (C(R('az'))*Cut()*P(';'))**0 * C(P(1))            | cut in a failed loop    | a;bc      | 0     |
+    | -(P('a')*Cut()*P('b')) * C(1) + C(P(2))           | cut in a predicate      | ac        | 0     |
+
+#-------------------------------------------------------------------------------
+Scenario: Grammars are loaded from the cache until the grammar changes.
+  Given a grammar module that builds C(R('09')**1)
+  When  the grammar is loaded with cachedGrammar
+  Then  the grammar was built 1 time(s)
+  And   the grammar matches '42ab' with captures ['42']
+  When  the grammar is loaded with cachedGrammar
+  Then  the grammar was built 1 time(s)
+  And   the grammar matches '42ab' with captures ['42']
+  When  the grammar module is changed to build C(R('az')**1)
+  And   the grammar is loaded with cachedGrammar
+  Then  the grammar was built 2 time(s)
+  And   the grammar matches 'ab42' with captures ['ab']
+
+#-------------------------------------------------------------------------------
+Scenario Outline: Streams give the same matches as the whole string.
+  Given p = <pattern> [<desc>]
+  When  the matches of p are read from a <source> of <subject> in chunks of <size>
+  Then  the matches should be the same as the matches in the whole string
+
+  Examples:
+    | pattern                             | desc               | source   | subject                         | size |
+    | C((1-newline)**0) * newline         | lines              | file     | 'ab\ncd\n\nef\n'                | 3    |
+    | C((1-newline)**0) * newline         | record over window | file     | 'x'*100 + '\nshort\n'           | 8    |
+    | C((1-newline)**0) * newline         | bytes records      | file     | b'x'*100 + b'\nab\ncd\n'        | 8    |
+    | C((1-newline)**0) * newline         | records in chunks  | iterator | 'x'*50 + '\nab\n' + 'y'*30      | 4    |
+    | C(alpha**1) * ';' * Cp() * Cl()     | positions          | file     | 'ab;cde;\nf;' + 'g'*40 + ';'    | 4    |
+    | (C(alpha)**1 / join('-')) * newline | joined bytes       | iterator | b'ab\ncd\nefg\n'                | 2    |
+    | C((1-newline)**0) * newline         | empty bytes chunks | lines    | b'ab\n' + b'cd\n'               | 4    |
+    | C((1-newline)**0) * newline         | bytearray records  | iterator | bytearray(b'ab\ncd\n' + b'x'*9) | 4    |
+
+#-------------------------------------------------------------------------------
+Scenario Outline: Left recursive grammars are matched by growing a seed. The
+  grammar is analyzed from its first rule, which is the head of each cycle.
+  Matching from another V object of a cycle does not grow its own seed.
+  Given the grammar <grammar> [<desc>]
+  When  rule <rule> is matched against '<string>'
+  Then  match.end should be <end>
+  And   captures should be <captures>
+
+  Examples:
+    | grammar                                                                            | desc                   | rule | string      | end | captures                                      |
+    | E = Cg(E*C(S('+-'))*C(digit**1)) + C(digit**1)                                     | direct recursion       | E    | 1+2-3       | 5   | [[['1','+','2'],'-','3']]                     |
+    | E = Cg(E*C(S('+-'))*C(digit**1)) + C(digit**1)                                     | seed only              | E    | 7+          | 1   | ['7']                                         |
+    | I = Cg(J*C('x')) + C('a'); J = Cg(I*C('y')) + C('b')                               | indirect recursion     | I    | ayxyx       | 5   | [[[[['a','y'],'x'],'y'],'x']]                 |
+    | I = Cg(J*C('x')) + C('a'); J = Cg(I*C('y')) + C('b')                               | from the other V       | J    | ayxy        | 4   | [[[['a','y'],'x'],'y']]                       |
+    | E = Cg(E*C('+')*T) + T; T = Cg(T*C('*')*F) + F; F = C(digit) + '(' * E * ')'       | nested cycles          | E    | 1+2*(3+4)*5 | 11  | [['1','+',[['2','*',['3','+','4']],'*','5']]] |
+    | I = Cg(J*C('y')) + Cg(J*C('x')) + C('b'); J = Cg(I*C('x')) + Cg(I*C('y')) + C('b') | non-head V stops early | J    | bya         | 1   | ['b']                                         |
+
+#-------------------------------------------------------------------------------
+Scenario Outline: Matching in worker processes gives the same results as matching
+  each subject.
+  Given p = <pattern> [<desc>]
+  When  matchMany(p, <subjects>, workers=<workers>, ordered=<ordered>) is called
+  Then  the results should be the same as p.match for each subject
+
+  Examples:
+    | pattern                           | desc              | subjects                        | workers | ordered |
+    | C(alpha**1) * Cp()                | in this process   | ['ab1', '1', 'cd']              | 0       | True    |
+    | C(alpha**1) * Cp()                | worker processes  | ['ab1', '1', 'cd', '', 'efg']   | 2       | True    |
+    | (Cg(C(alpha)*C(digit)))**1        | capture groups    | ['a1b2', 'x', 'c3']             | 2       | True    |
+    | Cb('q', C(alpha)) * '-' * Cb('q') | back captures     | ['a-a', 'a-b', 'b-b']           | 2       | True    |
+    | C(alpha**1) * Cl()                | bytes subjects    | [b'ab', b'1', bytearray(b'cd')] | 2       | True    |
+    | C(alpha**1)                       | unordered results | ['ab', 'cd', '1', 'ef']         | 2       | False   |
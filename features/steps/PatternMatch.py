@@ -1,6 +1,10 @@
+import io, os, shutil, sys, tempfile
 from behave import given, when, then
+import PyPE.PyPE
 from PyPE.PyPE import Match
-from PyPE import P, S, R, SOL, EOL, Cc, C, Cp, Cg
+from PyPE import P, S, R, V, SOL, EOL, Cc, C, Cp, Cg, Cl, Col, Cb, Sc, Sm, Ssz, \
+                 join, Keywords, matchUntil, Cut, cachedGrammar, StreamString, \
+                 matchMany, alpha, digit, newline
 from hamcrest import assert_that, equal_to, none, not_none
 
 # ******************************************************************************
@@ -11,19 +15,139 @@ from hamcrest import assert_that, equal_to, none, not_none
 def step_impl(context, pattern, desc):
   context.p = eval(pattern)
 
+# ==============================================================================
+kept = []
+
+def keep(match):
+  # A function for patterns that keeps the matches it is given
+  kept.append(match)
+  return match
+
+@given("the function keep saves the matches it is given")
+def step_impl(context):
+  del kept[:]
+
+# ==============================================================================
+@given("the grammar {grammar} [{desc}]")
+def step_impl(context, grammar, desc):
+  # Rules of the form "name = pattern", separated by semicolons
+  rules = [rule.split('=', 1) for rule in grammar.split(';')]
+  names = dict(globals())
+  context.rules = rules = [(V(name.strip()), pattern) for name, pattern in rules]
+  names.update((v.name, v) for v, pattern in rules)
+  for v, pattern in rules: v.setPattern(eval(pattern, names))
+  # The first rule is analyzed first, so it is the head of its cycles
+  rules[0][0].isLeftRecursive()
+
+# ==============================================================================
+GRAMMAR_MODULE = """
+import os
+from PyPE import C, R
+
+def build():
+  # Count the builds in a file next to the module
+  with open(os.path.join(os.path.dirname(__file__), 'builds.txt'), 'a') as file:
+    file.write('build\\n')
+  return {0}
+"""
+
+def writeGrammarModule(context, pattern):
+  with open(os.path.join(context.grammarDir, 'cachedGrammarModule.py'), 'w') as file:
+    file.write(GRAMMAR_MODULE.format(pattern))
+
+# ==============================================================================
+@given("a grammar module that builds {pattern}")
+def step_impl(context, pattern):
+  context.grammarDir = tempfile.mkdtemp()
+  context.add_cleanup(shutil.rmtree, context.grammarDir)
+  writeGrammarModule(context, pattern)
+
 # ******************************************************************************
 # When
 # ******************************************************************************
-@when("p.match('{text}',{index}) is called")
-def step_impl(context, text, index):
+def unescape(text):
   # Convert escaped values in text to the unescaped value
   try:
-    text = text.decode('string-escape')
+    return text.decode('string-escape')
   except AttributeError:
-    text = bytes(text,'utf8').decode('unicode_escape')
+    return bytes(text,'utf8').decode('unicode_escape')
+
+# ==============================================================================
+@when("p.match('{text}',{index}) is called")
+def step_impl(context, text, index):
+  text = unescape(text)
   context.match = context.p.match(text, int(index))
   pass
 
+# ==============================================================================
+@when("p.compile().match('{text}',{index}) is called")
+def step_impl(context, text, index):
+  context.match = context.p.compile().match(unescape(text), int(index))
+
+# ==============================================================================
+@when("matchMany(p, {subjects}, workers={workers}, ordered={ordered}) is called")
+def step_impl(context, subjects, workers, ordered):
+  context.subjects = eval(subjects)
+  results = matchMany(context.p, context.subjects, workers=int(workers),
+                      ordered=eval(ordered))
+  if eval(ordered):
+    context.results = list(zip(context.subjects, results))
+  else:
+    # Sort the (subject, result) pairs in the order of the subjects
+    context.results = sorted(results, key=lambda pair: context.subjects.index(pair[0]))
+
+# ==============================================================================
+@when("rule {name} is matched against '{text}'")
+def step_impl(context, name, text):
+  rule = [v for v, pattern in context.rules if v.name == name][0]
+  context.match = rule.match(unescape(text))
+
+# ==============================================================================
+@when("the grammar module is changed to build {pattern}")
+def step_impl(context, pattern):
+  writeGrammarModule(context, pattern)
+
+# ==============================================================================
+@when("the grammar is loaded with cachedGrammar")
+def step_impl(context):
+  # Load the module and the grammar as a new process would
+  PyPE.PyPE._loadedGrammars.clear()
+  sys.modules.pop('cachedGrammarModule', None)
+  sys.path.insert(0, context.grammarDir)
+  dontWriteBytecode, sys.dont_write_bytecode = sys.dont_write_bytecode, True
+  try:
+    module = __import__('cachedGrammarModule')
+  finally:
+    sys.path.remove(context.grammarDir)
+    sys.dont_write_bytecode = dontWriteBytecode
+  context.p = cachedGrammar(module.build, os.path.join(context.grammarDir, 'cache'))
+
+# ==============================================================================
+def matchResults(matches):
+  # The captures of bytes subjects are compared as bytes
+  def value(capture):
+    return bytes(capture) if isinstance(capture, memoryview) else capture
+  return [(match.start, match.end, [value(capture) for capture in match.captures])
+          for match in matches]
+
+# ==============================================================================
+@when("the matches of p are read from a {source} of {subject} in chunks of {size}")
+def step_impl(context, source, subject, size):
+  context.subject = eval(subject)
+  size = int(size)
+  if source == 'file':
+    file = io.BytesIO if isinstance(context.subject, bytes) else io.StringIO
+    stream = StreamString(file(context.subject), chunkSize=size)
+  elif source == 'iterator':
+    chunks = [context.subject[i:i+size] for i in range(0, len(context.subject), size)]
+    stream = StreamString(iter(chunks), chunkSize=size)
+  else:
+    # Lines with empty chunks between them
+    empty = context.subject[:0]
+    chunks = [item for line in context.subject.splitlines(True) for item in (line, empty)]
+    stream = StreamString(iter([empty] + chunks), chunkSize=size)
+  context.matches = matchResults(stream.matches(context.p))
+
 # ******************************************************************************
 # Then
 # ******************************************************************************
@@ -73,4 +197,58 @@ def step_impl(context, pattern):
 @then("captures should be {captures}")
 def step_impl(context, captures):
   captures = eval(captures)
-  assert_that(context.match.captures, equal_to(captures))
\ No newline at end of file
+  assert_that(context.match.captures, equal_to(captures))
+
+# ==============================================================================
+@then("the kept matches should have captures {captures}")
+def step_impl(context, captures):
+  assert_that([match.captures for match in kept], equal_to(eval(captures)))
+
+# ==============================================================================
+@then("the result should be the same as p.match('{text}',{index})")
+def step_impl(context, text, index):
+  expected = context.p.match(unescape(text), int(index))
+  if expected is None:
+    assert_that(context.match, none())
+  else:
+    assert_that(context.match, not_none())
+    assert_that((context.match.start, context.match.end), equal_to((expected.start, expected.end)))
+    assert_that(context.match.captures, equal_to(expected.captures))
+
+# ==============================================================================
+@then("the grammar was built {count} time(s)")
+def step_impl(context, count):
+  with open(os.path.join(context.grammarDir, 'builds.txt')) as file:
+    assert_that(len(file.readlines()), equal_to(int(count)))
+
+# ==============================================================================
+@then("the grammar matches '{text}' with captures {captures}")
+def step_impl(context, text, captures):
+  match = context.p.match(text)
+  assert_that(match, not_none())
+  assert_that(match.captures, equal_to(eval(captures)))
+
+# ==============================================================================
+@then("the matches should be the same as the matches in the whole string")
+def step_impl(context):
+  matches = []
+  index = 0
+  while True:
+    match = context.p.match(context.subject, index)
+    if not isinstance(match, Match): break
+    matches.append(match)
+    if match.end == index: break
+    index = match.end
+  assert_that(context.matches, equal_to(matchResults(matches)))
+  assert_that(len(context.matches), equal_to(len(matches)))
+
+# ==============================================================================
+@then("the results should be the same as p.match for each subject")
+def step_impl(context):
+  assert_that([subject for subject, result in context.results], equal_to(context.subjects))
+  for subject, result in context.results:
+    expected = context.p.match(subject)
+    if expected is None:
+      assert_that(result, none())
+    else:
+      assert_that(matchResults([result]), equal_to(matchResults([expected])))